@@ -0,0 +1,76 @@
+# Compare worker startup with the compressed NPZ features file vs. the memory-mapped artifact directory
+# Usage (from backend/): python -m benchmarks.bench_artifacts --rows 2000000
+import argparse, os, subprocess, sys, tempfile, time
+import numpy as np
+from recommend_api.services.artifacts import save_artifacts
+from recommend_api.services.columns import CategoricalColumn
+from recommend_api.services.mbid_index import build_mbid_index, encode_mbids
+from recommend_api.services.partitions import PartitionIndex
+from recommend_api.services.quantize import QuantizedMatrix
+from recommend_api.services.scoring import row_norms
+from .synthetic import make_catalogue
+
+
+def export(n: int) -> dict:
+    """Synthetic catalogue with the same arrays `build_database` exports."""
+    data = make_catalogue(n)
+    data["feature_matrix_sq"] = np.square(data["feature_matrix"])
+    data["feature_norms"] = row_norms(data["feature_matrix_sq"])
+    data["mbids"] = encode_mbids(data["mbids"])
+    data["mbid_keys"], data["mbid_rows"] = build_mbid_index(data["mbids"])
+    for prefix, name in [("ros", "genre_rosamerica"), ("dortmund", "genre_dortmund")]:
+        genres = data.pop(name)
+        data.update(PartitionIndex.build(genres, data["years"]).to_arrays(prefix))
+        data.update(CategoricalColumn.encode(genres).to_arrays(name))
+    data.update(QuantizedMatrix.build(data["feature_matrix"]).to_arrays())
+    return data
+
+
+def load(path: str):
+    """Runs in a fresh process: load the features like a worker does and report time/memory."""
+    start = time.perf_counter()
+    import recommend_api.services.recommender as rec
+    from recommend_api.services.artifacts import ArtifactStore
+
+    start = time.perf_counter()
+    data = ArtifactStore(path) if os.path.isdir(path) else np.load(path, allow_pickle=True)
+    snapshot = rec.load_features(data)
+    loaded = time.perf_counter() - start
+    rec.recommend(snapshot.mbid_at(12345), {"k": 100})
+    first = time.perf_counter() - start - loaded
+
+    with open("/proc/self/status") as f:
+        status = dict(line.split(":", 1) for line in f)
+    print(f"{loaded * 1e3:.0f} {first * 1e3:.0f} {status['RssAnon'].split()[0]} {status['RssFile'].split()[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--load", type=str, default=None)
+    args = parser.parse_args()
+    if args.load:
+        return load(args.load)
+
+    data = export(args.rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        npz = os.path.join(tmp, "features_and_index.npz")
+        np.savez_compressed(npz, **data)
+        directory = os.path.join(tmp, "features")
+        save_artifacts(directory, data)
+
+        print(f"rows: {args.rows:,}")
+        for name, path in [("npz (compressed, pickled)", npz), ("artifact directory (mmap)", directory)]:
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_artifacts", "--load", path],
+                capture_output=True, text=True, check=True,
+            ).stdout.split("\n")[-2]
+            loaded, first, anon, file = (int(value) for value in out.split())
+            print(
+                f"{name:27} load {loaded:6,} ms, first recommend {first:5,} ms, "
+                f"private RSS {anon / 1024:7.1f} MiB, shared file RSS {file / 1024:7.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
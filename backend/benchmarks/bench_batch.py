@@ -0,0 +1,43 @@
+# Compare throughput of N sequential recommend() calls vs. one recommend_many() call
+# Usage (from backend/): python -m benchmarks.bench_batch --rows 2000000 --seeds 200
+import argparse, time
+import numpy as np
+import recommend_api.services.recommender as rec
+from .synthetic import make_catalogue
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--seeds", type=int, default=200)
+    args = parser.parse_args()
+
+    snapshot = rec.load_features(make_catalogue(args.rows))
+    # measure the search itself, not the result cache
+    rec.result_cache.max_bytes = 0
+    rng = np.random.default_rng(1)
+    seeds = [snapshot.mbid_at(row) for row in rng.integers(0, args.rows, args.seeds)]
+
+    print(f"rows: {args.rows:,}, seeds: {args.seeds}")
+    for name, options in [
+        ("same genre + decade", {"k": 100}),
+        ("same genre", {"k": 100, "match_decade": False}),
+        ("dortmund genre + decade", {"k": 100, "use_ros": False}),
+    ]:
+        start = time.perf_counter()
+        for mbid in seeds:
+            rec.recommend(mbid, options)
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rec.recommend_many(seeds, options)
+        batched = time.perf_counter() - start
+
+        print(
+            f"{name:25} sequential {args.seeds / sequential:8.1f} seeds/s, "
+            f"batch {args.seeds / batched:8.1f} seeds/s ({sequential / batched:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
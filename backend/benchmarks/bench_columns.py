@@ -0,0 +1,47 @@
+# Compare string metadata columns (object arrays) vs. dictionary-encoded genres and binary MBIDs:
+# memory of the columns and the cost of building a genre mask / resolving excluded MBIDs
+# Usage (from backend/): python -m benchmarks.bench_columns --rows 2000000
+import argparse, sys
+import numpy as np
+from recommend_api.services.columns import CategoricalColumn
+from recommend_api.services.mbid_index import build_mbid_index, encode_mbids, lookup_many
+from .bench_partitions import best_of
+from .synthetic import make_catalogue
+
+
+def object_bytes(array) -> int:
+    """Size of an object array including the Python objects it points to."""
+    return array.nbytes + sum(sys.getsizeof(value) for value in set(array.tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    data = make_catalogue(args.rows)
+    mbids, genres = data["mbids"], data["genre_rosamerica"]
+    mbid_keys = encode_mbids(mbids)
+    keys, rows = build_mbid_index(mbid_keys)
+    column = CategoricalColumn.encode(genres)
+    exclude = list(mbids[:: args.rows // 50])
+
+    # object arrays share repeated genre strings, every MBID is its own string
+    print(f"rows: {args.rows:,}")
+    print(f"{'mbids object array':34} {object_bytes(mbids) / 2**20:8.1f} MiB")
+    print(f"{'mbids 16-byte keys':34} {mbid_keys.nbytes / 2**20:8.1f} MiB")
+    print(f"{'genre object array':34} {object_bytes(genres) / 2**20:8.1f} MiB")
+    print(f"{'genre codes + vocabulary':34} {(column.codes.nbytes + column.vocabulary.nbytes) / 2**20:8.1f} MiB")
+
+    code = column.code_of("roc")
+    for name, fn in [
+        ("genre == 'roc', object array", lambda: genres == "roc"),
+        ("genre == code, uint8 codes", lambda: column.codes == code),
+        ("exclude 50 MBIDs, np.isin strings", lambda: np.isin(mbids, exclude)),
+        ("exclude 50 MBIDs, key lookup", lambda: lookup_many(keys, rows, exclude)),
+    ]:
+        print(f"{name:34} {best_of(fn, repeat=5) * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
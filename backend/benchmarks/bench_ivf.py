@@ -0,0 +1,34 @@
+# Recall@k and latency of the IVF engine against exact search on a synthetic catalogue
+# Usage (from backend/): python -m benchmarks.bench_ivf --rows 2000000 --seeds 100
+import argparse, time
+import numpy as np
+import recommend_api.services.recommender as rec
+from recommend_api.services.ivf import IVFIndex
+from ingest.management.commands.evaluate_ann import evaluate_ann, format_row
+from .synthetic import make_catalogue
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--seeds", type=int, default=100)
+    parser.add_argument("--k", type=int, default=100)
+    args = parser.parse_args()
+
+    data = make_catalogue(args.rows)
+    start = time.perf_counter()
+    ivf_index = IVFIndex.build(data["feature_matrix"])
+    print(f"IVF build: {time.perf_counter() - start:.1f} s, {ivf_index.nlist} lists")
+    snapshot = rec.load_features({**data, **ivf_index.to_arrays()})
+    # measure the search itself, not the result cache
+    rec.result_cache.max_bytes = 0
+
+    rng = np.random.default_rng(1)
+    seeds = [snapshot.mbid_at(row) for row in rng.integers(0, args.rows, args.seeds)]
+    print(f"rows: {args.rows:,}, seeds: {args.seeds}, k: {args.k}, no genre/decade filter")
+    for row in evaluate_ann(seeds, [1, 4, 8, 16, 32], {"k": args.k, "match_genre": False, "match_decade": False}):
+        print(format_row(row))
+
+
+if __name__ == "__main__":
+    main()
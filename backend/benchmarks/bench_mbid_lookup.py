@@ -0,0 +1,40 @@
+# Compare MBID -> row lookups: linear scan over the MBID strings vs. the sorted 16-byte key index
+# Usage (from backend/): python -m benchmarks.bench_mbid_lookup --rows 2000000
+import argparse, time
+import numpy as np
+from recommend_api.services.mbid_index import build_mbid_index, lookup
+from .synthetic import random_mbids
+
+
+def time_per_call(fn, queries, repeat: int = 1) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            fn(query)
+    return (time.perf_counter() - start) / (len(queries) * repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    mbids = random_mbids(args.rows)
+    rng = np.random.default_rng(1)
+    queries = list(mbids[rng.integers(0, args.rows, args.queries)])
+
+    start = time.perf_counter()
+    keys, rows = build_mbid_index(mbids)
+    build_time = time.perf_counter() - start
+
+    scan = time_per_call(lambda m: int(np.where(mbids == m)[0][0]), queries)
+    indexed = time_per_call(lambda m: lookup(keys, rows, m), queries, repeat=100)
+
+    print(f"rows: {args.rows:,}, index build: {build_time:.2f}s, index size: {keys.nbytes + rows.nbytes:,} bytes")
+    print(f"np.where scan: {scan * 1e3:9.3f} ms/lookup")
+    print(f"sorted index:  {indexed * 1e3:9.3f} ms/lookup ({scan / indexed:,.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
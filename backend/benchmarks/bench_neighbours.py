@@ -0,0 +1,74 @@
+# Default-option requests answered from the precomputed neighbour graph vs scanning the partition
+# Usage (from backend/): python -m benchmarks.bench_neighbours --rows 200000 --seeds 500
+import argparse, time
+import numpy as np
+import recommend_api.services.recommender as rec
+from dataclasses import replace
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.neighbours import NeighbourGraph, default_workers
+from .synthetic import make_catalogue, random_artists
+
+
+def latencies(seeds, options) -> np.ndarray:
+    """Wall time of each request in ms."""
+    timings = []
+    for mbid in seeds:
+        start = time.perf_counter()
+        rec.recommend(mbid, options)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--seeds", type=int, default=500)
+    parser.add_argument("--k", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    args = parser.parse_args()
+
+    snapshot = rec.load_features({
+        **make_catalogue(args.rows),
+        **ArtistIndex.build(random_artists(args.rows)).to_arrays(),
+    })
+    # measure the search itself, not the result cache
+    rec.result_cache.max_bytes = 0
+    start = time.perf_counter()
+    graph = NeighbourGraph.build(
+        snapshot.feature_matrix, snapshot.feature_norms, snapshot.ros_partitions, k=args.k,
+        similarity_weight=0.9, popularity_weight=0.1, popularity=snapshot.popularity,
+        workers=args.workers,
+    )
+    build_time = time.perf_counter() - start
+    size = sum(array.nbytes for array in graph.to_arrays().values())
+    print(
+        f"rows: {args.rows:,}, k: {args.k}, built with {args.workers} workers in "
+        f"{build_time:.1f} s, {size / 2**20:,.0f} MB"
+    )
+
+    rng = np.random.default_rng(1)
+    seeds = [snapshot.mbid_at(row) for row in rng.integers(0, args.rows, args.seeds)]
+    listened = [snapshot.mbid_at(row) for row in rng.integers(0, args.rows, 50)]
+    api_defaults = {"k": 10, "diversify": True, "similarity_weight": 0.9, "popularity_weight": 0.1}
+    for name, options in [
+        ("defaults", api_defaults),
+        ("defaults + 50 listened", {**api_defaults, "exclude_mbids": listened}),
+        ("limit 50", {**api_defaults, "k": 50}),
+    ]:
+        rec.publish(snapshot)
+        scan = latencies(seeds, options)
+        rec.publish(replace(snapshot, neighbour_graph=graph))
+        from_graph = latencies(seeds, options)
+        answered = sum(
+            rec.recommend(mbid, options)["stats"]["engine"] == "graph" for mbid in seeds
+        )
+        print(
+            f"{name:24} partition scan p50 {np.percentile(scan, 50):6.2f} ms "
+            f"p99 {np.percentile(scan, 99):6.2f} ms   graph p50 "
+            f"{np.percentile(from_graph, 50):6.2f} ms p99 {np.percentile(from_graph, 99):6.2f} ms"
+            f"   answered from the graph: {answered / len(seeds):6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
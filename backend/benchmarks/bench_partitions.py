@@ -0,0 +1,52 @@
+# Compare candidate selection: boolean mask over the whole catalogue vs. (genre, decade) partitions
+# Usage (from backend/): python -m benchmarks.bench_partitions --rows 2000000
+import argparse, time
+import numpy as np
+from recommend_api.services.partitions import PartitionIndex, decade_of
+from .synthetic import make_catalogue
+
+
+def best_of(fn, repeat: int = 20) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    data = make_catalogue(args.rows)
+    # store the matrix in Rosamerica partition order, like build_database does
+    order = PartitionIndex.build(data["genre_rosamerica"], data["years"]).order
+    for name in ["feature_matrix", "years", "genre_rosamerica", "genre_dortmund"]:
+        data[name] = data[name][order]
+    fm, years = data["feature_matrix"], data["years"]
+    ros = PartitionIndex.build(data["genre_rosamerica"], years)
+    dortmund = PartitionIndex.build(data["genre_dortmund"], years)
+
+    target = int(np.flatnonzero((data["genre_rosamerica"] == "roc") & (years // 10 == 199))[0])
+    genre_r, genre_d = data["genre_rosamerica"][target], data["genre_dortmund"][target]
+    decade = int(decade_of(years[target]))
+
+    def mask_select(genres, genre):
+        mask = (years >= decade) & (years < decade + 10) & (genres == genre)
+        return fm[mask]
+
+    cases = [
+        ("rosamerica mask + gather", lambda: mask_select(data["genre_rosamerica"], genre_r)),
+        ("rosamerica partition slice", lambda: fm[ros.rows(genre=genre_r, decade=decade)]),
+        ("dortmund mask + gather", lambda: mask_select(data["genre_dortmund"], genre_d)),
+        ("dortmund partition gather", lambda: fm[dortmund.rows(genre=genre_d, decade=decade)]),
+    ]
+    print(f"rows: {args.rows:,}, partitions: {len(ros.genres)} rosamerica / {len(dortmund.genres)} dortmund")
+    for name, fn in cases:
+        print(f"{name:30} {best_of(fn) * 1e3:9.3f} ms ({len(fn()):,} candidates)")
+
+
+if __name__ == "__main__":
+    main()
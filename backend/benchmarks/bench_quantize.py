@@ -0,0 +1,55 @@
+# Compare recommend() on scattered candidate rows: float32 scan vs. int8 first pass + exact re-rank
+# Usage (from backend/): python -m benchmarks.bench_quantize --rows 2000000 --seeds 50
+import argparse
+import numpy as np
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services.partitions import PartitionIndex
+from .bench_partitions import best_of
+from .synthetic import make_catalogue
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--seeds", type=int, default=50)
+    args = parser.parse_args()
+
+    data = make_catalogue(args.rows)
+    # store the matrix in Rosamerica partition order, like build_database does
+    order = PartitionIndex.build(data["genre_rosamerica"], data["years"]).order
+    for name in ["feature_matrix", "years", "genre_rosamerica", "genre_dortmund", "mbids"]:
+        data[name] = data[name][order]
+    snapshot = rec.load_features(data)
+    # measure the search itself, not the result cache
+    rec.result_cache.max_bytes = 0
+
+    rng = np.random.default_rng(1)
+    seeds = [snapshot.mbid_at(row) for row in rng.integers(0, args.rows, args.seeds)]
+    matrix_mib = snapshot.feature_matrix.nbytes / 2**20
+    codes_mib = snapshot.quantized_matrix.codes.nbytes / 2**20
+    print(f"rows: {args.rows:,}, seeds: {args.seeds}, float32 {matrix_mib:.1f} MiB, int8 {codes_mib:.1f} MiB")
+
+    for name, options in [
+        ("dortmund genre + decade", {"k": 100, "use_ros": False}),
+        ("dortmund genre", {"k": 100, "use_ros": False, "match_decade": False}),
+        ("rosamerica decade", {"k": 100, "match_genre": False}),
+        ("dortmund genre, weighted", {"k": 100, "use_ros": False, "feature_weights": {"happiness": 2}}),
+    ]:
+        run = lambda: [rec.recommend(mbid, options) for mbid in seeds]
+        quantized = best_of(run, repeat=3) / len(seeds)
+        results = run()
+        with patch.object(snapshot, "quantized_matrix", None):
+            exact = best_of(run, repeat=3) / len(seeds)
+            same = all(
+                [t["mbid"] for t in q["top_tracks"]] == [t["mbid"] for t in e["top_tracks"]]
+                for q, e in zip(results, run())
+            )
+        print(
+            f"{name:26} float32 {exact * 1e3:7.2f} ms, int8 + re-rank {quantized * 1e3:7.2f} ms "
+            f"({exact / quantized:.1f}x), same top-k: {same}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Request latency while a new feature file version is published and hot-swapped
+# Usage (from backend/): python -m benchmarks.bench_reload --rows 2000000
+import argparse, os, tempfile, threading, time
+import numpy as np
+import recommend_api.services.recommender as rec
+from recommend_api.services.artifacts import save_artifacts
+from .bench_artifacts import export
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--seconds", type=float, default=20)
+    args = parser.parse_args()
+
+    data = export(args.rows)
+    # measure the search itself, not the result cache
+    rec.result_cache.max_bytes = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, "features")
+        save_artifacts(directory, data)
+        rec.DEFAULT_DIRECTORY, rec.RELOAD_CHECK_INTERVAL = directory, 0.5
+
+        snapshot = rec.get_snapshot()
+        rng = np.random.default_rng(1)
+        seeds = [snapshot.mbid_at(row) for row in rng.integers(0, args.rows, 200)]
+
+        # serve requests in a loop, remember (time, latency, version) of each one
+        samples, stop = [], threading.Event()
+
+        def serve():
+            i = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                rec.recommend(seeds[i % len(seeds)], {"k": 100})
+                samples.append((start, time.perf_counter() - start, rec.get_snapshot().version))
+                i += 1
+
+        worker = threading.Thread(target=serve)
+        worker.start()
+        time.sleep(args.seconds / 2)
+
+        # publish a new catalogue version under load
+        data["years"] = data["years"].copy()
+        data["years"][0] += 1
+        published = time.perf_counter()
+        version = save_artifacts(directory, data)
+        print(f"published version {version} in {time.perf_counter() - published:.1f} s")
+        time.sleep(args.seconds / 2)
+        stop.set()
+        worker.join()
+
+    latencies = np.array([latency for _, latency, _ in samples]) * 1e3
+    swapped = [i for i, (_, _, v) in enumerate(samples) if v == version]
+    print(f"requests: {len(samples):,}, served by new version: {len(swapped):,}")
+    for name, part in [
+        ("before publish", latencies[[i for i, s in enumerate(samples) if s[0] < published]]),
+        ("after publish", latencies[[i for i, s in enumerate(samples) if s[0] >= published]]),
+        ("first 20 after swap", latencies[swapped[:20]]),
+    ]:
+        print(
+            f"{name:22} p50 {np.percentile(part, 50):7.2f} ms   p99 {np.percentile(part, 99):7.2f} ms   "
+            f"max {part.max():7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
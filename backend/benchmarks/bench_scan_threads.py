@@ -0,0 +1,45 @@
+# Scaling of the parallel scan of unfiltered queries from 1 to N threads
+# Usage (from backend/): python -m benchmarks.bench_scan_threads --rows 2000000 --max-threads 16
+# Set OPENBLAS_NUM_THREADS=1 (or MKL_NUM_THREADS=1) so the BLAS library doesn't start its own
+# threads inside each shard's matvec.
+import argparse, os
+import numpy as np
+import recommend_api.services.recommender as rec
+from .bench_partitions import best_of
+from .synthetic import make_catalogue
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--seeds", type=int, default=20)
+    parser.add_argument("--max-threads", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-sizes", type=int, nargs="+", default=[65_536, 262_144])
+    args = parser.parse_args()
+
+    snapshot = rec.load_features(make_catalogue(args.rows))
+    # measure the search itself, not the result cache
+    rec.result_cache.max_bytes = 0
+    rng = np.random.default_rng(1)
+    seeds = [snapshot.mbid_at(row) for row in rng.integers(0, args.rows, args.seeds)]
+    options = {"k": 100, "match_genre": False, "match_decade": False}
+
+    threads = sorted({1, *[2**i for i in range(args.max_threads.bit_length())], args.max_threads})
+    threads = [t for t in threads if t <= args.max_threads]
+    print(f"rows: {args.rows:,}, cores: {os.cpu_count()}")
+    for shard_size in args.shard_sizes:
+        baseline = None
+        for count in threads:
+            rec.configure_scan(threads=count, shard_size=shard_size)
+            timing = best_of(lambda: [rec.recommend(mbid, options) for mbid in seeds], repeat=5)
+            timing /= len(seeds)
+            baseline = baseline or timing
+            print(
+                f"shard {shard_size:8,} rows   {count:3} threads   {timing * 1e3:7.2f} ms   "
+                f"speed-up {baseline / timing:5.2f}x"
+            )
+    rec.configure_scan(threads=1)
+
+
+if __name__ == "__main__":
+    main()
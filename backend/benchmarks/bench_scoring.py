@@ -0,0 +1,53 @@
+# Compare similarity scoring: weighted float64 copy + sklearn cosine_similarity vs. the float32 kernel
+# Usage (from backend/): python -m benchmarks.bench_scoring --rows 2000000
+import argparse, time, tracemalloc
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from recommend_api.services.scoring import feature_weights_vector, row_norms, weighted_cosine
+from .synthetic import FEATURE_NAMES, make_catalogue
+
+
+def measure(fn, repeat: int = 5):
+    """Best wall time and peak traced allocation of `fn`."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    data = make_catalogue(args.rows)
+    fm = data["feature_matrix"]
+    fm_sq = np.square(fm)
+    norms = row_norms(fm_sq)
+    query = fm[0]
+    feature_weights = {"danceability": 0.5, "aggressiveness": 0.2, "moods_mirex_3": 0.8}
+    weights = feature_weights_vector(FEATURE_NAMES, feature_weights)
+    weights_64 = np.ones(len(FEATURE_NAMES))
+    for i, name in enumerate(FEATURE_NAMES):
+        weights_64[i] = feature_weights.get(name, 1)
+
+    cases = [
+        ("sklearn, unweighted", lambda: cosine_similarity(query[None, :], fm * np.ones(len(FEATURE_NAMES))).flatten()),
+        ("kernel, unweighted", lambda: weighted_cosine(query, fm, fm_sq, candidate_norms=norms)),
+        ("sklearn, weighted", lambda: cosine_similarity(query[None, :], fm * weights_64).flatten()),
+        ("kernel, weighted", lambda: weighted_cosine(query, fm, fm_sq, weights=weights)),
+    ]
+    print(f"candidates: {args.rows:,} x {len(FEATURE_NAMES)} features")
+    for name, fn in cases:
+        seconds, peak = measure(fn)
+        print(f"{name:22} {seconds * 1e3:9.2f} ms  peak {peak / 2**20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
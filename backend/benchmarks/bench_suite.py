@@ -0,0 +1,279 @@
+# Latency and peak allocation of `recommend()` over a matrix of options and catalogue sizes, as JSON
+# Usage (from backend/): python -m benchmarks.bench_suite --rows 100000 1000000 2000000 \
+#     --output baseline.json [--compare previous.json] [--deltas 4] [--ivf]
+import argparse, itertools, json, os, platform, subprocess, sys, time, tracemalloc
+import numpy as np
+from functools import partial
+import recommend_api.services.recommender as rec
+from recommend_api.services import timings
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.columns import hash_strings
+from recommend_api.services.ivf import IVFIndex
+from recommend_api.services.mbid_index import key_to_mbid
+from recommend_api.services.partitions import PartitionIndex
+from .synthetic import make_catalogue, random_artists
+
+# The option matrix, every combination is a case
+FILTERS = {
+    "genre+decade": {},
+    "decade": {"match_genre": False},
+    "dortmund": {"use_ros": False},
+    "unfiltered": {"match_genre": False, "match_decade": False},
+}
+EXCLUDE_SIZES = [0, 50, 1000]
+WEIGHTS = {
+    "none": {},
+    "weighted": {"danceability": 2.0, "acousticness": 0.5, "moods_mirex_3": 0.0},
+}
+K_VALUES = [10, 100]
+# Options outside the matrix, each one is a case of its own over FEATURE_FILTERS with k=10. Sizes
+# are filled in with random MBIDs per request, "seed_count" requests a taste profile of that many
+# seeds, "result_cache" asks every seed twice with the cache on, "debug_timings" times the phases
+FEATURE_FILTERS = {
+    "genre+decade": {},
+    "unfiltered": {"match_genre": False, "match_decade": False},
+}
+FEATURES = {
+    "stats=none": {"stats": "none"},
+    "stats=exact": {"stats": "exact"},
+    "exclude_artists=20": {"exclude_artists": 20},
+    "diversify": {"diversify": True},
+    "popularity": {"similarity_weight": 0.9, "popularity_weight": 0.1},
+    "budget=25ms": {"budget_ms": 25},
+    "disliked=10": {"disliked_mbids": 10},
+    "profile=centroid/seeds=20": {"profile": "centroid", "seed_count": 20},
+    "profile=max/seeds=20": {"profile": "max", "seed_count": 20},
+    "result_cache": {"result_cache": True},
+    "debug_timings": {"debug_timings": True},
+}
+# Share of the catalogue in each delta segment with `--deltas`
+DELTA_SHARE = 0.01
+# Requests traced with tracemalloc per case, tracing slows numpy down so they aren't timed
+TRACED_REQUESTS = 5
+
+
+def build_snapshot(rows: int, seed: int = 0, deltas: int = 0, ivf: bool = False):
+    """
+    A synthetic catalogue stored like `build_database` exports it: rows sorted by (Rosamerica
+    genre, decade), with the artist index and title hashes.
+
+    Args:
+        rows (int): Number of tracks.
+        seed (int): Random seed of the catalogue.
+        deltas (int): Number of delta segments published after the base, each one holding
+            DELTA_SHARE of the tracks.
+        ivf (bool): Build an IVF index over the base.
+    """
+    data = make_catalogue(rows, seed)
+    artists = random_artists(rows, seed)
+    rng = np.random.default_rng(seed)
+    # about 1 in 4 tracks shares its title with another one, like covers and re-releases
+    titles = [f"title {i}" for i in rng.integers(0, int(rows * 0.75), rows)]
+    order = PartitionIndex.build(data["genre_rosamerica"], data["years"]).order
+    if order is not None:
+        data = {name: array if name == "feature_names" else array[order]
+                for name, array in data.items()}
+        artists = [artists[row] for row in order]
+        titles = [titles[row] for row in order]
+
+    def segment(selected):
+        arrays = {name: array if name == "feature_names" else array[selected]
+                  for name, array in data.items()}
+        arrays.update(ArtistIndex.build([artists[row] for row in selected]).to_arrays())
+        arrays["title_hashes"] = hash_strings([titles[row] for row in selected])
+        return arrays
+
+    # segment of each track, 0 for the base
+    segment_of = np.zeros(rows, dtype=np.int64)
+    delta_rows = int(rows * DELTA_SHARE)
+    picked = rng.permutation(rows)[:deltas * delta_rows]
+    segment_of[picked] = 1 + np.arange(len(picked)) // max(delta_rows, 1)
+    base = segment(np.flatnonzero(segment_of == 0))
+    if ivf:
+        base.update(IVFIndex.build(base["feature_matrix"]).to_arrays())
+    snapshot = rec.RecommenderSnapshot.load(
+        base, deltas=[segment(np.flatnonzero(segment_of == i)) for i in range(1, deltas + 1)]
+    )
+    rec.publish(snapshot)
+    return snapshot
+
+
+def cases():
+    """(name, exclude_size, options) of every combination of the option matrix, then features."""
+    for (filter_name, filters), exclude_size, (weight_name, weights), k in itertools.product(
+        FILTERS.items(), EXCLUDE_SIZES, WEIGHTS.items(), K_VALUES
+    ):
+        name = f"{filter_name}/exclude={exclude_size}/weights={weight_name}/k={k}"
+        yield name, exclude_size, {**filters, "feature_weights": weights, "k": k}
+    for (filter_name, filters), (feature, options) in itertools.product(
+        FEATURE_FILTERS.items(), FEATURES.items()
+    ):
+        yield f"{filter_name}/{feature}/k=10", 0, {**filters, **options, "k": 10}
+
+
+def random_tracks(snapshot, count, rng) -> list:
+    """MBIDs of `count` random tracks of the base."""
+    return [snapshot.mbid_at(row) for row in rng.integers(0, snapshot.row_count, count)]
+
+
+def requests(snapshot, seeds, exclude_size, options, rng) -> list:
+    """One call per seed, with its own random MBIDs for the sized options."""
+    options = dict(options)
+    seed_count = options.pop("seed_count", None)
+    debug_timings = options.pop("debug_timings", False)
+    options.pop("result_cache", None)
+    artist_keys = snapshot.artist_index.artist_keys
+    calls = []
+    for mbid in seeds:
+        # a different exclude list per request, like the listening history of different users
+        request = {**options, "exclude_mbids": random_tracks(snapshot, exclude_size, rng)}
+        if "disliked_mbids" in options:
+            request["disliked_mbids"] = random_tracks(snapshot, options["disliked_mbids"], rng)
+        if "exclude_artists" in options:
+            codes = rng.integers(0, len(artist_keys), options["exclude_artists"])
+            request["exclude_artists"] = [key_to_mbid(key) for key in artist_keys[codes]]
+        if seed_count:
+            profile_seeds = [mbid, *random_tracks(snapshot, seed_count - 1, rng)]
+            call = partial(rec.recommend_profile, profile_seeds, None, request)
+        else:
+            call = partial(rec.recommend, mbid, request)
+        calls.append(partial(timed_request, call) if debug_timings else call)
+    return calls
+
+
+def timed_request(call):
+    """A request with its phases timed, like one with `debug_timings`."""
+    with timings.collect():
+        return call()
+
+
+def run_case(snapshot, seeds, exclude_size, options, rng) -> dict:
+    """Time a request per seed, then trace the peak allocation of a few requests."""
+    calls = requests(snapshot, seeds, exclude_size, options, rng)
+    if options.get("result_cache"):
+        # the second request of each seed is answered by the cache
+        rec.result_cache.max_bytes = rec.RESULT_CACHE_MAX_BYTES
+        rec.result_cache.clear()
+        calls = calls + calls
+    try:
+        latencies = []
+        engines = {}
+        for call in calls:
+            start = time.perf_counter()
+            result = call()
+            latencies.append(time.perf_counter() - start)
+            engines[result["stats"]["engine"]] = engines.get(result["stats"]["engine"], 0) + 1
+
+        peak = 0
+        tracemalloc.start()
+        try:
+            for call in calls[:TRACED_REQUESTS]:
+                tracemalloc.reset_peak()
+                call()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    finally:
+        rec.result_cache.max_bytes = 0
+        rec.result_cache.clear()
+
+    latencies = np.array(latencies) * 1e3
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "peak_alloc_bytes": int(peak),
+        "engines": engines,
+    }
+
+
+def environment() -> dict:
+    """What the numbers were measured on, to tell comparable runs apart."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": (
+            len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        ),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline_path):
+    """Print the p50/p99 of each case next to the same case of a previous run."""
+    with open(baseline_path) as f:
+        baseline = {
+            (entry["rows"], entry["case"]): entry for entry in json.load(f)["results"]
+        }
+    print(f"compared to {baseline_path}:", file=sys.stderr)
+    for entry in results:
+        previous = baseline.get((entry["rows"], entry["case"]))
+        if previous is None:
+            continue
+        print(
+            f"{entry['rows']:>9,} {entry['case']:50} "
+            f"p50 {previous['p50_ms']:8.2f} -> {entry['p50_ms']:8.2f} ms "
+            f"({entry['p50_ms'] / previous['p50_ms']:5.2f}x)   "
+            f"p99 {previous['p99_ms']:8.2f} -> {entry['p99_ms']:8.2f} ms",
+            file=sys.stderr,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000, 2_000_000])
+    parser.add_argument("--seeds", type=int, default=50)
+    parser.add_argument("--case", default=None, help="Only run the cases containing this string.")
+    parser.add_argument("--output", default=None, help="Write the JSON here instead of stdout.")
+    parser.add_argument("--compare", default=None, help="JSON of a previous run to compare to.")
+    parser.add_argument(
+        "--deltas", type=int, default=0, help="Publish part of the catalogue in delta segments."
+    )
+    parser.add_argument("--ivf", action="store_true", help="Build an IVF index over the base.")
+    args = parser.parse_args()
+
+    # measure the search itself, not the result cache
+    rec.result_cache.max_bytes = 0
+    results = []
+    for rows in args.rows:
+        snapshot = build_snapshot(rows, deltas=args.deltas, ivf=args.ivf)
+        rng = np.random.default_rng(1)
+        seeds = random_tracks(snapshot, args.seeds, rng)
+        for name, exclude_size, options in cases():
+            if args.case and args.case not in name:
+                continue
+            entry = {
+                "rows": rows, "case": name, "exclude_size": exclude_size, "options": options,
+                **run_case(snapshot, seeds, exclude_size, options, rng),
+            }
+            results.append(entry)
+            print(
+                f"{rows:>9,} {name:50} p50 {entry['p50_ms']:8.2f} ms  "
+                f"p99 {entry['p99_ms']:8.2f} ms  peak {entry['peak_alloc_bytes'] / 2**20:7.1f} MB",
+                file=sys.stderr,
+            )
+
+    report = {
+        "environment": environment(), "seeds": args.seeds, "deltas": args.deltas, "ivf": args.ivf,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
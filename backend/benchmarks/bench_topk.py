@@ -0,0 +1,34 @@
+# Compare top-k selection: full argsort vs. argpartition top-k vs. block streaming top-k
+# Usage (from backend/): python -m benchmarks.bench_topk
+import argparse
+import numpy as np
+from recommend_api.services.topk import stream_top_k, top_k
+from .bench_partitions import best_of
+
+SIZES = [100_000, 1_000_000, 2_000_000]
+KS = [10, 100, 500]
+BLOCK_SIZE = 65_536
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print(f"{'candidates':>10} {'k':>4} {'argsort':>10} {'top_k':>10} {'stream':>10}  (ms)")
+    for n in SIZES:
+        scores = rng.uniform(-1, 1, n).astype(np.float32)
+        rows = np.arange(n)
+        for k in KS:
+            blocks = lambda: (
+                (rows[i:i + BLOCK_SIZE], scores[i:i + BLOCK_SIZE]) for i in range(0, n, BLOCK_SIZE)
+            )
+            full = best_of(lambda: scores.argsort()[::-1][:k], args.repeat)
+            partial = best_of(lambda: top_k(scores, k), args.repeat)
+            streamed = best_of(lambda: stream_top_k(blocks(), k), args.repeat)
+            print(f"{n:>10,} {k:>4} {full * 1e3:>10.2f} {partial * 1e3:>10.2f} {streamed * 1e3:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
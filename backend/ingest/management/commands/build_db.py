@@ -28,6 +28,14 @@ class Command(BaseCommand):
             default=None,
             help="List of part indexes to process (optional).",
         )
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            help=(
+                "Add the tracks to the existing DB and publish their features as a delta segment "
+                "of the current feature file (see compact_features)."
+            ),
+        )
 
     def handle(self, *args, **options):
         try:
@@ -39,7 +47,8 @@ class Command(BaseCommand):
                 use_sample=options["sample"],
                 show_log=options["log"],
                 num_parts=options["parts"],
-                parts_list=parts_list
+                parts_list=parts_list,
+                delta=options["delta"],
             )
         except Exception as e:
             raise CommandError(str(e))
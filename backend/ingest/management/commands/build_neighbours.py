@@ -0,0 +1,76 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from recommend_api.services.artifacts import (
+    DEFAULT_DIRECTORY, ArtifactStore, current_deltas, save_artifacts,
+)
+from recommend_api.services.neighbours import (
+    BLOCK_SIZE, NEIGHBOUR_COUNT, NeighbourGraph, default_workers,
+)
+from recommend_api.services.snapshot import RecommenderSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Precomputes the nearest neighbours of every track for the default recommendation options "
+        "and publishes them with the current feature file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--k", type=int, default=NEIGHBOUR_COUNT, help="Number of neighbours kept per track."
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of processes scoring the partitions (default: one per core).",
+        )
+        parser.add_argument(
+            "--block-size",
+            type=int,
+            default=BLOCK_SIZE,
+            help="Rows scored at once against their whole partition.",
+        )
+        # the blend the API ranks tracks by when the request doesn't set `total_weights`
+        parser.add_argument("--similarity-weight", type=float, default=0.9)
+        parser.add_argument("--popularity-weight", type=float, default=0.1)
+
+    def handle(self, *args, **options):
+        try:
+            store = ArtifactStore(DEFAULT_DIRECTORY)
+        except FileNotFoundError as e:
+            raise CommandError(f"{e}, run build_db first.")
+        # the graph is built over the base only and publishing it as a new base drops the delta
+        # segments, their tracks have to be folded into the base first
+        if current_deltas(DEFAULT_DIRECTORY):
+            raise CommandError("The feature file has delta segments, run compact_features first.")
+        snapshot = RecommenderSnapshot.load(store, version=store.version)
+        workers = options["workers"] or default_workers()
+
+        start = time.time()
+        try:
+            graph = NeighbourGraph.build(
+                snapshot.feature_matrix,
+                snapshot.feature_norms,
+                snapshot.ros_partitions,
+                k=options["k"],
+                similarity_weight=options["similarity_weight"],
+                popularity_weight=options["popularity_weight"],
+                popularity=snapshot.popularity,
+                block_size=options["block_size"],
+                workers=workers,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        print(
+            f"Found {graph.k} neighbours of {snapshot.row_count:,} tracks with {workers} workers "
+            f"in {time.time() - start:.2f} seconds"
+        )
+
+        # a new version with every array of the current one plus the graph, the recommender
+        # picks it up like any other published feature file
+        arrays = {name: store[name] for name in store}
+        version = save_artifacts(
+            DEFAULT_DIRECTORY, {**arrays, **graph.to_arrays()}, metadata=store.metadata
+        )
+        self.stdout.write(self.style.SUCCESS(f"Published version {version}."))
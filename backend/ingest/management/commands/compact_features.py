@@ -0,0 +1,80 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from ingest.pipeline import feature_arrays
+from recommend_api.services.artifacts import (
+    DEFAULT_DIRECTORY, ArtifactStore, published_segments, save_artifacts,
+)
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.snapshot import RecommenderSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Folds the delta segments published by build_db --delta into a new base feature file, "
+        "dropping the tracks they replaced or removed."
+    )
+
+    def handle(self, *args, **options):
+        version, deltas = published_segments(DEFAULT_DIRECTORY)
+        if version is None:
+            raise CommandError(f"No feature file found at {DEFAULT_DIRECTORY}, run build_db first.")
+        if not deltas:
+            self.stdout.write("No delta segments to compact.")
+            return
+
+        start = time.time()
+        base = ArtifactStore(DEFAULT_DIRECTORY, version)
+        snapshot = RecommenderSnapshot.load(
+            base, deltas=[ArtifactStore(DEFAULT_DIRECTORY, delta) for delta in deltas]
+        )
+        if any(segment.artist_index is None for segment in snapshot.segments):
+            raise CommandError("The feature file has no artist index, rebuild it with build_db.")
+        if any("feature_matrix_raw" not in segment.data for segment in snapshot.segments):
+            raise CommandError("The feature file has no raw features, rebuild it with build_db.")
+
+        # the rows of each segment that no later segment replaced or removed
+        visible = [
+            np.setdiff1d(
+                np.arange(segment.row_count),
+                [] if segment.hidden_rows is None else segment.hidden_rows,
+            )
+            for segment in snapshot.segments
+        ]
+
+        def gather(column):
+            return np.concatenate([
+                np.asarray(column(segment))[rows]
+                for segment, rows in zip(snapshot.segments, visible)
+            ])
+
+        has_titles = all(segment.title_hashes is not None for segment in snapshot.segments)
+        has_popularity = all(segment.popularity is not None for segment in snapshot.segments)
+        # deltas were scaled with the base's scaler, the scaled features are kept as they are
+        arrays, feature_stats = feature_arrays(
+            mbids=gather(lambda segment: segment.mbids),
+            years=gather(lambda segment: segment.years),
+            genre_dortmund=gather(lambda segment: segment.genre_dortmund.labels()),
+            genre_rosamerica=gather(lambda segment: segment.genre_rosamerica.labels()),
+            feature_matrix=gather(lambda segment: segment.feature_matrix),
+            feature_matrix_raw=gather(lambda segment: segment.data["feature_matrix_raw"]),
+            feature_names=snapshot.feature_names,
+            artist_index=ArtistIndex.concatenate([
+                segment.artist_index.take(rows)
+                for segment, rows in zip(snapshot.segments, visible)
+            ]),
+            title_hashes=gather(lambda segment: segment.title_hashes) if has_titles else None,
+            popularity=gather(lambda segment: segment.popularity) if has_popularity else None,
+        )
+        print(
+            f"Compacted {len(deltas)} delta segments into {len(arrays['mbids']):,} tracks "
+            f"in {time.time() - start:.2f} seconds"
+        )
+
+        # a new base drops the deltas, the neighbour graph of the old base doesn't apply to it
+        new_version = save_artifacts(
+            DEFAULT_DIRECTORY, arrays, metadata={**base.metadata, "catalogue_stats": feature_stats}
+        )
+        self.stdout.write(self.style.SUCCESS(f"Published version {new_version}."))
+        if snapshot.neighbour_graph is not None:
+            self.stdout.write("The neighbour graph was dropped, run build_neighbours again.")
@@ -0,0 +1,98 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+import recommend_api.services.recommender as rec
+
+
+class Command(BaseCommand):
+    help = "Reports recall@k and latency of the IVF engine against exact search on random targets."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seeds", type=int, default=200, help="Number of random target tracks.")
+        parser.add_argument("--k", type=int, default=100, help="Number of neighbours compared.")
+        parser.add_argument(
+            "--nprobe",
+            type=str,
+            default="1,2,4,8,16,32",
+            help="Comma separated list of nprobe values to evaluate.",
+        )
+        parser.add_argument(
+            "--filters",
+            action="store_true",
+            help="Keep the same genre/decade filters on (default compares against all tracks).",
+        )
+
+    def handle(self, *args, **options):
+        snapshot = rec.get_snapshot()
+        if snapshot.ivf_index is None:
+            raise CommandError("No IVF index in the features file, rebuild it with build_db.")
+        # every search is timed, cached results would report the time of an earlier run
+        rec.result_cache.max_bytes = 0
+
+        rng = np.random.default_rng(0)
+        seeds = [snapshot.mbid_at(row) for row in rng.integers(0, snapshot.row_count, options["seeds"])]
+        nprobes = [int(n) for n in options["nprobe"].split(",")]
+        search_options = {
+            "k": options["k"],
+            "match_genre": options["filters"],
+            "match_decade": options["filters"],
+        }
+
+        print(f"tracks: {snapshot.row_count:,}, lists: {snapshot.ivf_index.nlist}, seeds: {len(seeds)}")
+        for row in evaluate_ann(seeds, nprobes, search_options):
+            print(format_row(row))
+
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+
+def evaluate_ann(seeds, nprobes, options: dict) -> list[dict]:
+    """
+    Run every seed through the exact engine then through the IVF engine for each nprobe value.
+
+    Args:
+        seeds (list[str]): MBIDs of the target tracks.
+        nprobes (list[int]): Number of IVF lists to probe.
+        options (dict): Options passed to `recommend()`, the engine and nprobe are overwritten.
+
+    Returns:
+        list[dict]: One row per engine with the average recall@k (share of the exact top-k that is
+            also returned), the p50/p99 search time in ms and the average number of candidates.
+    """
+    exact = {}
+    timings, candidates = [], []
+    for mbid in seeds:
+        result = rec.recommend(mbid, {**options, "engine": "exact"})
+        exact[mbid] = {t["mbid"] for t in result["top_tracks"]}
+        timings.append(result["stats"]["search_time"])
+        candidates.append(result["stats"]["candidate_count"])
+    rows = [_summary("exact", 1.0, timings, candidates)]
+
+    for nprobe in nprobes:
+        recalls, timings, candidates = [], [], []
+        for mbid in seeds:
+            result = rec.recommend(mbid, {**options, "engine": "ivf", "nprobe": nprobe})
+            found = {t["mbid"] for t in result["top_tracks"]}
+            if exact[mbid]:
+                recalls.append(len(found & exact[mbid]) / len(exact[mbid]))
+            timings.append(result["stats"]["search_time"])
+            candidates.append(result["stats"]["candidate_count"])
+        rows.append(_summary(f"ivf nprobe={nprobe}", np.mean(recalls) if recalls else 1.0, timings, candidates))
+
+    return rows
+
+
+def format_row(row: dict) -> str:
+    return (
+        f'{row["engine"]:16} recall@k {row["recall"]:6.3f}   p50 {row["p50_ms"]:8.2f} ms   '
+        f'p99 {row["p99_ms"]:8.2f} ms   candidates {row["candidates"]:12,.0f}'
+    )
+
+
+def _summary(engine, recall, timings, candidates) -> dict:
+    timings = np.array(timings) * 1000
+    return {
+        "engine": engine,
+        "recall": float(recall),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "candidates": float(np.mean(candidates)),
+    }
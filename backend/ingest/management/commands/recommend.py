@@ -1,5 +1,4 @@
 import time
-import numpy as math
 from django.core.management.base import BaseCommand, CommandError
 from recommend_api.models import Track
 import recommend_api.services.recommender as rec
@@ -15,11 +14,17 @@ class Command(BaseCommand):
             default="62c2e20a-559e-422f-a44c-9afa7882f0c4",
             help="Use the sample dataset instead of full high-level parts.",
         )
+        parser.add_argument(
+            "--recompute",
+            action="store_true",
+            help="Recompute the feature matrix stats instead of reading the ones stored by build_db.",
+        )
 
     def handle(self, *args, **options):
         try:
             generate_recommendations(
-                target_mbid=options["mbid"]
+                target_mbid=options["mbid"],
+                recompute_stats=options["recompute"],
             )
         except Exception as e:
             raise CommandError(str(e))
@@ -27,7 +32,7 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS("Done."))
 
 
-def generate_recommendations(target_mbid: str):
+def generate_recommendations(target_mbid: str, recompute_stats: bool = False):
     start = time.time()
 
     # Select a track from the database by its MBID
@@ -35,19 +40,28 @@ def generate_recommendations(target_mbid: str):
     target_artist = target_track.artists.first()
 
     # Display stats about feature matrix
-    feature_stats = rec.get_feature_stats()
+    feature_stats = rec.get_feature_stats(recompute=recompute_stats)
     print("Feature matrix stats:")
     print(f'Number of unique tracks: {feature_stats["unique_track_count"]}')
     print(f'Number of unique feature vectors: {feature_stats["unique_vector_count"]}')
     print(f'Number of near-zero columns: {feature_stats["near_zero_col_count"]}')
     print(f'Total number of columns: {feature_stats["total_col_count"]}')
+    print(
+        f'Tracks sharing a feature vector: {feature_stats["duplicate_track_count"]} '
+        f'in {feature_stats["duplicate_group_count"]} groups '
+        f'(largest: {feature_stats["largest_duplicate_groups"]})'
+    )
 
     # Display recommendations
     recommendations = rec.recommend(
         target_mbid=target_mbid, 
         options={
             "k": 100,
-            "use_ros": True
+            "use_ros": True,
+            "stats": "exact",
+            # simple blend: mostly similarity, small nudge from popularity
+            "similarity_weight": 0.9,
+            "popularity_weight": 0.1,
         }
     )
     target_year = recommendations["target_year"]
@@ -70,15 +84,6 @@ def generate_recommendations(target_mbid: str):
         ).prefetch_related("artists")
     }
 
-    # add popularity and combined score
-    for track in top_tracks:
-        submissions = track_map.get(track["mbid"]).submissions
-        # simple blend: mostly similarity, small nudge from popularity
-        track["final_score"] = 0.9 * track["similarity"] + 0.1 * math.log1p(submissions)
-
-    # rerank by final score
-    top_tracks.sort(key=lambda x: x["final_score"], reverse=True)
-
     print(
         f"Tracks similar to: {target_artist.name} - {target_track.title} ({target_year}) [{target_genre_dortmund}] [{target_genre_rosamerica}] [{target_mbid}]:"
     )
@@ -113,7 +118,7 @@ def generate_recommendations(target_mbid: str):
         print(
             f'{artist_name[:20]:20} | {track_obj.title[:30]:30} | {str(track["year"]):6} | '
             f'{track["genre_dortmund"][:6]:6} | {track["genre_rosamerica"][:4]:4} | '
-            f'{track["similarity"]:2.3f} | {track_obj.submissions:3d} | {track["final_score"]:1.3f} | '
+            f'{track["similarity"]:2.3f} | {track_obj.submissions:3d} | {track["score"]:1.3f} | '
             f'{track["mbid"]}'
         )
 
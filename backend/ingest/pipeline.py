@@ -10,9 +10,39 @@ from dotenv import dotenv_values
 from pathlib import Path
 from sklearn.preprocessing import StandardScaler
 from recommend_api.models import Track, Artist, TrackArtist, Album, AlbumArtist
-
-
-def build_database(use_sample: bool, show_log: bool, num_parts: int = None, parts_list: list = None):
+from recommend_api.services.artifacts import (
+    DEFAULT_DIRECTORY as ARTIFACT_DIRECTORY, ArtifactStore, current_version, save_artifacts,
+    save_delta,
+)
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.catalogue_stats import catalogue_stats, duplicate_groups
+from recommend_api.services.columns import CategoricalColumn, hash_strings
+from recommend_api.services.ivf import IVFIndex
+from recommend_api.services.mbid_index import build_mbid_index, encode_mbids
+from recommend_api.services.partitions import PartitionIndex
+from recommend_api.services.quantize import QuantizedMatrix
+from recommend_api.services.scoring import row_norms
+
+
+def build_database(
+    use_sample: bool, show_log: bool, num_parts: int = None, parts_list: list = None,
+    delta: bool = False,
+):
+    """
+    Load AcousticBrainz dumps into the DB and export the feature file used by the recommender.
+
+    With `delta` the tracks are added to the existing DB instead of replacing it (tracks that are
+    already in it are re-ingested) and their features are published as a delta segment of the
+    current feature file, scaled like it. `compact_features` later folds the deltas into the base.
+    """
+    if delta:
+        if current_version(ARTIFACT_DIRECTORY) is None:
+            raise FileNotFoundError(
+                f"No feature file published at {ARTIFACT_DIRECTORY}, "
+                "run build_db without --delta first"
+            )
+        # checked before touching the DB, the delta is scaled like the base
+        base_mean, base_scale = base_scaler(ArtifactStore(ARTIFACT_DIRECTORY))
     WORKERS = max(8, (os.cpu_count() or 8))
     BASE_DIR = Path(__file__).resolve().parent.parent
     config = dotenv_values(BASE_DIR / ".env")
@@ -31,13 +61,14 @@ def build_database(use_sample: bool, show_log: bool, num_parts: int = None, part
         # 1M records
         dataset_path = config.get("AB_HIGHLEVEL_ROOT")
 
-    # Clean old records
-    print("Cleaning up old records", flush=True)
-    AlbumArtist.objects.all().delete()
-    Album.objects.all().delete()
-    TrackArtist.objects.all().delete()
-    Track.objects.all().delete()
-    Artist.objects.all().delete()
+    # Clean old records, a delta keeps them and only replaces the tracks it re-ingests
+    if not delta:
+        print("Cleaning up old records", flush=True)
+        AlbumArtist.objects.all().delete()
+        Album.objects.all().delete()
+        TrackArtist.objects.all().delete()
+        Track.objects.all().delete()
+        Artist.objects.all().delete()
 
     # If the user downloaded the AB dataset parts archives then store a list of the files,
     # we'll check and process later on, restrict based on param.
@@ -191,6 +222,9 @@ def build_database(use_sample: bool, show_log: bool, num_parts: int = None, part
     album_index = {}  # keep track of unique album names, indexed by MBID
     artist_index = defaultdict(list)  # keep track of unique artist names, indexed by MBID
     trackartist_set = set() # set of all Track-Artist M2M pairings, to avoid duplication
+    track_artist_ids = {}  # artist MBIDs of each track in credit order, exported with the features
+    track_titles = {}  # title of each track, exported (hashed) with the features
+    track_submissions = {}  # number of submissions of each track, exported as its popularity
     albumartist_set = set()  # set of all Album-Artist M2M pairings
     track_features_list = []  # list of feature values for each track
     track_list = []
@@ -214,6 +248,10 @@ def build_database(use_sample: bool, show_log: bool, num_parts: int = None, part
         )
         track_list.append(track_obj)
 
+        track_artist_ids[track_id] = list(dict.fromkeys(artist_id for artist_id, _ in artist_pairs))
+        track_titles[track_id] = track["title"]
+        track_submissions[track_id] = track["submissions"]
+
         # Associate artists, albums and tracks
         for artist_id, artist_name in artist_pairs:
             # Store artist data in a separate hashmap and associate it with the track
@@ -287,6 +325,19 @@ def build_database(use_sample: bool, show_log: bool, num_parts: int = None, part
         start = time.time()
         BATCH_SIZE = 20000
 
+        # tracks of a delta that are already in the DB are replaced, their rows in the feature
+        # file get tombstoned so the recommender only sees the new ones
+        replaced_mbids = []
+        if delta:
+            track_ids = [track.musicbrainz_recordingid for track in track_list]
+            for i in range(0, len(track_ids), BATCH_SIZE):
+                existing = Track.objects.filter(
+                    musicbrainz_recordingid__in=track_ids[i:i + BATCH_SIZE]
+                )
+                replaced_mbids.extend(existing.values_list("musicbrainz_recordingid", flat=True))
+                existing.delete()
+            print(f"Replacing {len(replaced_mbids):,} tracks that were already ingested")
+
         # For artists that appear under different names, merge by selecting most common one
         merged_artist_index = {}
         for artist_id, artist_names in artist_index.items():
@@ -294,8 +345,13 @@ def build_database(use_sample: bool, show_log: bool, num_parts: int = None, part
             merged_artist_index[artist_id] = Artist(
                 musicbrainz_artistid=artist_id, name=merged_name
             )
-        Album.objects.bulk_create(album_index.values(), batch_size=BATCH_SIZE)
-        Artist.objects.bulk_create(merged_artist_index.values(), batch_size=BATCH_SIZE)
+        # a delta keeps the albums and artists that already exist (same MBID primary key)
+        Album.objects.bulk_create(
+            album_index.values(), batch_size=BATCH_SIZE, ignore_conflicts=delta
+        )
+        Artist.objects.bulk_create(
+            merged_artist_index.values(), batch_size=BATCH_SIZE, ignore_conflicts=delta
+        )
         end = time.time()
         print(f"Inserted artists and albums in {end - start:.2f} seconds")
 
@@ -332,7 +388,9 @@ def build_database(use_sample: bool, show_log: bool, num_parts: int = None, part
             TrackArtist.objects.bulk_create(trackartist_list[i:i+BATCH_SIZE], batch_size=BATCH_SIZE)
 
         for i in range(0, len(albumartist_list), BATCH_SIZE):
-            AlbumArtist.objects.bulk_create(albumartist_list[i:i+BATCH_SIZE], batch_size=BATCH_SIZE)
+            AlbumArtist.objects.bulk_create(
+                albumartist_list[i:i+BATCH_SIZE], batch_size=BATCH_SIZE, ignore_conflicts=delta
+            )
 
         end = time.time()
         print(f"Inserted M2M pairings for TrackArtist and AlbumArtist in {end - start:.2f} seconds")
@@ -351,32 +409,175 @@ def build_database(use_sample: bool, show_log: bool, num_parts: int = None, part
     df[DF_FEATURE_FIELDS] = df[DF_FEATURE_FIELDS].astype(np.float32)
 
     # separate indexes from features
-    # feature_ids = df["mbid"].to_numpy()
     feature_matrix_raw = df[DF_FEATURE_FIELDS].to_numpy(dtype=np.float32)
 
-    # Scale values so they're more spread out, fixes skewed distribution
-    scaler = StandardScaler(with_mean=True, with_std=True).fit(feature_matrix_raw)
-    feature_matrix_scaled = scaler.transform(feature_matrix_raw).astype(np.float32)
+    # Scale values so they're more spread out, fixes skewed distribution. A delta is scaled like
+    # the base it's added to so their similarities can be compared.
+    if delta:
+        mean, scale = base_mean, base_scale
+    else:
+        scaler = StandardScaler(with_mean=True, with_std=True).fit(feature_matrix_raw)
+        mean, scale = scaler.mean_, scaler.scale_
+    feature_matrix_scaled = ((feature_matrix_raw - mean) / scale).astype(np.float32)
 
     # L2 normalize each row for cosine similarity later on
     feature_matrix_scaled /= (
         np.linalg.norm(feature_matrix_scaled, axis=1, keepdims=True) + 1e-8
     )
 
-    filename = os.path.join(os.path.dirname(__file__), "..", "features_and_index.npz")
-    np.savez_compressed(
-        filename,
-        # save vectors with values for audio features of tracks
-        feature_matrix=feature_matrix_scaled,
-        # keep the raw matrix for future re-weighting experiments
-        feature_matrix_raw=feature_matrix_raw,
-        feature_names=np.array(DF_FEATURE_FIELDS, dtype=object),
-        # save mapping from MusicBrainz ID to indexes in feature matrix
-        mbids=df["mbid"].to_numpy(),
+    arrays, feature_stats = feature_arrays(
+        # 16-byte binary UUIDs of the MusicBrainz IDs
+        mbids=encode_mbids(df["mbid"].to_numpy()),
         years=df["year"].to_numpy(np.int16),
         genre_dortmund=df["genre_dortmund"].to_numpy(),
         genre_rosamerica=df["genre_rosamerica"].to_numpy(),
+        feature_matrix=feature_matrix_scaled,
+        feature_matrix_raw=feature_matrix_raw,
+        feature_names=DF_FEATURE_FIELDS,
+        artist_index=ArtistIndex.build([track_artist_ids[mbid] for mbid in df["mbid"]]),
+        # titles only need comparing (same song by the same artist), 8 bytes per row
+        title_hashes=hash_strings([track_titles[mbid] for mbid in df["mbid"]]),
+        # popularity blended with the similarity when ranking, log1p so a few very popular tracks
+        # don't drown the similarity
+        popularity=np.log1p(
+            np.array([track_submissions[mbid] for mbid in df["mbid"]], dtype=np.float64)
+        ).astype(np.float32),
+        delta=delta,
     )
+    del track_artist_ids, track_titles, track_submissions
+
+    # Uncompressed .npy files + manifest, memory-mapped by the recommender so all workers share
+    # one copy of the data through the page cache
+    if delta:
+        version = save_delta(
+            ARTIFACT_DIRECTORY, {**arrays, "tombstones": encode_mbids(replaced_mbids)}
+        )
+        print(f"Published delta segment {version} with {len(df):,} tracks")
+    else:
+        save_artifacts(ARTIFACT_DIRECTORY, arrays, metadata={
+            "catalogue_stats": feature_stats,
+            # deltas are scaled with the scaler of their base
+            "feature_scaler": {"mean": mean.tolist(), "scale": scale.tolist()},
+        })
 
     end = time.time()
     print(f"Exported feature matrix and indexes in {end - start:.2f} seconds")
+
+
+def base_scaler(store) -> tuple:
+    """
+    Mean and scale the features of a published feature file were standardized with, recomputed
+    from its raw features if they aren't in its metadata.
+
+    Raises:
+        ValueError: If the feature file has neither.
+    """
+    scaler = store.metadata.get("feature_scaler")
+    if scaler is not None:
+        return np.array(scaler["mean"]), np.array(scaler["scale"])
+    if "feature_matrix_raw" not in store:
+        raise ValueError("The feature file has no raw features, rebuild it to add a delta")
+    raw = np.asarray(store["feature_matrix_raw"], dtype=np.float64)
+    scale = raw.std(axis=0)
+    # constant features are left unscaled, like StandardScaler does
+    scale[scale == 0] = 1.0
+    return raw.mean(axis=0), scale
+
+
+def feature_arrays(
+    mbids, years, genre_dortmund, genre_rosamerica, feature_matrix, feature_matrix_raw,
+    feature_names, artist_index, title_hashes=None, popularity=None, delta=False,
+):
+    """
+    Sort the rows of a catalogue by partition and build the arrays and indexes of a feature file,
+    used by `build_database` and `compact_features`.
+
+    Args:
+        mbids (np.ndarray): 16-byte MBID key of each row.
+        years (np.ndarray): Release year of each row, 0 when unknown.
+        genre_dortmund, genre_rosamerica (np.ndarray): Genre labels of each row.
+        feature_matrix (np.ndarray): Scaled and L2 normalized features.
+        feature_matrix_raw (np.ndarray): Unscaled features, in the same order.
+        feature_names (list[str]): Name of each feature column.
+        artist_index (ArtistIndex): Artists credited on each row.
+        title_hashes (np.ndarray, optional): Hash of each row's title, see `hash_strings`.
+        popularity (np.ndarray, optional): Popularity of each row.
+        delta (bool): Build a delta segment, without the IVF index and catalogue stats that only
+            the base has.
+
+    Returns:
+        tuple: (arrays, catalogue_stats), the stats are None for a delta.
+    """
+    # Store the rows sorted by (Rosamerica genre, decade), the default same genre + same decade
+    # query then reads a contiguous range of the matrix. Dortmund partitions keep a row permutation.
+    order = PartitionIndex.build(genre_rosamerica, years).order
+    if order is not None:
+        mbids, years, genre_dortmund, genre_rosamerica = (
+            mbids[order], years[order], genre_dortmund[order], genre_rosamerica[order]
+        )
+        feature_matrix, feature_matrix_raw = feature_matrix[order], feature_matrix_raw[order]
+        artist_index = artist_index.take(order)
+        title_hashes = None if title_hashes is None else title_hashes[order]
+        popularity = None if popularity is None else popularity[order]
+    ros_partitions = PartitionIndex.build(genre_rosamerica, years)
+    dortmund_partitions = PartitionIndex.build(genre_dortmund, years)
+
+    # Sorted 16-byte MBID keys and the row each one maps to, lets the recommender find a track
+    # with a binary search instead of scanning every MBID string
+    mbid_keys, mbid_rows = build_mbid_index(mbids)
+    feature_matrix_sq = np.square(feature_matrix)
+    arrays = {
+        # save vectors with values for audio features of tracks
+        "feature_matrix": feature_matrix,
+        # squared features and row norms, lets the recommender compute weighted row norms with
+        # one matvec
+        "feature_matrix_sq": feature_matrix_sq,
+        "feature_norms": row_norms(feature_matrix_sq),
+        # raw features, only read when a track's features are requested
+        "feature_matrix_raw": feature_matrix_raw,
+        "feature_names": np.array(feature_names),
+        # save mapping from MusicBrainz ID (16-byte binary UUID) to indexes in feature matrix
+        "mbids": mbids,
+        "mbid_keys": mbid_keys,
+        "mbid_rows": mbid_rows,
+        "years": years.astype(np.int16),
+        # genres as 1-byte codes + the list of genre labels
+        **CategoricalColumn.encode(genre_dortmund).to_arrays("genre_dortmund"),
+        **CategoricalColumn.encode(genre_rosamerica).to_arrays("genre_rosamerica"),
+        # integer artist codes of each row (CSR), the rows of each artist and the first credited
+        # artist of each row, used to exclude artists and keep one track per artist
+        **artist_index.to_arrays(),
+        # offsets of each (genre, decade) partition
+        **ros_partitions.to_arrays("ros"),
+        **dortmund_partitions.to_arrays("dortmund"),
+        # int8 copy of the features, first pass over scattered candidate rows
+        **QuantizedMatrix.build(feature_matrix).to_arrays(),
+    }
+    if title_hashes is not None:
+        arrays["title_hashes"] = title_hashes
+    if popularity is not None:
+        arrays["popularity"] = popularity
+    if delta:
+        return arrays, None
+
+    # Coarse k-means clustering of the tracks, used by the approximate ("ivf") search engine
+    ivf_start = time.time()
+    ivf_index = IVFIndex.build(feature_matrix)
+    print(f"Built IVF index with {ivf_index.nlist:,} lists in {time.time() - ivf_start:.2f} seconds")
+
+    # Stats about the catalogue (unique vectors, per-feature distribution), stored in the manifest
+    # so the recommender doesn't have to sort the feature matrix to report them
+    duplicate_offsets, duplicate_rows = duplicate_groups(feature_matrix)
+    feature_stats = catalogue_stats(feature_matrix, feature_names, duplicate_offsets)
+    print(
+        f"{feature_stats['unique_vector_count']:,} unique feature vectors, "
+        f"{feature_stats['duplicate_track_count']:,} tracks share theirs"
+    )
+    return {
+        **arrays,
+        # centroids and inverted lists for approximate search
+        **ivf_index.to_arrays(),
+        # tracks with the same feature vector, group `g` is rows[offsets[g]:offsets[g + 1]]
+        "duplicate_offsets": duplicate_offsets,
+        "duplicate_rows": duplicate_rows,
+    }, feature_stats
@@ -0,0 +1,106 @@
+import os, tempfile, uuid
+import numpy as np
+from io import StringIO
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from ingest.pipeline import feature_arrays
+from recommend_api.services.artifacts import (
+    ArtifactStore, published_segments, save_artifacts, save_delta,
+)
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.columns import hash_strings
+from recommend_api.services.mbid_index import encode_mbids
+
+
+class CompactFeaturesTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.directory = os.path.join(self.tmp.name, "features")
+        for command in ["compact_features", "build_neighbours"]:
+            self.enterContext(patch(
+                f"ingest.management.commands.{command}.DEFAULT_DIRECTORY", self.directory
+            ))
+        self.rng = np.random.default_rng(0)
+        self.mbids = [str(uuid.UUID(bytes=self.rng.bytes(16))) for _ in range(700)]
+
+    def segment(self, mbids, delta=False):
+        n = len(mbids)
+        raw = self.rng.normal(size=(n, 6)).astype(np.float32)
+        arrays, _ = feature_arrays(
+            mbids=encode_mbids(mbids),
+            years=self.rng.choice([1985, 1995], size=n).astype(np.int16),
+            genre_dortmund=self.rng.choice(["rock", "jazz"], size=n),
+            genre_rosamerica=self.rng.choice(["roc", "pop"], size=n),
+            feature_matrix=raw / np.linalg.norm(raw, axis=1, keepdims=True),
+            feature_matrix_raw=raw,
+            feature_names=[f"f{i}" for i in range(6)],
+            artist_index=ArtistIndex.build(
+                [[self.mbids[i]] for i in self.rng.integers(0, 40, size=n)]
+            ),
+            title_hashes=hash_strings([f"S{i}" for i in self.rng.integers(0, 100, size=n)]),
+            popularity=self.rng.random(n).astype(np.float32),
+            delta=delta,
+        )
+        return arrays
+
+    def test_compact(self):
+        save_artifacts(self.directory, self.segment(self.mbids[:500]))
+        # new tracks and 20 re-ingested ones, then more new tracks and 10 removed ones
+        save_delta(self.directory, {
+            **self.segment(self.mbids[500:600] + self.mbids[:20], delta=True),
+            "tombstones": encode_mbids(self.mbids[:20]),
+        })
+        save_delta(self.directory, {
+            **self.segment(self.mbids[600:], delta=True),
+            "tombstones": encode_mbids(self.mbids[20:30]),
+        })
+        version, deltas = published_segments(self.directory)
+        segmented = rec._load_segments(self.directory, version, deltas)
+
+        call_command("compact_features", stdout=StringIO())
+        new_version, new_deltas = published_segments(self.directory)
+        self.assertNotEqual(new_version, version)
+        self.assertListEqual(new_deltas, [])
+        store = ArtifactStore(self.directory)
+        self.assertEqual(len(store["mbids"]), 690)
+        self.assertIn("ivf_centroids", store)
+        compacted = rec.RecommenderSnapshot.load(store)
+        self.assertEqual(compacted.find_index(self.mbids[25]), -1)
+
+        seeds = self.mbids[:20] + self.mbids[30::25]
+        for options in [{"k": 10}, {"k": 10, "diversify": True, "use_ros": False}]:
+            rec.publish(segmented)
+            expected = [rec.recommend(mbid, options)["top_tracks"] for mbid in seeds]
+            rec.publish(compacted)
+            for mbid, tracks in zip(seeds, expected):
+                out = rec.recommend(mbid, options)["top_tracks"]
+                self.assertListEqual([t["mbid"] for t in out], [t["mbid"] for t in tracks])
+
+        # nothing left to compact
+        call_command("compact_features", stdout=StringIO())
+        self.assertEqual(published_segments(self.directory), (new_version, []))
+
+    def test_build_neighbours_needs_compaction(self):
+        save_artifacts(self.directory, self.segment(self.mbids[:500]))
+        save_delta(self.directory, self.segment(self.mbids[500:], delta=True))
+        segments = published_segments(self.directory)
+
+        # publishing the graph as a new base would drop the delta
+        with self.assertRaisesMessage(CommandError, "run compact_features first"):
+            call_command("build_neighbours", k=5, workers=1, stdout=StringIO())
+        self.assertEqual(published_segments(self.directory), segments)
+
+        call_command("compact_features", stdout=StringIO())
+        call_command("build_neighbours", k=5, workers=1, stdout=StringIO())
+        version, deltas = published_segments(self.directory)
+        self.assertListEqual(deltas, [])
+        snapshot = rec.RecommenderSnapshot.load(ArtifactStore(self.directory, version))
+        self.assertEqual(snapshot.row_count, 700)
+        self.assertIsNotNone(snapshot.neighbour_graph)
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "music_recommendation.settings")
 
 application = get_asgi_application()
+
+# Load the feature file when a server process starts instead of on the first request
+from recommend_api.services import recommender  # noqa: E402
+
+recommender.start_preload()
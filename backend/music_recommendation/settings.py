@@ -161,6 +161,17 @@ SPECTACULAR_SETTINGS = {
     "VERSION": "1.0.0",
 }
 
+# Recommender: unfiltered queries can be scored in parallel by RECOMMENDER_SCAN_THREADS threads,
+# each shard holding RECOMMENDER_SCAN_SHARD_SIZE rows (1 thread = scan on the request's thread)
+RECOMMENDER_SCAN_THREADS = int(config.get("RECOMMENDER_SCAN_THREADS", "1"))
+RECOMMENDER_SCAN_SHARD_SIZE = int(config.get("RECOMMENDER_SCAN_SHARD_SIZE", "262144"))
+# Recommender: milliseconds a /recommend/ request may take when it doesn't set `budget_ms`, longer
+# searches are answered by the IVF index (unset = no budget)
+RECOMMENDER_LATENCY_BUDGET_MS = (
+    float(config["RECOMMENDER_LATENCY_BUDGET_MS"])
+    if config.get("RECOMMENDER_LATENCY_BUDGET_MS") else None
+)
+
 # allow Vite dev server to hit API in dev
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOWED_ORIGINS = [
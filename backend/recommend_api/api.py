@@ -1,5 +1,4 @@
-import logging, time, math
-import numpy as np
+import logging, time
 from django.conf import settings
 from django.contrib.postgres.search import TrigramDistance, TrigramWordDistance
 from django.db.models import F
@@ -15,6 +14,7 @@ from rest_framework.views import APIView
 from .models import *
 from .serializers import *
 from .services.youtube_sources import get_youtube_source
+from .services import timings
 import recommend_api.services.recommender as rec
 
 log = logging.getLogger(__name__)
@@ -57,15 +57,24 @@ class TrackViewSet(viewsets.ReadOnlyModelViewSet):
     def features(self, request, *args, **kwargs):
         track = self.get_object()
         mbid = track.musicbrainz_recordingid
-        index = np.where(rec.mbid_to_idx == mbid)[0]
-        features = rec.feature_matrix[index][0]
-        raw_features = rec.feature_matrix_raw[index][0]
+        snapshot, error = run_recommender(rec.get_snapshot)
+        if error:
+            return error
+        # the newest segment that has the track, the base or a delta published after it
+        segment, index = snapshot.locate(mbid)
+        if segment is None:
+            return Response(
+                {"detail": "Track features not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        features = segment.feature_matrix[index]
+        raw_features = segment.raw_features(index)
 
         features_dict = {}
         raw_features_dict = {}
         for i, feature in enumerate(features):
-            features_dict[rec.feature_names[i]] = feature
-            raw_features_dict[rec.feature_names[i]] = raw_features[i]
+            features_dict[snapshot.feature_names[i]] = feature
+            if raw_features is not None:
+                raw_features_dict[snapshot.feature_names[i]] = raw_features[i]
 
         serializer = TrackFeaturesResponseSerializer({
             "track": track,
@@ -202,6 +211,102 @@ class ArtistViewSet(viewsets.ReadOnlyModelViewSet):
         return self.get_data(Album, AlbumSerializer, order_by="date")
 
 
+def recommend_options(validated_data):
+    """
+    Convert a validated recommend request into the options passed to the recommender.
+
+    Returns:
+        dict: The options.
+    """
+    listened_mbids = validated_data.get("listened_mbids", [])
+    filters = validated_data.get("filters", {})
+    feature_weights = validated_data.get("feature_weights", {})
+    total_weights = validated_data.get("total_weights", {})
+    limit = validated_data.get("limit", 10)
+    limit = min(limit, 50)
+    use_ros = filters.get("genre_classification", "rosamerica") == "rosamerica"
+    same_genre = filters.get("same_genre", True)
+    same_decade = filters.get("same_decade", True)
+
+    # The recommender ranks the tracks by the similarity/popularity blend, keeps one track per
+    # artist and skips the target's song by the same artist, only the `limit` tracks it returns
+    # are loaded from the DB
+    options = {
+        "k": limit,
+        "diversify": True,
+        "use_ros": use_ros, 
+        "exclude_mbids": listened_mbids,
+        "exclude_artists": filters.get("exclude_artists", []),
+        "match_genre": same_genre,
+        "match_decade": same_decade,
+        "feature_weights": feature_weights,
+        # simple blend: mostly similarity, small nudge from popularity
+        "similarity_weight": total_weights.get("similarity", 0.9),
+        "popularity_weight": total_weights.get("popularity", 0.1),
+    }
+    # disliked tracks are excluded and similar ones are penalized by the recommender itself, the
+    # `limit` tracks it returns are already ranked by their penalized score
+    for name in ["engine", "nprobe", "stats", "disliked_mbids", "dislike_weight"]:
+        if name in validated_data:
+            options[name] = validated_data[name]
+    # searches estimated to take longer are answered by the IVF index, see `rec._plan`
+    options["budget_ms"] = validated_data.get("budget_ms", settings.RECOMMENDER_LATENCY_BUDGET_MS)
+    return options
+
+
+def run_recommender(fn, *args, **kwargs):
+    """
+    Call a recommender function, converting its errors into API responses.
+
+    Returns:
+        tuple: (result, error_response), only one of them is set.
+    """
+    try:
+        return fn(*args, **kwargs), None
+    except ValueError as e:
+        # MBID not found in feature matrix
+        return None, Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except FileNotFoundError as e:
+        # Feature matrix data couldn't be loaded from disk
+        return None, Response(
+            {"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    except Exception as e:
+        # Any other error
+        log.exception("Unexpected error in similar_tracks")
+        return None, Response(
+            {"detail": "Unexpected error."},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+
+def hydrate_tracks(mbids):
+    """Load the Track objects for a list of MBIDs with one query, indexed by MBID."""
+    return {
+        t.musicbrainz_recordingid: t
+        for t in Track.objects.filter(
+            musicbrainz_recordingid__in=mbids
+        ).select_related("album").prefetch_related("artists")
+    }
+
+
+def build_similar_list(top_tracks, track_map):
+    """
+    The recommender's top tracks as Track objects, in the order they were ranked.
+    """
+    similar_list = []
+    for track in top_tracks:
+        track_obj = track_map.get(track["mbid"])
+        if not track_obj:
+            continue
+
+        # Include similarity score for the track
+        track_obj.similarity = track["similarity"]
+        similar_list.append(track_obj)
+
+    return similar_list
+
+
 class RecommendView(GenericAPIView):
     serializer_class = RecommendRequestSerializer
     parser_classes = [JSONParser, FormParser]
@@ -212,133 +317,197 @@ class RecommendView(GenericAPIView):
         description="Recommend similar tracks for a given MusicBrainz recording ID. Returns the target track, a list of similar tracks (with similarity scores), and recommendation statistics."
     )
     def post(self, request):
+        with timings.collect() as timer:
+            response = self.recommend(request)
+        response["Server-Timing"] = timings.server_timing(timer)
+        return response
+
+    def recommend(self, request):
         # Process options
-        serializer = RecommendRequestSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        with timings.phase("validate"):
+            serializer = RecommendRequestSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
         target_mbid = serializer.validated_data.get("mbid")
         if not target_mbid:
             return Response(
                 {"detail": "Missing 'mbid' parameter."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-
-        listened_mbids = serializer.validated_data.get("listened_mbids", [])
-        filters = serializer.validated_data.get("filters", {})
-        feature_weights = serializer.validated_data.get("feature_weights", {})
-        total_weights = serializer.validated_data.get("total_weights", {})
-        limit = serializer.validated_data.get("limit", 10)
-        limit = min(limit, 50)
-        use_ros = filters.get("genre_classification", "rosamerica") == "rosamerica"
-        same_genre = filters.get("same_genre", True)
-        same_decade = filters.get("same_decade", True)
+        options = recommend_options(serializer.validated_data)
 
         try:
-            target_track = Track.objects.get(musicbrainz_recordingid=target_mbid)
-            target_artist = target_track.artists.first()
+            with timings.phase("target"):
+                target_track = Track.objects.get(musicbrainz_recordingid=target_mbid)
         except Track.DoesNotExist:
             return Response(
                 {"detail": "Target track not found"}, status=status.HTTP_404_NOT_FOUND
             )
 
-        # Get the recommendations dict, ask for a large number of similar tracks (50)
-        # so we can have a buffer in case we need to filter the data
-        # (e.g. same artist shows up multiple times)
-        try:
-            recommendations = rec.recommend(
-                target_mbid=target_mbid,
-                options={
-                    "k": limit*10, 
-                    "use_ros": use_ros, 
-                    "exclude_mbids": listened_mbids,
-                    "match_genre": same_genre,
-                    "match_decade": same_decade,
-                    "feature_weights": feature_weights,
-                }
-            )
-            top_tracks = recommendations["top_tracks"]
-        except ValueError as e:
-            # MBID not found in feature matrix
-            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        except FileNotFoundError as e:
-            # Feature matrix data couldn't be loaded from disk
-            return Response(
-                {"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
-        except Exception as e:
-            # Any other error
-            log.exception("Unexpected error in similar_tracks")
-            return Response(
-                {"detail": "Unexpected error."},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        # Get the recommendations dict, the recommender times its own phases, "recommend" is
+        # what's left of the call
+        with timings.phase("recommend"):
+            recommendations, error_response = run_recommender(
+                rec.recommend, target_mbid=target_mbid, options=options
             )
+        if error_response:
+            return error_response
+        top_tracks = recommendations["top_tracks"]
 
         # Build the QuerySet for the similar track data and create an index based on MBID
-        top_mbids = [t["mbid"] for t in top_tracks]
-        track_map = {
-            t.musicbrainz_recordingid: t
-            for t in Track.objects.filter(
-                musicbrainz_recordingid__in=top_mbids
-            ).select_related("album").prefetch_related("artists")
-        }
-
-        # add popularity and combined score
-        similarity_weight = total_weights.get("similarity", 0.9)
-        popularity_weight = total_weights.get("popularity", 0.1)
-        for track in top_tracks:
-            submissions = track_map.get(track["mbid"]).submissions
-            # simple blend: mostly similarity, small nudge from popularity
-            track["final_score"] = (
-                similarity_weight * track["similarity"] + 
-                popularity_weight * math.log1p(submissions)
-            )
-
-        # rerank by final score
-        top_tracks.sort(key=lambda x: x["final_score"], reverse=True)
-
-
-        # Go through the similar tracks and extract a subset by filtering for
-        # artist name, track title, etc.
-        seen_artists = set()
-        similar_list = []
-        for track in top_tracks:
-            # Skip is target track is encountered again somehow
-            if track["mbid"] == target_mbid:
-                continue
-
-            track_obj = track_map.get(track["mbid"])
-            if not track_obj:
-                continue
-
-            artist = track_obj.artists.first()
-            artist_name = artist.name if artist else "Unknown Artist"
-
-            # Skip if it's the same song by the same artist as the target track
-            if (
-                artist_name == target_artist.name
-                and track_obj.title == target_track.title
-            ):
-                continue
-            
-            # Only allow 1 track per artist
-            if artist in seen_artists:
-                continue
-            seen_artists.add(artist)
-
-            # Include similarity score for the track
-            track_obj.similarity = track["similarity"]
-            similar_list.append(track_obj)
-
-            # Limit the subset
-            if len(similar_list) >= limit:
-                break
+        with timings.phase("hydrate"):
+            track_map = hydrate_tracks([t["mbid"] for t in top_tracks])
+            similar_list = build_similar_list(top_tracks, track_map)
 
         data = {
             "target_track": target_track,
             "similar_list": similar_list,
             "stats": recommendations["stats"],
         }
-        response_serializer = RecommendResponseSerializer(data)
-        return Response(response_serializer.data)
+        with timings.phase("serialize"):
+            payload = RecommendResponseSerializer(data).data
+        # added to the serialized copy, the stats dict may be shared with the result cache
+        if serializer.validated_data["debug_timings"]:
+            payload["stats"]["timings"] = timings.current().as_ms()
+        return Response(payload)
+
+
+class RecommendBatchView(GenericAPIView):
+    serializer_class = RecommendBatchRequestSerializer
+    parser_classes = [JSONParser, FormParser]
+
+    @extend_schema(
+        request=RecommendBatchRequestSerializer,
+        responses=RecommendBatchResponseSerializer,
+        description="Recommend similar tracks for several MusicBrainz recording IDs at once, with the same options applied to each. Returns one result per target track, in the order they were requested."
+    )
+    def post(self, request):
+        with timings.collect() as timer:
+            response = self.recommend(request)
+        response["Server-Timing"] = timings.server_timing(timer)
+        return response
+
+    def recommend(self, request):
+        with timings.phase("validate"):
+            serializer = RecommendBatchRequestSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+        target_mbids = serializer.validated_data["mbids"]
+        options = recommend_options(serializer.validated_data)
+
+        with timings.phase("target"):
+            target_map = {
+                t.musicbrainz_recordingid: t
+                for t in Track.objects.filter(
+                    musicbrainz_recordingid__in=target_mbids
+                ).select_related("album").prefetch_related("artists")
+            }
+        missing = [mbid for mbid in target_mbids if mbid not in target_map]
+        if missing:
+            return Response(
+                {"detail": f"Target track not found: {', '.join(missing)}"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        # Seeds that share the same candidate tracks are scored together
+        with timings.phase("recommend"):
+            results, error_response = run_recommender(
+                rec.recommend_many, target_mbids=target_mbids, options=options
+            )
+        if error_response:
+            return error_response
+
+        # One query for the similar tracks of every target
+        with timings.phase("hydrate"):
+            track_map = hydrate_tracks(
+                {t["mbid"] for result in results for t in result["top_tracks"]}
+            )
+            data = {
+                "results": [
+                    {
+                        "target_track": target_map[mbid],
+                        "similar_list": build_similar_list(result["top_tracks"], track_map),
+                        "stats": result["stats"],
+                    }
+                    for mbid, result in zip(target_mbids, results)
+                ]
+            }
+        with timings.phase("serialize"):
+            payload = RecommendBatchResponseSerializer(data).data
+        # the phases of the whole batch, not of each target
+        if serializer.validated_data["debug_timings"]:
+            payload["timings"] = timings.current().as_ms()
+        return Response(payload)
+
+
+class RecommendProfileView(GenericAPIView):
+    serializer_class = RecommendProfileRequestSerializer
+    parser_classes = [JSONParser, FormParser]
+
+    @extend_schema(
+        request=RecommendProfileRequestSerializer,
+        responses=RecommendProfileResponseSerializer,
+        description="Recommend tracks for a taste profile made of several seed tracks (ex: a listening history), optionally weighted. Returns the seed tracks, a single list of similar tracks and recommendation statistics."
+    )
+    def post(self, request):
+        with timings.collect() as timer:
+            response = self.recommend(request)
+        response["Server-Timing"] = timings.server_timing(timer)
+        return response
+
+    def recommend(self, request):
+        with timings.phase("validate"):
+            serializer = RecommendProfileRequestSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+        seed_mbids = serializer.validated_data["seed_mbids"]
+        options = recommend_options(serializer.validated_data)
+        if "profile" in serializer.validated_data:
+            options["profile"] = serializer.validated_data["profile"]
+
+        with timings.phase("target"):
+            seed_map = {
+                t.musicbrainz_recordingid: t
+                for t in Track.objects.filter(
+                    musicbrainz_recordingid__in=seed_mbids
+                ).select_related("album").prefetch_related("artists")
+            }
+        missing = [mbid for mbid in seed_mbids if mbid not in seed_map]
+        if missing:
+            return Response(
+                {"detail": f"Seed track not found: {', '.join(missing)}"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        # One search for every seed, instead of a request per seed
+        with timings.phase("recommend"):
+            recommendations, error_response = run_recommender(
+                rec.recommend_profile, seed_mbids=seed_mbids,
+                seed_weights=serializer.validated_data.get("seed_weights"), options=options,
+            )
+        if error_response:
+            return error_response
+        top_tracks = recommendations["top_tracks"]
+
+        with timings.phase("hydrate"):
+            track_map = hydrate_tracks([t["mbid"] for t in top_tracks])
+            data = {
+                "seed_tracks": [seed_map[mbid] for mbid in dict.fromkeys(seed_mbids)],
+                "similar_list": build_similar_list(top_tracks, track_map),
+                "stats": recommendations["stats"],
+            }
+        with timings.phase("serialize"):
+            payload = RecommendProfileResponseSerializer(data).data
+        if serializer.validated_data["debug_timings"]:
+            payload["stats"]["timings"] = timings.current().as_ms()
+        return Response(payload)
+
+
+class RecommendCacheView(APIView):
+    @extend_schema(
+        responses=RecommendCacheStatsSerializer,
+        description="Counters of this process' cache of recommendation results, used to size it. Entries are dropped when a new feature file version is loaded."
+    )
+    def get(self, request):
+        serializer = RecommendCacheStatsSerializer(rec.result_cache.stats())
+        return Response(serializer.data)
 
 
 class SearchView(APIView):
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class RecommendApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "recommend_api"
+
+    def ready(self):
+        # The feature file is loaded ahead of the first request by the server entry points
+        # (`recommender.start_preload()` in wsgi.py/asgi.py), not by every process
+        from .services import recommender
+        recommender.configure_scan(
+            threads=settings.RECOMMENDER_SCAN_THREADS,
+            shard_size=settings.RECOMMENDER_SCAN_SHARD_SIZE,
+        )
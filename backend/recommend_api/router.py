@@ -32,6 +32,9 @@ class CustomAPIRootView(APIRootView):
         extras = OrderedDict()
         extras["genres"] = request.build_absolute_uri(reverse("api:genre-list"))
         extras["recommend"] = request.build_absolute_uri(reverse("api:recommend"))
+        extras["recommend-batch"] = request.build_absolute_uri(reverse("api:recommend-batch"))
+        extras["recommend-profile"] = request.build_absolute_uri(reverse("api:recommend-profile"))
+        extras["recommend-cache"] = request.build_absolute_uri(reverse("api:recommend-cache"))
         extras["search"] = request.build_absolute_uri(reverse("api:search"))
         extras["documentation"] = {
            "schema": request.build_absolute_uri(reverse("api:schema")),
@@ -102,10 +102,18 @@ class SimilarTrackSerializer(TrackSerializer):
 class RecommendStatsSerializer(serializers.Serializer):
     candidate_count = serializers.IntegerField()
     search_time = serializers.FloatField()
+    engine = serializers.CharField(required=False)
+    cached = serializers.BooleanField(required=False)
+    mode = serializers.ChoiceField(["none", "approx", "exact"], required=False)
     mean = serializers.FloatField(allow_null=True)
     std = serializers.FloatField(allow_null=True)
     p95 = serializers.FloatField(allow_null=True)
     max = serializers.FloatField(allow_null=True)
+    timings = serializers.DictField(
+        child=serializers.FloatField(),
+        help_text="Milliseconds spent in each phase of the request, only set with debug_timings",
+        required=False
+    )
 
 
 class RecommendResponseSerializer(serializers.Serializer):
@@ -154,10 +162,108 @@ class RecommendRequestSerializer(serializers.Serializer):
         help_text="IDs of tracks already listened to, won't show up in recommendations",
         required=False
     )
+    disliked_mbids = serializers.ListField(
+        child=serializers.CharField(),
+        help_text="IDs of tracks the user disliked, they and the tracks similar to them are "
+        "ranked lower",
+        required=False, max_length=100
+    )
+    dislike_weight = serializers.FloatField(
+        help_text="How much similarity to a disliked track lowers a track's score (default: 0.5)",
+        required=False, min_value=0, max_value=1
+    )
     filters = RecommendFiltersSerializer(required=False)
     feature_weights = RecommendFeatureWeightsSerializer(required=False)
     total_weights = RecommendTotalWeightsSerializer(required=False)
     limit = serializers.IntegerField(required=False)
+    engine = serializers.ChoiceField(
+        ["exact", "ivf"],
+        help_text="Search engine: exact (compare against every candidate) or ivf (approximate)",
+        required=False
+    )
+    nprobe = serializers.IntegerField(
+        help_text="Number of IVF lists to search, only used by the ivf engine",
+        required=False, min_value=1, max_value=1024
+    )
+    stats = serializers.ChoiceField(
+        ["none", "approx", "exact"],
+        help_text="Similarity stats: none, approx (estimated from a sample, default) or exact",
+        required=False
+    )
+    budget_ms = serializers.FloatField(
+        help_text="Milliseconds the search may take, a longer exact search is answered by a "
+        "cheaper engine (ivf, or partition when there's no IVF index). Defaults to the server's",
+        required=False, min_value=1
+    )
+    debug_timings = serializers.BooleanField(
+        help_text="Include the time spent in each phase of the request in the response stats",
+        required=False, default=False
+    )
+
+
+class RecommendBatchRequestSerializer(RecommendRequestSerializer):
+    mbid = None
+    mbids = serializers.ListField(
+        child=serializers.CharField(),
+        min_length=1,
+        max_length=500,
+        help_text="MusicBrainz recording IDs of the target tracks"
+    )
+
+
+class RecommendProfileRequestSerializer(RecommendRequestSerializer):
+    mbid = None
+    seed_mbids = serializers.ListField(
+        child=serializers.CharField(),
+        min_length=1,
+        max_length=100,
+        help_text="MusicBrainz recording IDs of the seed tracks, ex: the recently played ones"
+    )
+    seed_weights = serializers.ListField(
+        child=serializers.FloatField(min_value=0),
+        help_text="Weight of each seed, ex: higher for recent plays (default: all 1)",
+        required=False
+    )
+    profile = serializers.ChoiceField(
+        ["centroid", "max"],
+        help_text="Score tracks against the weighted mean of the seeds (centroid, default) or "
+        "their most similar seed (max)",
+        required=False
+    )
+
+    def validate(self, data):
+        if "seed_weights" in data and len(data["seed_weights"]) != len(data["seed_mbids"]):
+            raise serializers.ValidationError("seed_weights must have one weight per seed.")
+        return data
+
+
+class RecommendProfileResponseSerializer(serializers.Serializer):
+    seed_tracks = TrackSerializer(many=True)
+    similar_list = SimilarTrackSerializer(many=True)
+    stats = RecommendStatsSerializer()
+
+
+class RecommendBatchResponseSerializer(serializers.Serializer):
+    results = RecommendResponseSerializer(many=True)
+    timings = serializers.DictField(
+        child=serializers.FloatField(),
+        help_text="Milliseconds spent in each phase of the request, only set with debug_timings",
+        required=False
+    )
+
+
+class RecommendCacheStatsSerializer(serializers.Serializer):
+    entries = serializers.IntegerField()
+    size_bytes = serializers.IntegerField()
+    max_bytes = serializers.IntegerField()
+    ttl = serializers.FloatField()
+    hits = serializers.IntegerField()
+    misses = serializers.IntegerField()
+    hit_rate = serializers.FloatField(allow_null=True)
+    evictions = serializers.IntegerField()
+    expirations = serializers.IntegerField()
+    invalidations = serializers.IntegerField()
+    version = serializers.CharField(allow_null=True)
 
 
 class SearchResponseSerializer(serializers.Serializer):
@@ -0,0 +1,258 @@
+# On-disk layout of the recommender's feature file
+# A directory with one uncompressed `.npy` file per array and a `manifest.json` describing them.
+# Arrays are opened with `mmap_mode="r"`, pages are read from the OS page cache on first access so
+# every worker process shares a single copy of the data and startup doesn't decompress anything.
+# String columns are stored as fixed-width unicode arrays, object (pickled) arrays aren't allowed.
+#
+# Every export is an immutable version directory named after a hash of its content, a `CURRENT`
+# file holds the name of the published version and is replaced atomically:
+#
+#   features/
+#     CURRENT               -> "3f2a9c..."
+#     3f2a9c.../            manifest.json, feature_matrix.npy, ...
+#     8d01b7.../            previous version, kept for readers that are still opening it
+#
+# A published version can be followed by small append-only delta segments (new or re-ingested
+# tracks, and tombstones of removed ones), written as version directories of their own and listed
+# in order in a `DELTAS` file that also names the base they apply to. Publishing a new base
+# (`build_db`, `compact_features`) drops them.
+import hashlib, json, os, shutil, time
+import numpy as np
+from collections.abc import Mapping
+
+FORMAT_VERSION = 2
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"
+DELTAS_NAME = "DELTAS"
+# Where `build_database` exports the artifact and the recommender loads it from
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "..", "features")
+
+
+def save_artifacts(directory, arrays: dict, metadata: dict = None) -> str:
+    """
+    Write arrays as a new version of an artifact directory and publish it.
+
+    Args:
+        directory (str): Path of the artifact directory.
+        arrays (dict[str, array-like]): Arrays keyed by name, string/object arrays are converted to
+            fixed-width unicode arrays.
+        metadata (dict, optional): Extra JSON serializable values stored in the manifest.
+
+    Returns:
+        str: The version (content hash) of the published artifact.
+
+    Notes:
+        Files are written to a temporary directory first, the version only becomes visible to
+        readers once every array and the manifest are complete. The previous version is kept,
+        older ones are deleted. The delta segments of the previous version aren't carried over.
+    """
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    previous = current_version(directory)
+    version = _write_version(directory, arrays, metadata)
+
+    # a new base replaces the deltas of the previous one, even when its content is the same
+    try:
+        os.remove(os.path.join(directory, DELTAS_NAME))
+    except FileNotFoundError:
+        pass
+    # publish, readers see either the old or the new version name, never a partial file
+    _replace_file(directory, CURRENT_NAME, version)
+
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and name not in (version, previous):
+            # mapped files of a removed version stay readable for the processes using them,
+            # this includes the delta segments of the previous base
+            shutil.rmtree(path, ignore_errors=True)
+    return version
+
+
+def save_delta(directory, arrays: dict, metadata: dict = None) -> str:
+    """
+    Write arrays as a delta segment of the published version and publish it after the existing
+    deltas.
+
+    Args:
+        directory (str): Path of the artifact directory.
+        arrays (dict[str, array-like]): Arrays of the segment, see `save_artifacts`.
+        metadata (dict, optional): Extra JSON serializable values stored in the manifest.
+
+    Returns:
+        str: The version (content hash) of the delta segment.
+
+    Raises:
+        FileNotFoundError: If no version is published in the directory.
+
+    Notes:
+        Deltas are written by one process at a time (`build_db --delta`, `compact_features`).
+    """
+    directory = os.path.abspath(directory)
+    base = current_version(directory)
+    if base is None:
+        raise FileNotFoundError(f"No feature file published in {directory}")
+    deltas = current_deltas(directory)
+    version = _write_version(directory, arrays, {**(metadata or {}), "base": base})
+    if version not in deltas:
+        pointer = {"base": base, "deltas": deltas + [version]}
+        _replace_file(directory, DELTAS_NAME, json.dumps(pointer))
+    return version
+
+
+def current_version(directory):
+    """Name of the published version of an artifact directory, None if nothing is published."""
+    try:
+        with open(os.path.join(directory, CURRENT_NAME)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_deltas(directory) -> list[str]:
+    """Versions of the delta segments of the published version, oldest first."""
+    try:
+        with open(os.path.join(directory, DELTAS_NAME)) as f:
+            pointer = json.load(f)
+    except FileNotFoundError:
+        return []
+    # deltas of a base that has since been replaced
+    if pointer["base"] != current_version(directory):
+        return []
+    return list(pointer["deltas"])
+
+
+def published_segments(directory):
+    """
+    The published version and its delta segments, read so that both belong together.
+
+    Returns:
+        tuple: (version, deltas), version is None if nothing is published.
+    """
+    while True:
+        version = current_version(directory)
+        deltas = current_deltas(directory)
+        # a new base could be published between the two reads
+        if version == current_version(directory):
+            return version, deltas
+
+
+def has_artifacts(directory) -> bool:
+    """Whether the directory has a published artifact."""
+    return current_version(directory) is not None
+
+
+def _write_version(directory, arrays: dict, metadata: dict = None) -> str:
+    """Write an immutable version directory (if it doesn't exist yet), returns its name."""
+    arrays = {name: _storable(np.asarray(array)) for name, array in arrays.items()}
+    content_hash = hashlib.sha256()
+    entries = {}
+    for name, array in arrays.items():
+        array_hash = _array_hash(array)
+        content_hash.update(f"{name}:{array.dtype.str}:{array.shape}:{array_hash};".encode())
+        entries[name] = {
+            "file": f"{name}.npy",
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "sha256": array_hash,
+        }
+    # a version is immutable, metadata that changes (ex: new stats) makes a new one
+    content_hash.update(json.dumps(metadata or {}, sort_keys=True).encode())
+    version = content_hash.hexdigest()[:16]
+
+    version_path = os.path.join(directory, version)
+    if not os.path.isdir(version_path):
+        staging = os.path.join(directory, f".tmp-{version}")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, entries[name]["file"]), array, allow_pickle=False)
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "metadata": metadata or {},
+            "arrays": entries,
+        }
+        with open(os.path.join(staging, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging, version_path)
+    return version
+
+
+def _replace_file(directory, name, content: str):
+    """Atomically replace a small pointer file."""
+    pointer = os.path.join(directory, f".{name}.tmp")
+    with open(pointer, "w") as f:
+        f.write(content)
+    os.replace(pointer, os.path.join(directory, name))
+
+
+class ArtifactStore(Mapping):
+    """
+    Read-only mapping of array name -> memory-mapped array for one version of an artifact directory.
+
+    Arrays are only opened on first access, an array that's never used (ex: `feature_matrix_raw`
+    when no one asks for the raw features) is never read from disk.
+    """
+
+    def __init__(self, directory, version: str = None):
+        """
+        Args:
+            directory (str): Path of the artifact directory.
+            version (str, optional): Version to open, defaults to the published one.
+        """
+        version = version or current_version(directory)
+        if version is None:
+            raise FileNotFoundError(f"No feature file published in {directory}")
+        self.directory = os.path.join(directory, version)
+        with open(os.path.join(self.directory, MANIFEST_NAME)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported feature file format {self.manifest.get('format_version')} in "
+                f"{self.directory}"
+            )
+        self._arrays = {}
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    @property
+    def metadata(self) -> dict:
+        return self.manifest["metadata"]
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            entry = self.manifest["arrays"][name]
+            path = os.path.join(self.directory, entry["file"])
+            # empty arrays can't be memory-mapped
+            mmap_mode = "r" if np.prod(entry["shape"]) > 0 else None
+            self._arrays[name] = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+        return self._arrays[name]
+
+    def __contains__(self, name):
+        return name in self.manifest["arrays"]
+
+    def __iter__(self):
+        return iter(self.manifest["arrays"])
+
+    def __len__(self):
+        return len(self.manifest["arrays"])
+
+
+def _storable(array) -> np.ndarray:
+    """Object arrays of strings become fixed-width unicode arrays, None values become ""."""
+    if array.dtype != object:
+        return array
+    if array.size == 0:
+        return array.astype(str)
+    return np.array(["" if value is None else str(value) for value in array.ravel()]).reshape(
+        array.shape
+    )
+
+
+def _array_hash(array) -> str:
+    """sha256 of the array's bytes."""
+    return hashlib.sha256(np.ascontiguousarray(array).reshape(-1).view(np.uint8).data).hexdigest()
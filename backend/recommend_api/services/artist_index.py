@@ -0,0 +1,164 @@
+# Sparse index of the artists credited on each track of the feature matrix
+# Artists get an integer code (their position in the sorted array of 16-byte MBID keys). The
+# artists of each row are stored in compressed sparse row (CSR) form, plus the transposed index
+# (the rows of each artist) so excluding an artist is a couple of slices rather than a DB query.
+import numpy as np
+from dataclasses import dataclass
+from .mbid_index import KEY_DTYPE, encode_mbids
+
+
+@dataclass
+class ArtistIndex:
+    # sorted 16-byte MBID keys, an artist's code is its position in this array
+    artist_keys: np.ndarray
+    # artists of row `r`: track_artists[track_offsets[r]:track_offsets[r + 1]], in credit order
+    track_offsets: np.ndarray
+    track_artists: np.ndarray
+    # rows of artist `a`: artist_rows[artist_offsets[a]:artist_offsets[a + 1]], ascending
+    artist_offsets: np.ndarray
+    artist_rows: np.ndarray
+    # first credited artist of each row, -1 for tracks without an artist
+    primary_artists: np.ndarray
+
+    @classmethod
+    def build(cls, artists_per_track):
+        """
+        Build the index from the artist MBIDs of each row.
+
+        Args:
+            artists_per_track (list[list[str]]): Artist MBIDs credited on each row of the feature
+                matrix, in credit order.
+        """
+        counts = np.array([len(artists) for artists in artists_per_track], dtype=np.int64)
+        keys = encode_mbids([mbid for artists in artists_per_track for mbid in artists])
+        return cls._from_entries(counts, keys)
+
+    @classmethod
+    def concatenate(cls, indexes):
+        """
+        Index of the rows of several indexes one after the other, ex: the segments of a feature
+        file being compacted. Artist codes are reassigned.
+        """
+        return cls._from_entries(
+            np.concatenate([np.diff(index.track_offsets) for index in indexes]),
+            np.concatenate([index.artist_keys[index.track_artists] for index in indexes]),
+        )
+
+    def take(self, rows):
+        """
+        Index of a subset of the rows, in the given order, artist codes are reassigned.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = np.diff(self.track_offsets)[rows]
+        # positions of the entries of each row in `track_artists`
+        starts = np.repeat(self.track_offsets[rows] - np.r_[0, np.cumsum(counts)[:-1]], counts)
+        entries = starts + np.arange(counts.sum(), dtype=np.int64)
+        return self._from_entries(counts, self.artist_keys[self.track_artists[entries]])
+
+    @classmethod
+    def _from_entries(cls, counts, keys):
+        """
+        Build the index from the number of artists of each row and the 16-byte keys of every
+        (row, artist) entry, in row then credit order.
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        if len(keys):
+            artist_keys, codes = np.unique(keys, return_inverse=True)
+        else:
+            artist_keys, codes = np.empty(0, dtype=KEY_DTYPE), np.empty(0, dtype=np.int64)
+        codes = codes.ravel().astype(np.int32)
+
+        track_offsets = np.r_[0, np.cumsum(counts)].astype(np.int64)
+        # transpose: sort the (row, artist) entries by artist, rows stay ascending within each one
+        entry_rows = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+        order = np.argsort(codes, kind="stable")
+        return cls(
+            artist_keys=artist_keys,
+            track_offsets=track_offsets,
+            track_artists=codes,
+            artist_offsets=np.r_[
+                0, np.cumsum(np.bincount(codes, minlength=len(artist_keys)))
+            ].astype(np.int64),
+            artist_rows=entry_rows[order],
+            primary_artists=_primary_artists(track_offsets, codes),
+        )
+
+    @property
+    def artist_count(self) -> int:
+        return len(self.artist_keys)
+
+    def codes_of(self, artist_mbids) -> np.ndarray:
+        """
+        Returns the codes of a list of artist MBIDs, unknown MBIDs are skipped.
+        """
+        if len(artist_mbids) == 0 or self.artist_count == 0:
+            return np.empty(0, dtype=np.int64)
+        query = encode_mbids(artist_mbids)
+        pos = np.minimum(np.searchsorted(self.artist_keys, query), self.artist_count - 1)
+        return pos[self.artist_keys[pos] == query]
+
+    def artists_of(self, row) -> np.ndarray:
+        """
+        Returns the codes of the artists credited on a row, in credit order.
+        """
+        return self.track_artists[self.track_offsets[row]:self.track_offsets[row + 1]]
+
+    def rows_of(self, artist_mbids) -> np.ndarray:
+        """
+        Returns the rows of the tracks credited to any of the artists (unknown MBIDs are skipped).
+
+        Notes:
+            A track credited to several of the artists appears once per artist.
+        """
+        return self.rows_of_codes(self.codes_of(artist_mbids))
+
+    def rows_of_codes(self, codes) -> np.ndarray:
+        """
+        Returns the rows of the tracks credited to any of the artist codes, see `rows_of`.
+        """
+        if len(codes) == 0:
+            return np.empty(0, dtype=np.int32)
+        return np.concatenate(
+            [self.artist_rows[self.artist_offsets[a]:self.artist_offsets[a + 1]] for a in codes]
+        )
+
+    def to_arrays(self) -> dict:
+        """
+        Returns the arrays needed to restore the index, keyed for the features file.
+        """
+        return {
+            "artist_keys": self.artist_keys,
+            "track_artist_offsets": self.track_offsets,
+            "track_artists": self.track_artists,
+            "artist_track_offsets": self.artist_offsets,
+            "artist_track_rows": self.artist_rows,
+            "primary_artists": self.primary_artists,
+        }
+
+    @classmethod
+    def from_arrays(cls, data):
+        """
+        Restore an index saved with `to_arrays`, returns None if it isn't in the file.
+        """
+        if "artist_keys" not in data:
+            return None
+        return cls(
+            artist_keys=data["artist_keys"],
+            track_offsets=data["track_artist_offsets"],
+            track_artists=data["track_artists"],
+            artist_offsets=data["artist_track_offsets"],
+            artist_rows=data["artist_track_rows"],
+            primary_artists=(
+                data["primary_artists"] if "primary_artists" in data
+                else _primary_artists(data["track_artist_offsets"], data["track_artists"])
+            ),
+        )
+
+
+def _primary_artists(track_offsets, track_artists) -> np.ndarray:
+    """First artist code of each row of a CSR index, -1 for rows without artists."""
+    starts = np.asarray(track_offsets[:-1])
+    has_artist = np.diff(track_offsets) > 0
+    primary = np.full(len(starts), -1, dtype=np.int32)
+    primary[has_artist] = track_artists[starts[has_artist]]
+    return primary
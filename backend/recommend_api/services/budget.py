@@ -0,0 +1,31 @@
+# Latency budget of a request, the cost of a search is estimated from its candidate count before
+# it runs. A request whose exact search wouldn't fit its budget is answered by the IVF index
+# instead of holding a worker for the whole catalogue (see `recommender._plan`). How much a
+# candidate costs depends on how its row is read: contiguous slices of the float32 matrix stream
+# through BLAS, scattered rows are gathered (from the int8 matrix first when it's available).
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class CostModel:
+    # nanoseconds per candidate of a whole search (exclusions, scores, top k, stats) for each way
+    # the candidates are read, measured end to end on one core over a 2M row catalogue
+    slice_ns: float = 30.0
+    # scattered rows scored with the int8 matrix, then a shortlist re-scored with float32
+    quantized_ns: float = 75.0
+    # scattered rows gathered from the float32 matrix, ex: the rows of the probed IVF lists
+    gather_ns: float = 270.0
+
+    def estimate_ms(self, count: int, kind: str) -> float:
+        """
+        Estimated milliseconds to search `count` candidates.
+
+        Args:
+            count (int): Number of candidates.
+            kind (str): "slice", "quantized" or "gather", how the candidates are read.
+        """
+        return count * getattr(self, f"{kind}_ns") / 1e6
+
+    def affordable(self, budget_ms: float, kind: str) -> int:
+        """Number of candidates that can be searched within a budget."""
+        return int(max(budget_ms, 0.0) * 1e6 / getattr(self, f"{kind}_ns"))
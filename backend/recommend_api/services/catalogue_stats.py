@@ -0,0 +1,105 @@
+# Statistics about the audio features of the whole catalogue
+# Computed once by `build_database` and stored in the feature file's manifest, the recommender
+# reads them back instead of sorting the feature matrix every time they're asked for.
+import numpy as np
+
+# Feature vectors that are equal once rounded to this many decimals count as duplicates
+DUPLICATE_DECIMALS = 4
+# Columns with a smaller standard deviation don't help telling tracks apart
+NEAR_ZERO_STD = 1e-6
+# Number of duplicate groups whose size is listed in the stats, largest first
+LARGEST_DUPLICATE_GROUPS = 10
+
+
+def duplicate_groups(feature_matrix, decimals: int = DUPLICATE_DECIMALS):
+    """
+    Group the tracks that share the same (rounded) feature vector.
+
+    Args:
+        feature_matrix (np.ndarray): Feature vectors, one row per track.
+        decimals (int): Vectors are compared after rounding to this many decimals.
+
+    Returns:
+        tuple: (offsets, rows), group `g` holds the rows `rows[offsets[g]:offsets[g + 1]]`. Only
+            vectors shared by at least two tracks form a group, groups are ordered by their
+            first row.
+
+    Notes:
+        Each row is compared as a single opaque value (its bytes), sorting n values is much
+        cheaper than `np.unique(axis=0)`'s column by column comparisons.
+    """
+    rounded = np.ascontiguousarray(np.round(feature_matrix, decimals), dtype=np.float32)
+    rounded += 0.0  # -0.0 and 0.0 have different bytes
+    keys = rounded.view(np.dtype((np.void, rounded.dtype.itemsize * rounded.shape[1]))).ravel()
+    _, first, inverse, counts = np.unique(
+        keys, return_index=True, return_inverse=True, return_counts=True
+    )
+
+    # vectors shared by several tracks, ordered by the first row that has them
+    shared = np.flatnonzero(counts > 1)
+    shared = shared[np.argsort(first[shared], kind="stable")]
+    # group of each unique vector, -1 for vectors that only one track has
+    group_of = np.full(len(counts), -1, dtype=np.int64)
+    group_of[shared] = np.arange(len(shared))
+    row_groups = group_of[inverse.ravel()]
+
+    rows = np.flatnonzero(row_groups >= 0)
+    rows = rows[np.argsort(row_groups[rows], kind="stable")]
+    offsets = np.r_[0, np.cumsum(counts[shared])].astype(np.int64)
+    return offsets, rows.astype(np.int32)
+
+
+def catalogue_stats(feature_matrix, feature_names, duplicate_offsets=None) -> dict:
+    """
+    Compute general stats about the audio features across all tracks.
+
+    Args:
+        feature_matrix (np.ndarray): Feature vectors, one row per track.
+        feature_names (array-like): Name of each column.
+        duplicate_offsets (np.ndarray, optional): Offsets returned by `duplicate_groups`, computed
+            if they aren't given.
+
+    Returns:
+        dict: JSON serializable stats:
+            - "unique_track_count" (int): Total number of tracks in the dataset.
+            - "unique_vector_count" (int): Number of unique feature vectors.
+            - "near_zero_col_count" (int): Number of feature columns with near-zero variance
+              (< NEAR_ZERO_STD standard deviation).
+            - "total_col_count" (int): Total number of feature columns.
+            - "features" (dict): {name: {mean, std, min, max}} for each column.
+            - "duplicate_group_count" (int): Number of feature vectors shared by several tracks.
+            - "duplicate_track_count" (int): Number of tracks that share their feature vector.
+            - "largest_duplicate_groups" (list[int]): Sizes of the largest groups.
+    """
+    if duplicate_offsets is None:
+        duplicate_offsets, _ = duplicate_groups(feature_matrix)
+    group_sizes = np.diff(duplicate_offsets)
+    track_count = len(feature_matrix)
+
+    columns = len(feature_names)
+    if track_count:
+        # float64 accumulators, float32 sums over millions of rows lose precision
+        col_mean = feature_matrix.mean(axis=0, dtype=np.float64)
+        col_std = feature_matrix.std(axis=0, dtype=np.float64)
+        col_min, col_max = feature_matrix.min(axis=0), feature_matrix.max(axis=0)
+    else:
+        col_mean = col_std = col_min = col_max = np.zeros(columns)
+
+    return {
+        "unique_track_count": int(track_count),
+        "unique_vector_count": int(track_count - group_sizes.sum() + len(group_sizes)),
+        "near_zero_col_count": int((col_std < NEAR_ZERO_STD).sum()),
+        "total_col_count": int(columns),
+        "features": {
+            str(name): {
+                "mean": float(col_mean[i]),
+                "std": float(col_std[i]),
+                "min": float(col_min[i]),
+                "max": float(col_max[i]),
+            }
+            for i, name in enumerate(feature_names)
+        },
+        "duplicate_group_count": int(len(group_sizes)),
+        "duplicate_track_count": int(group_sizes.sum()),
+        "largest_duplicate_groups": np.sort(group_sizes)[::-1][:LARGEST_DUPLICATE_GROUPS].tolist(),
+    }
@@ -0,0 +1,83 @@
+# Dictionary-encoded (categorical) metadata columns
+# Each row stores a small integer code that points into a vocabulary of labels, ex: the genre of
+# every track is 1 byte instead of a Python string. Comparisons run on the integer codes.
+import hashlib
+import numpy as np
+from dataclasses import dataclass
+
+
+@dataclass
+class CategoricalColumn:
+    # code of each row, an index into `vocabulary`
+    codes: np.ndarray
+    # label of each code, sorted fixed-width strings
+    vocabulary: np.ndarray
+
+    @classmethod
+    def encode(cls, values):
+        """
+        Dictionary-encode an array of labels, missing values (None) become "".
+        """
+        labels = np.array(["" if value is None else str(value) for value in values], dtype=str)
+        vocabulary, codes = np.unique(labels, return_inverse=True)
+        dtype = np.uint8 if len(vocabulary) <= 256 else np.int32
+        return cls(codes=codes.astype(dtype), vocabulary=vocabulary)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        """Label of a row as a str, or an array of labels for an array of rows."""
+        labels = self.vocabulary[self.codes[rows]]
+        return str(labels) if np.ndim(labels) == 0 else labels
+
+    def code_of(self, label) -> int:
+        """Code of a label, -1 if no row has it."""
+        position = int(np.searchsorted(self.vocabulary, label))
+        if position < len(self.vocabulary) and self.vocabulary[position] == label:
+            return position
+        return -1
+
+    def labels(self) -> np.ndarray:
+        """Decoded label of every row."""
+        return self.vocabulary[self.codes]
+
+    def to_arrays(self, name: str) -> dict:
+        """
+        Returns the arrays needed to restore the column, keyed for the features file.
+        """
+        return {f"{name}_codes": self.codes, f"{name}_vocab": self.vocabulary}
+
+    @classmethod
+    def from_arrays(cls, data, name: str):
+        """
+        Restore a column saved with `to_arrays`. Feature files that store the plain labels under
+        `name` are encoded on the fly, returns None if neither is in the file.
+        """
+        if f"{name}_codes" in data:
+            return cls(codes=data[f"{name}_codes"], vocabulary=data[f"{name}_vocab"])
+        if name in data:
+            return cls.encode(data[name])
+        return None
+
+
+def hash_strings(values) -> np.ndarray:
+    """
+    Stable 64-bit hash of each string, ex: to compare track titles without storing them.
+
+    Notes:
+        Missing values (None) hash like "". The hash doesn't depend on the process (unlike
+        Python's `hash`), values exported by `build_database` can be compared at query time.
+    """
+    return np.array(
+        [
+            int.from_bytes(
+                hashlib.blake2b(
+                    ("" if value is None else str(value)).encode(), digest_size=8
+                ).digest(),
+                "little",
+            )
+            for value in values
+        ],
+        dtype=np.uint64,
+    )
@@ -0,0 +1,90 @@
+# Inverted-file (IVF) index for approximate nearest neighbour search over the feature matrix
+# Rows are clustered around coarse k-means centroids, each centroid keeps the list of rows assigned
+# to it. A query is only compared against the rows of the `nprobe` centroids closest to it instead
+# of the whole catalogue, trading some recall for a much smaller scan.
+import numpy as np
+from dataclasses import dataclass
+from sklearn.cluster import MiniBatchKMeans
+
+
+@dataclass
+class IVFIndex:
+    # (nlist, features) L2 normalized centroids
+    centroids: np.ndarray
+    # list `i` holds `rows[offsets[i]:offsets[i + 1]]`
+    offsets: np.ndarray
+    rows: np.ndarray
+
+    @classmethod
+    def build(cls, feature_matrix, nlist: int = None, sample_size: int = 200_000, seed: int = 0):
+        """
+        Cluster the rows of the feature matrix and build the inverted lists.
+
+        Args:
+            feature_matrix (np.ndarray): L2 normalized feature vectors.
+            nlist (int, optional): Number of centroids (lists), defaults to sqrt(rows).
+            sample_size (int): Number of rows used to fit the centroids.
+            seed (int): Random seed for sampling and k-means.
+        """
+        n = len(feature_matrix)
+        if nlist is None:
+            nlist = int(np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+
+        rng = np.random.default_rng(seed)
+        sample = feature_matrix[rng.choice(n, size=min(sample_size, n), replace=False)]
+        kmeans = MiniBatchKMeans(
+            n_clusters=nlist, batch_size=max(1024, 4 * nlist), n_init=1, random_state=seed
+        ).fit(sample)
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-8
+
+        # assign every row to its most similar centroid, in blocks to bound memory
+        assignments = np.empty(n, dtype=np.int32)
+        block_size = max(1, 2**24 // nlist)
+        for start in range(0, n, block_size):
+            block = feature_matrix[start:start + block_size]
+            assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+
+        rows = np.argsort(assignments, kind="stable").astype(np.int32)
+        offsets = np.r_[0, np.cumsum(np.bincount(assignments, minlength=nlist))].astype(np.int64)
+        return cls(centroids=centroids, offsets=offsets, rows=rows)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def probe(self, query, nprobe: int) -> np.ndarray:
+        """
+        Returns the rows of the `nprobe` lists whose centroids are closest to the query, sorted.
+        """
+        nprobe = max(1, min(int(nprobe), self.nlist))
+        similarity = self.centroids @ np.asarray(query, dtype=np.float32)
+        lists = np.argpartition(similarity, self.nlist - nprobe)[self.nlist - nprobe:]
+        rows = np.concatenate(
+            [self.rows[self.offsets[i]:self.offsets[i + 1]] for i in lists]
+        )
+        return np.sort(rows)
+
+    def to_arrays(self) -> dict:
+        """
+        Returns the arrays needed to restore the index, keyed for the features file.
+        """
+        return {
+            "ivf_centroids": self.centroids,
+            "ivf_offsets": self.offsets,
+            "ivf_rows": self.rows,
+        }
+
+    @classmethod
+    def from_arrays(cls, data):
+        """
+        Restore an index saved with `to_arrays`, returns None if it isn't in the file.
+        """
+        if "ivf_centroids" not in data:
+            return None
+        return cls(
+            centroids=data["ivf_centroids"],
+            offsets=data["ivf_offsets"],
+            rows=data["ivf_rows"],
+        )
@@ -0,0 +1,86 @@
+# Persistent index that maps MusicBrainz IDs to rows in the feature matrix
+# MBIDs are packed into fixed-width 16-byte keys and stored in sorted order, next to the row each
+# key points to. Lookups are a binary search over the keys, O(log n) with no per-request copies.
+import uuid
+import numpy as np
+
+KEY_DTYPE = np.dtype("S16")
+
+
+def mbid_to_key(mbid) -> bytes:
+    """
+    Convert an MBID string to its 16-byte binary form.
+
+    Notes:
+        Values that aren't valid UUIDs (ex: fixtures used in tests) fall back to their first 16
+        bytes, they can still be looked up but aren't guaranteed to be unique past that length.
+    """
+    try:
+        return uuid.UUID(mbid).bytes
+    except (ValueError, TypeError, AttributeError):
+        return str(mbid).encode("utf-8")[:16]
+
+
+def key_to_mbid(key) -> str:
+    """
+    Convert a 16-byte key back to its MBID string (inverse of `mbid_to_key` for UUIDs).
+    """
+    # numpy drops the trailing null bytes of fixed-width values, pad them back
+    return str(uuid.UUID(bytes=bytes(key).ljust(16, b"\0")))
+
+
+def encode_mbids(mbids) -> np.ndarray:
+    """
+    Convert a list of MBID strings to an array of 16-byte keys, arrays of keys are returned as is.
+    """
+    if isinstance(mbids, np.ndarray) and mbids.dtype.kind == "S":
+        return mbids.astype(KEY_DTYPE, copy=False)
+    return np.array([mbid_to_key(mbid) for mbid in mbids], dtype=KEY_DTYPE)
+
+
+def build_mbid_index(mbids):
+    """
+    Build a sorted key array used to look up the row of an MBID with binary search.
+
+    Args:
+        mbids (array-like): MBIDs in feature matrix row order.
+
+    Returns:
+        tuple: (keys, rows) where `keys` is the sorted array of 16-byte MBID keys and `rows[i]` is
+            the feature matrix row for `keys[i]`.
+    """
+    keys = encode_mbids(mbids)
+    order = np.argsort(keys, kind="stable")
+    return keys[order], order.astype(np.int32)
+
+
+def lookup(keys, rows, mbid) -> int:
+    """
+    Find the feature matrix row of an MBID.
+
+    Returns:
+        int: The row index, or -1 if the MBID isn't in the index.
+    """
+    # compare as a fixed-width numpy value, trailing null bytes are dropped the same way they are
+    # for the stored keys
+    key = np.array(mbid_to_key(mbid), dtype=KEY_DTYPE)
+    pos = int(np.searchsorted(keys, key))
+    if pos < len(keys) and keys[pos] == key:
+        return int(rows[pos])
+    return -1
+
+
+def lookup_many(keys, rows, mbids) -> np.ndarray:
+    """
+    Find the feature matrix rows for a list of MBIDs, unknown MBIDs are skipped.
+
+    Returns:
+        np.ndarray: int32 array of row indexes.
+    """
+    if len(mbids) == 0 or len(keys) == 0:
+        return np.empty(0, dtype=np.int32)
+    query = encode_mbids(mbids)
+    pos = np.searchsorted(keys, query)
+    pos[pos >= len(keys)] = len(keys) - 1
+    found = keys[pos] == query
+    return rows[pos[found]]
@@ -0,0 +1,229 @@
+# Precomputed nearest neighbours of every track for the default recommendation options
+# Most requests use the same filters (same Rosamerica genre, same decade, all feature weights 1),
+# their answer only depends on the target track and doesn't change until the feature file is
+# rebuilt. `build_neighbours` scores every (genre, decade) partition against itself once with
+# blocked matrix-matrix products and keeps the best `k` neighbours of each row, a request with
+# the default options then reads one row of the graph instead of scanning its partition.
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from .scoring import weighted_cosine_many
+from .topk import top_k
+
+# Neighbours kept per track, enough for a page of 50 results after exclusions and one track per
+# artist in most cases, requests that need more fall back to a search
+NEIGHBOUR_COUNT = 200
+# Rows of a partition scored at once by each task, (block, partition) float32 scores are held
+BLOCK_SIZE = 512
+
+# Arrays a worker process scores its blocks against, set by `_init_worker`
+_worker_arrays = None
+
+
+@dataclass
+class NeighbourGraph:
+    # (rows, k) int32 best neighbours of each row, best first, -1 pads the rows of partitions
+    # smaller than k + 1 tracks
+    rows: np.ndarray
+    # (rows, k) float16 similarity of each neighbour
+    scores: np.ndarray
+    # (rows, 4) float16 mean, std, p95 and max similarity of each row to the rest of its partition
+    stats: np.ndarray
+    # the blend neighbours are ranked by, see `recommender._blend`
+    similarity_weight: float
+    popularity_weight: float
+
+    @classmethod
+    def build(
+        cls, feature_matrix, feature_norms, partitions, k: int = NEIGHBOUR_COUNT,
+        similarity_weight: float = 1.0, popularity_weight: float = 0.0, popularity=None,
+        block_size: int = BLOCK_SIZE, workers: int = 1,
+    ):
+        """
+        Find the k best neighbours of every row within its partition.
+
+        Args:
+            feature_matrix (np.ndarray): L2 normalized feature vectors.
+            feature_norms (np.ndarray): Norm of each row, see `scoring.row_norms`.
+            partitions (PartitionIndex): The (genre, decade) partitions neighbours are taken from.
+            k (int): Number of neighbours kept per row.
+            similarity_weight, popularity_weight (float): Blend the neighbours are ranked by.
+            popularity (np.ndarray, optional): Popularity of each row, needed when
+                `popularity_weight` isn't 0.
+            block_size (int): Rows scored at once against their whole partition.
+            workers (int): Processes the blocks are spread over, 1 scores them in this process.
+
+        Notes:
+            Neighbours are ranked exactly like `recommend()` ranks the candidates of a partition:
+            by score, ties broken by candidate order.
+        """
+        if popularity_weight != 0 and popularity is None:
+            raise ValueError(
+                "The feature file has no popularity column, rebuild it to blend scores"
+            )
+        n = len(feature_matrix)
+        graph = cls(
+            rows=np.full((n, k), -1, dtype=np.int32),
+            scores=np.zeros((n, k), dtype=np.float16),
+            stats=np.zeros((n, 4), dtype=np.float16),
+            similarity_weight=float(similarity_weight),
+            popularity_weight=float(popularity_weight),
+        )
+        order = np.arange(n, dtype=np.int32) if partitions.order is None else partitions.order
+        tasks = [
+            (int(part_start), int(part_stop), block_start, min(block_start + block_size, part_stop))
+            for part_start, part_stop in zip(partitions.offsets[:-1], partitions.offsets[1:])
+            for block_start in range(int(part_start), int(part_stop), block_size)
+        ]
+        arrays = (
+            feature_matrix, feature_norms, order, k, graph.similarity_weight,
+            graph.popularity_weight, popularity,
+        )
+
+        if workers <= 1:
+            _init_worker(*arrays)
+            try:
+                graph._fill(map(_score_block, tasks))
+            finally:
+                _init_worker()
+        else:
+            # memory-mapped arrays are passed by path and mapped again by each worker, the workers
+            # share their pages whatever the start method (spawn pickles the initargs)
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=tuple(_MappedArray.of(array) for array in arrays),
+            ) as pool:
+                graph._fill(pool.map(_score_block, tasks, chunksize=8))
+        return graph
+
+    @property
+    def k(self) -> int:
+        return self.rows.shape[1]
+
+    def neighbours_of(self, row) -> np.ndarray:
+        """Ranked neighbours of a row, fewer than k when its partition is smaller than k + 1."""
+        neighbours = self.rows[row]
+        return neighbours[neighbours >= 0]
+
+    def to_arrays(self) -> dict:
+        """
+        Returns the arrays needed to restore the graph, keyed for the features file.
+        """
+        return {
+            "neighbour_rows": self.rows,
+            "neighbour_scores": self.scores,
+            "neighbour_stats": self.stats,
+            "neighbour_blend": np.array(
+                [self.similarity_weight, self.popularity_weight], dtype=np.float64
+            ),
+        }
+
+    @classmethod
+    def from_arrays(cls, data):
+        """
+        Restore a graph saved with `to_arrays`, returns None if it isn't in the file.
+        """
+        if "neighbour_rows" not in data:
+            return None
+        similarity_weight, popularity_weight = data["neighbour_blend"]
+        return cls(
+            rows=data["neighbour_rows"],
+            scores=data["neighbour_scores"],
+            stats=data["neighbour_stats"],
+            similarity_weight=float(similarity_weight),
+            popularity_weight=float(popularity_weight),
+        )
+
+    def _fill(self, results):
+        """Copy the neighbours of each scored block into the graph."""
+        for block_rows, neighbour_rows, neighbour_scores, stats in results:
+            count = neighbour_rows.shape[1]
+            self.rows[block_rows, :count] = neighbour_rows
+            self.scores[block_rows, :count] = neighbour_scores
+            self.stats[block_rows] = stats
+
+
+def default_workers() -> int:
+    """Number of processes used to build the graph when none is given, one per available core."""
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+
+@dataclass
+class _MappedArray:
+    """A read-only memory-mapped .npy array a worker process maps again from its file."""
+    filename: str
+    dtype: str
+    shape: tuple
+    offset: int
+
+    @classmethod
+    def of(cls, array):
+        """The array to pass to a worker, a `_MappedArray` when it's mapped from a file."""
+        if isinstance(array, np.memmap) and array.filename is not None:
+            if array.flags.c_contiguous:
+                return cls(array.filename, array.dtype.str, array.shape, array.offset)
+        return array
+
+    def open(self) -> np.memmap:
+        return np.memmap(
+            self.filename, dtype=self.dtype, mode="r", shape=self.shape, offset=self.offset
+        )
+
+
+def _init_worker(*arrays):
+    """
+    Keep the arrays `_score_block` reads: (feature_matrix, feature_norms, order, k,
+    similarity_weight, popularity_weight, popularity), no arguments releases them.
+    """
+    global _worker_arrays
+    arrays = tuple(array.open() if isinstance(array, _MappedArray) else array for array in arrays)
+    _worker_arrays = arrays or None
+
+
+def _score_block(task):
+    """
+    Score rows `order[block_start:block_stop]` against their partition `order[start:stop]`.
+
+    Returns:
+        tuple: (block_rows, neighbour_rows, neighbour_scores, stats) for the rows of the block.
+    """
+    feature_matrix, feature_norms, order, k, similarity_weight, popularity_weight, popularity = (
+        _worker_arrays
+    )
+    start, stop, block_start, block_stop = task
+    candidates = order[start:stop]
+    block_rows = order[block_start:block_stop]
+
+    # one matrix-matrix product per block, the norms are given so the squared features aren't read
+    similarities = weighted_cosine_many(
+        feature_matrix[block_rows], feature_matrix[candidates], None,
+        candidate_norms=feature_norms[candidates],
+    )
+    # a track is never its own neighbour, nor part of its own stats
+    own = (np.arange(len(block_rows)), np.arange(block_start - start, block_stop - start))
+    ranking = similarities.copy()
+    if similarity_weight != 1 or popularity_weight != 0:
+        ranking *= similarity_weight
+        if popularity_weight != 0:
+            ranking += popularity_weight * popularity[candidates]
+    ranking[own] = -np.inf
+    similarities[own] = np.nan
+
+    count = min(k, len(candidates) - 1)
+    neighbour_rows = np.empty((len(block_rows), count), dtype=np.int32)
+    neighbour_scores = np.empty((len(block_rows), count), dtype=np.float16)
+    for i in range(len(block_rows)):
+        best = top_k(ranking[i], count)
+        neighbour_rows[i] = candidates[best]
+        neighbour_scores[i] = similarities[i, best]
+
+    stats = np.zeros((len(block_rows), 4), dtype=np.float16)
+    if len(candidates) > 1:
+        stats[:] = np.stack([
+            np.nanmean(similarities, axis=1),
+            np.nanstd(similarities, axis=1),
+            np.nanquantile(similarities, 0.95, axis=1),
+            np.nanmax(similarities, axis=1),
+        ], axis=1)
+    return block_rows, neighbour_rows, neighbour_scores, stats
@@ -0,0 +1,110 @@
+# In-process LRU cache of the weighted norm of every row, one entry per feature weight profile
+# A weighted cosine needs `|x * w|` for each candidate, a matrix-vector product over the squared
+# features that costs about as much as the scores themselves. Clients send the same few weight
+# profiles over and over (presets, slider defaults), their norms are computed once per snapshot.
+# The cache belongs to one snapshot, publishing a new feature file version clears it. Requests still
+# running on the previous snapshot after a reload bypass the cache instead of clearing it again.
+import threading
+import numpy as np
+from collections import OrderedDict
+from .scoring import weighted_norms
+
+
+class NormCache:
+    """
+    Least recently used cache of `weighted_norms(feature_matrix_sq, weights)` keyed by weights.
+
+    Notes:
+        A profile is only cached the `admit_after`-th time it's asked for, one-off weights (ex: a
+        slider being dragged) don't evict the profiles that are in use. Until then `get` returns
+        None and callers compute the norms of their candidates only.
+        A `max_profiles` of 0 disables the cache.
+    """
+    # number of profiles not cached yet whose request count is kept
+    MAX_PENDING = 256
+
+    def __init__(self, max_profiles: int, admit_after: int = 2):
+        self.max_profiles = max_profiles
+        self.admit_after = admit_after
+        self._entries = OrderedDict()  # weights bytes -> norms of every row
+        self._requests = OrderedDict()  # weights bytes -> times asked for, profiles not cached yet
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, snapshot, weights):
+        """
+        Returns the weighted norms of every row of the snapshot's feature matrix, None if the
+        profile isn't cached (yet).
+
+        Args:
+            snapshot (RecommenderSnapshot): The snapshot the norms are computed from.
+            weights (np.ndarray): Weight of each feature.
+        """
+        if self.max_profiles <= 0:
+            return None
+        key = np.asarray(weights, dtype=np.float32).tobytes()
+        with self._lock:
+            if not self._check_snapshot(snapshot):
+                self.misses += 1
+                return None
+            norms = self._entries.get(key)
+            if norms is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return norms
+            self.misses += 1
+            count = self._requests.pop(key, 0) + 1
+            if count < self.admit_after:
+                self._requests[key] = count
+                while len(self._requests) > self.MAX_PENDING:
+                    self._requests.popitem(last=False)
+                return None
+
+        # computed outside the lock, requests with other profiles aren't held up
+        norms = weighted_norms(snapshot.feature_matrix_sq, weights)
+        with self._lock:
+            if snapshot is not self._snapshot:
+                # a new snapshot was published meanwhile, these norms are already stale
+                return norms
+            self._entries[key] = norms
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_profiles:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return norms
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._requests.clear()
+
+    def stats(self) -> dict:
+        """Counters used to size the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "profiles": len(self._entries),
+                "max_profiles": self.max_profiles,
+                "size_bytes": int(sum(norms.nbytes for norms in self._entries.values())),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+            }
+
+    def _check_snapshot(self, snapshot) -> bool:
+        """
+        Drop the profiles of the previous snapshot when a newer one is asked for, called with the
+        lock held. Returns False for an older snapshot than the cache's, which bypasses the cache.
+        """
+        if snapshot is self._snapshot:
+            return True
+        if self._snapshot is not None and snapshot.generation < self._snapshot.generation:
+            return False
+        self._entries.clear()
+        self._requests.clear()
+        self._snapshot = snapshot
+        return True
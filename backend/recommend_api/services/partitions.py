@@ -0,0 +1,155 @@
+# Partitioned layout of the feature matrix, rows are grouped by (genre, decade)
+# Each genre classification gets a row order where tracks of the same genre and decade are stored
+# next to each other, plus the offsets where each partition starts. A same-genre/same-decade query
+# becomes a range of rows instead of a boolean mask over the whole catalogue.
+import numpy as np
+from dataclasses import dataclass
+
+
+def decade_of(years):
+    """
+    Returns the decade of a year (or array of years), ex: 1994 -> 1990. Missing years (0) map to 0.
+    """
+    return (years // 10) * 10
+
+
+def genre_labels(genres) -> np.ndarray:
+    """
+    Convert a genre column to a fixed-width string array, missing genres become "".
+    """
+    return np.array(["" if genre is None else str(genre) for genre in genres], dtype=str)
+
+
+@dataclass
+class PartitionIndex:
+    # row order that groups tracks by partition, None when the matrix is already stored in it
+    order: np.ndarray
+    # genre and decade of each partition
+    genres: np.ndarray
+    decades: np.ndarray
+    # partition `p` spans `order[offsets[p]:offsets[p + 1]]`
+    offsets: np.ndarray
+
+    @classmethod
+    def build(cls, genres, years):
+        """
+        Group the rows of the feature matrix by (genre, decade).
+
+        Args:
+            genres (array-like): Genre of each row.
+            years (array-like): Release year of each row.
+
+        Notes:
+            If the rows are already stored in partition order no permutation is kept and ranges
+            are used directly as slices of the feature matrix (no copies).
+        """
+        labels = genre_labels(genres)
+        decades = decade_of(np.asarray(years).astype(np.int32))
+        order = np.lexsort((decades, labels)).astype(np.int32)
+
+        sorted_labels = labels[order]
+        sorted_decades = decades[order]
+        # a partition starts wherever the genre or the decade changes
+        changed = (
+            (sorted_labels[1:] != sorted_labels[:-1]) | (sorted_decades[1:] != sorted_decades[:-1])
+        )
+        starts = np.flatnonzero(np.r_[True, changed]) if len(order) else np.empty(0, dtype=np.int64)
+        offsets = np.r_[starts, len(order)].astype(np.int64)
+
+        is_sorted = np.array_equal(order, np.arange(len(order)))
+        return cls(
+            order=None if is_sorted else order,
+            genres=sorted_labels[starts],
+            decades=sorted_decades[starts].astype(np.int16),
+            offsets=offsets,
+        )
+
+    @property
+    def row_count(self) -> int:
+        return int(self.offsets[-1])
+
+    def rows(self, genre=None, decade=None):
+        """
+        Returns the rows of the feature matrix that match a genre and/or a decade.
+
+        Args:
+            genre (str, optional): Only keep rows of this genre, use "" for tracks with no genre.
+            decade (int, optional): Only keep rows released in this decade.
+
+        Returns:
+            slice | np.ndarray: A slice when the rows are contiguous in the feature matrix,
+                otherwise an array of row indexes.
+        """
+        if genre is None and decade is None:
+            # every row is a candidate, the order they're scanned in doesn't matter
+            return slice(0, self.row_count)
+
+        parts = self._selected(genre, decade)
+
+        if parts.size == 0:
+            return slice(0, 0) if self.order is None else self.order[:0]
+
+        if genre is not None:
+            # partitions of the same genre are next to each other, sorted by decade
+            start, end = int(self.offsets[parts[0]]), int(self.offsets[parts[-1] + 1])
+            return slice(start, end) if self.order is None else self.order[start:end]
+
+        # same decade across all genres, stitch together one range per genre
+        positions = np.concatenate(
+            [np.arange(self.offsets[p], self.offsets[p + 1]) for p in parts]
+        )
+        return positions if self.order is None else self.order[positions]
+
+    def contains(self, rows, genre=None, decade=None) -> np.ndarray:
+        """
+        Boolean mask over an array of rows, True for rows that match the genre and/or decade.
+        """
+        if genre is None and decade is None:
+            return np.ones(len(rows), dtype=bool)
+        positions = rows if self.order is None else self._rank()[rows]
+        partition_ids = np.searchsorted(self.offsets, positions, side="right") - 1
+        return np.isin(partition_ids, self._selected(genre, decade))
+
+    def _selected(self, genre, decade) -> np.ndarray:
+        """Ids of the partitions that match the genre and/or decade."""
+        selected = np.ones(len(self.offsets) - 1, dtype=bool)
+        if genre is not None:
+            selected &= self.genres == genre
+        if decade is not None:
+            selected &= self.decades == decade
+        return np.flatnonzero(selected)
+
+    def _rank(self) -> np.ndarray:
+        """Position of each row in `order` (inverse permutation), built on first use."""
+        if getattr(self, "_rank_cache", None) is None:
+            rank = np.empty_like(self.order)
+            rank[self.order] = np.arange(len(self.order), dtype=self.order.dtype)
+            self._rank_cache = rank
+        return self._rank_cache
+
+    def to_arrays(self, prefix: str) -> dict:
+        """
+        Returns the arrays needed to restore the index, keyed for the features file.
+        """
+        arrays = {
+            f"{prefix}_part_genres": self.genres,
+            f"{prefix}_part_decades": self.decades,
+            f"{prefix}_part_offsets": self.offsets,
+        }
+        if self.order is not None:
+            arrays[f"{prefix}_order"] = self.order
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, data, prefix: str):
+        """
+        Restore an index saved with `to_arrays`, returns None if it isn't in the file.
+        """
+        if f"{prefix}_part_offsets" not in data:
+            return None
+        return cls(
+            order=data[f"{prefix}_order"] if f"{prefix}_order" in data else None,
+            genres=data[f"{prefix}_part_genres"],
+            decades=data[f"{prefix}_part_decades"],
+            offsets=data[f"{prefix}_part_offsets"],
+        )
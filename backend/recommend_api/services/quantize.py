@@ -0,0 +1,69 @@
+# int8 copy of the feature matrix used for a cheaper first-pass scan
+# Each feature column is scaled so its largest absolute value maps to 127, a row then takes 1 byte
+# per feature instead of 4. Scores computed from the codes are approximate (off by about
+# 1 / 127 per feature), the candidates they rank highest are re-scored exactly with the float32
+# matrix before the final top-k is picked.
+import numpy as np
+from dataclasses import dataclass
+
+
+@dataclass
+class QuantizedMatrix:
+    # (rows, features) int8 codes, `feature_matrix ~= codes * scales`
+    codes: np.ndarray
+    # float32 scale of each feature column
+    scales: np.ndarray
+
+    @classmethod
+    def build(cls, feature_matrix):
+        """
+        Quantize the feature matrix to int8 with one scale per feature column.
+        """
+        max_abs = np.abs(feature_matrix).max(axis=0) if len(feature_matrix) else 0
+        scales = (np.maximum(max_abs, 1e-12) / 127).astype(np.float32)
+        codes = np.clip(np.rint(feature_matrix / scales), -127, 127).astype(np.int8)
+        return cls(codes=codes, scales=scales)
+
+    def cosine(self, query, rows, weights=None, candidate_norms=None) -> np.ndarray:
+        """
+        Approximate `scoring.weighted_cosine` between a query vector and the candidate rows.
+
+        Args:
+            query (np.ndarray): 1D feature vector of the target track (float32).
+            rows (slice | np.ndarray): Candidate rows of the matrix.
+            weights (np.ndarray, optional): Weight of each feature, None means all weights are 1.
+            candidate_norms (np.ndarray, optional): Exact norms of the weighted candidates, they're
+                estimated from the codes if they aren't given.
+
+        Returns:
+            np.ndarray: float32 approximate similarity of each candidate, 0 for zero vectors.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if weights is not None:
+            query = query * weights
+        column_weights = self.scales if weights is None else self.scales * weights
+        # the int8 rows are only widened after they're gathered, the source read is 1 byte/feature
+        candidates = self.codes[rows].astype(np.float32)
+        scores = candidates @ (query * column_weights)
+        if candidate_norms is None:
+            np.square(candidates, out=candidates)
+            norms = np.sqrt(candidates @ (column_weights * column_weights))
+        else:
+            norms = np.array(candidate_norms, dtype=np.float32)
+        norms *= np.linalg.norm(query)
+        return np.divide(scores, norms, out=np.zeros_like(scores), where=norms > 0)
+
+    def to_arrays(self) -> dict:
+        """
+        Returns the arrays needed to restore the matrix, keyed for the features file.
+        """
+        return {"feature_codes": self.codes, "feature_scales": self.scales}
+
+    @classmethod
+    def from_arrays(cls, data):
+        """
+        Restore a matrix saved with `to_arrays`, returns None if it isn't in the file.
+        """
+        if "feature_codes" not in data:
+            return None
+        return cls(codes=data["feature_codes"], scales=data["feature_scales"])
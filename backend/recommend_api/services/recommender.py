@@ -1,26 +1,276 @@
 # Generate recommendations based on a given MusicBrainzID using Cosine Similarity
-# Note: This file loads the feature matrix into memory, make sure to import it only once
+# Note: The feature file is loaded into a `RecommenderSnapshot` on first use and reloaded when
+# `build_db` publishes a new version (or delta segment), requests always run against a single
+# snapshot
 # Note: MBID - MusicBrainz unique IDs
-import os, sys, time
+import hashlib, logging, os, threading, time
 import numpy as np
-from dataclasses import dataclass
-from sklearn.metrics.pairwise import cosine_similarity
-
-filename = os.path.join(os.path.dirname(__file__), "../..", "features_and_index.npz")
-try:
-    data = np.load(filename, allow_pickle=True)
-    # Load the audio features matrix and track metadata into memory
-    feature_matrix = data["feature_matrix"]
-    feature_matrix_raw = data["feature_matrix_raw"]
-    feature_names = data["feature_names"]
-    mbid_to_idx = data["mbids"]
-    years = data["years"]  # release year
-    genre_dortmund = data["genre_dortmund"]  # genre classification
-    genre_rosamerica = data["genre_rosamerica"]  # genre classification
-except FileNotFoundError as ex:
-    print(f"Feature file not found at {filename}")
-
-    
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from .artifacts import DEFAULT_DIRECTORY, ArtifactStore, published_segments
+from .budget import CostModel
+from .catalogue_stats import catalogue_stats
+from .mbid_index import KEY_DTYPE, lookup_many
+from .norm_cache import NormCache
+from .partitions import decade_of
+from .result_cache import ResultCache
+from .scoring import feature_weights_vector, weighted_cosine, weighted_cosine_many
+from .similarity_stats import SAMPLE_SIZE, RunningStats, empty_stats, exact_stats, sample_stats
+from .snapshot import RecommenderSnapshot
+from .timings import phase, timed
+from .topk import stream_top_k, top_k
+# Unfiltered queries over at least this many tracks are scored in blocks of STREAM_BLOCK_SIZE rows,
+# keeping only a running top-k instead of every similarity score
+STREAM_MIN_CANDIDATES = 500_000
+STREAM_BLOCK_SIZE = 65_536
+# Opt-in parallel scan: with more than one SCAN_THREADS, unfiltered queries are split into shards
+# of SCAN_SHARD_SIZE rows scored by a thread pool (BLAS and NumPy reductions release the GIL), each
+# shard keeps a local top-k and the shards are merged. Set from settings with `configure_scan`
+SCAN_THREADS = 1
+SCAN_SHARD_SIZE = 262_144
+# Upper bound on the number of similarity scores (candidates x targets) `recommend_many` computes
+# with a single matrix-matrix product, targets over it are scored in chunks
+BATCH_MAX_SCORES = 2**24
+# Number of IVF lists searched by the "ivf" engine when the options don't say otherwise
+IVF_NPROBE = 8
+# Candidates that aren't a contiguous range of rows are first ranked with the int8 matrix, the best
+# max(QUANTIZED_SHORTLIST, QUANTIZED_SHORTLIST_FACTOR * k) of them are re-scored exactly
+QUANTIZED_SHORTLIST = 500
+QUANTIZED_SHORTLIST_FACTOR = 4
+# With `diversify`, the k results are picked from the best DIVERSE_POOL_FACTOR * k candidates, the
+# pool grows DIVERSE_POOL_GROWTH times whenever it has fewer than k distinct artists
+DIVERSE_POOL_FACTOR = 10
+DIVERSE_POOL_GROWTH = 4
+# Weight of the penalty of candidates similar to `disliked_mbids` when a request doesn't set
+# `dislike_weight`. The k results are picked from the best k + DISLIKE_POOL_SIZE candidates by
+# score, the pool grows DISLIKE_POOL_GROWTH times until the penalized picks are exact: every
+# growth is a new search, a pool of a few hundred candidates costs about the same as k of them
+DISLIKE_WEIGHT = 0.5
+DISLIKE_POOL_SIZE = 640
+DISLIKE_POOL_GROWTH = 16
+# Ways of computing the similarity stats of a request, see the `stats` option of `recommend()`
+STATS_MODES = ("none", "approx", "exact")
+# Ways of scoring candidates against several seed tracks, see `recommend_profile()`
+PROFILE_MODES = ("centroid", "max")
+# Results of recent requests are kept in memory, up to RESULT_CACHE_MAX_BYTES (estimated) for at
+# most RESULT_CACHE_TTL seconds, 0 bytes disables the cache
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_TTL = 600.0
+# Weighted norms of every row are kept for the NORM_CACHE_PROFILES most recently used feature
+# weight profiles (4 bytes per row each), 0 disables the cache
+NORM_CACHE_PROFILES = 8
+
+# Seconds between two checks for a newly published feature file
+RELOAD_CHECK_INTERVAL = 5.0
+# Feature files built before the artifact directory was introduced are still loaded from the NPZ
+LEGACY_FILENAME = os.path.join(os.path.dirname(__file__), "../..", "features_and_index.npz")
+
+# Snapshot answering new requests, the artifact directory it's kept in sync with (None when the
+# snapshot was published directly) and the reload state
+_snapshot = None
+_watched_directory = None
+_next_check = 0.0
+_reloading = False
+_lock = threading.Lock()
+# Shared by every request of the process, emptied whenever a new snapshot starts serving
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
+norm_cache = NormCache(NORM_CACHE_PROFILES)
+# Cost of a search per candidate, used to fit requests to their latency budget
+cost_model = CostModel()
+# Threads of the parallel scan, created on first use
+_scan_pool = None
+_scan_lock = threading.Lock()
+# (snapshot generation, option) of the options ignored for a snapshot missing their arrays, each
+# one is only logged once
+_ignored_options = set()
+
+log = logging.getLogger(__name__)
+
+
+def get_snapshot() -> RecommenderSnapshot:
+    """
+    Returns the current snapshot, loading the published feature file on first use.
+
+    Notes:
+        Every `RELOAD_CHECK_INTERVAL` seconds the artifact directory is checked for a new version,
+        which is loaded and warmed up in a background thread while the current snapshot keeps
+        serving requests. A request holds on to the snapshot it started with.
+
+    Raises:
+        FileNotFoundError: If no feature file has been built yet.
+    """
+    snapshot = _snapshot
+    if snapshot is None:
+        return _load_initial()
+    if _watched_directory is not None and time.monotonic() >= _next_check:
+        _check_for_update()
+    return snapshot
+
+
+def publish(snapshot: RecommenderSnapshot, watched_directory=None):
+    """
+    Make a snapshot the one new requests are served from.
+
+    Args:
+        snapshot (RecommenderSnapshot): The snapshot to serve.
+        watched_directory (str, optional): Artifact directory checked for newer versions, None
+            keeps serving this snapshot until another one is published.
+    """
+    with _lock:
+        _swap(snapshot, watched_directory)
+
+
+def load_features(data, version=None):
+    """
+    Build a snapshot from the arrays exported by `build_database` and publish it.
+
+    Args:
+        data (Mapping): An `ArtifactStore`, a legacy NPZ file or a dict of arrays.
+        version (str, optional): Version tag of the snapshot.
+    """
+    snapshot = RecommenderSnapshot.load(data, version=version)
+    publish(snapshot)
+    return snapshot
+
+
+def configure_scan(threads=None, shard_size=None):
+    """
+    Set how unfiltered queries are scanned, called with the RECOMMENDER_SCAN_THREADS and
+    RECOMMENDER_SCAN_SHARD_SIZE settings when the app starts.
+
+    Args:
+        threads (int, optional): Number of threads scoring the shards, 1 scans on the thread
+            that handles the request.
+        shard_size (int, optional): Number of rows in each shard.
+
+    Raises:
+        ValueError: If a value isn't a positive number.
+    """
+    global SCAN_THREADS, SCAN_SHARD_SIZE, _scan_pool
+    if threads is not None and int(threads) < 1:
+        raise ValueError(f"Scan threads must be at least 1, got {threads}")
+    if shard_size is not None and int(shard_size) < 1:
+        raise ValueError(f"Scan shard size must be at least 1, got {shard_size}")
+
+    with _scan_lock:
+        if threads is not None:
+            SCAN_THREADS = int(threads)
+        if shard_size is not None:
+            SCAN_SHARD_SIZE = int(shard_size)
+        # the next parallel scan starts a pool of the new size
+        previous, _scan_pool = _scan_pool, None
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+def _get_scan_pool() -> ThreadPoolExecutor:
+    """Returns the thread pool of the parallel scan, starting it on first use."""
+    global _scan_pool
+    with _scan_lock:
+        if _scan_pool is None:
+            _scan_pool = ThreadPoolExecutor(
+                max_workers=SCAN_THREADS, thread_name_prefix="recommender-scan"
+            )
+        return _scan_pool
+
+
+def preload():
+    """
+    Load and warm up the published feature file ahead of the first request, does nothing (beyond
+    a message) if there's no feature file yet.
+    """
+    try:
+        get_snapshot().warm_up()
+    except FileNotFoundError as ex:
+        print(ex)
+
+
+def start_preload():
+    """
+    Run `preload` on a daemon thread. Called by the server entry points (wsgi.py, asgi.py) only,
+    management commands don't need the feature matrix in memory.
+    """
+    threading.Thread(target=preload, daemon=True).start()
+
+
+def _load_initial() -> RecommenderSnapshot:
+    """Load the published feature file (or the legacy NPZ) the first time a snapshot is needed."""
+    with _lock:
+        if _snapshot is not None:
+            return _snapshot
+
+    version, deltas = published_segments(DEFAULT_DIRECTORY)
+    if version is not None:
+        snapshot = _load_segments(DEFAULT_DIRECTORY, version, deltas)
+    elif os.path.exists(LEGACY_FILENAME):
+        snapshot = RecommenderSnapshot.load(np.load(LEGACY_FILENAME, allow_pickle=True))
+    else:
+        raise FileNotFoundError(
+            f"Feature file not found at {DEFAULT_DIRECTORY} or {LEGACY_FILENAME}, run build_db"
+        )
+
+    with _lock:
+        # another thread may have finished loading first, keep a single snapshot
+        if _snapshot is None:
+            _swap(snapshot, DEFAULT_DIRECTORY)
+        return _snapshot
+
+
+def _swap(snapshot, watched_directory):
+    """Replace the current snapshot, the caller holds the lock."""
+    global _snapshot, _watched_directory, _next_check
+    _snapshot = snapshot
+    _watched_directory = watched_directory
+    _next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+
+
+def _check_for_update():
+    """Start loading the published artifact version if it differs from the current snapshot."""
+    global _next_check, _reloading
+    with _lock:
+        if _reloading or time.monotonic() < _next_check:
+            return
+        _next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+        directory = _watched_directory
+        version, deltas = published_segments(directory)
+        if version is None or _segments_version(version, deltas) == _snapshot.version:
+            return
+        _reloading = True
+    threading.Thread(target=_reload, args=(directory, version, deltas), daemon=True).start()
+
+
+def _reload(directory, version, deltas=()):
+    """Load and warm up a new artifact version, then swap it in."""
+    global _reloading
+    try:
+        snapshot = _load_segments(directory, version, deltas)
+        snapshot.warm_up()
+        with _lock:
+            # don't replace a snapshot that was published directly in the meantime
+            if _watched_directory == directory:
+                _swap(snapshot, directory)
+        print(f"Loaded feature file version {_segments_version(version, deltas)}")
+    except Exception as ex:
+        print(f"Failed to load feature file version {_segments_version(version, deltas)}: {ex}")
+    finally:
+        with _lock:
+            _reloading = False
+
+
+def _load_segments(directory, version, deltas) -> RecommenderSnapshot:
+    """Load a published version and its delta segments."""
+    return RecommenderSnapshot.load(
+        ArtifactStore(directory, version),
+        version=_segments_version(version, deltas),
+        deltas=[ArtifactStore(directory, delta) for delta in deltas],
+    )
+
+
+def _segments_version(version, deltas) -> str:
+    """Version of a snapshot made of a base and its delta segments."""
+    return "+".join([version, *deltas])
+
+
 def recommend(target_mbid, options=None):
     """
     Returns k tracks that have similar features to a target track identified by MBID.
@@ -31,141 +281,1421 @@ def recommend(target_mbid, options=None):
             - k (int): Number of similar tracks to return (default: 50).
             - use_ros (bool): Use Rosamerica genre classification for filtering, otherwise Dortmund (default: True).
             - exclude_mbids (list[str]): List of MBIDs to exclude from recommendations (default: []).
+            - exclude_artists (list[str]): MBIDs of artists whose tracks are excluded (default: []).
+            - diversify (bool): Return at most one track per artist and skip the target's song
+              by the same artist under another MBID (default: False).
             - match_genre (bool): Whether to filter by genre (default: True).
             - match_decade (bool): Whether to filter by decade (default: True).
+            - feature_weights (dict[str, float]): Weight of each audio feature (default: all 1).
+            - similarity_weight (float): Weight of the similarity in a track's score (default: 1).
+            - popularity_weight (float): Weight of the popularity, log1p(submissions), in a
+              track's score (default: 0).
+            - engine (str): "exact" compares the target against every candidate, "ivf" only
+              against the candidates in the `nprobe` closest IVF lists (default: "exact").
+            - nprobe (int): Number of IVF lists to search (default: IVF_NPROBE).
+            - stats (str): How the mean/std/p95/max similarity stats are computed, "none" skips
+              them, "approx" estimates them from a sample of the scores (max is exact), "exact"
+              uses every score (default: "approx").
+            - budget_ms (float): Milliseconds the request may take, an exact search estimated to
+              take longer is answered by the IVF index (default: None, no budget).
+            - disliked_mbids (list[str]): MBIDs of tracks the user disliked, they're excluded and
+              the candidates similar to them are ranked lower (default: []).
+            - dislike_weight (float): Weight of the dislike penalty, a candidate's score is lowered
+              by `dislike_weight` times its best similarity to a disliked track (default:
+              DISLIKE_WEIGHT).
 
     Notes:
         The target_mbid is always excluded from the recommendations, even if not in exclude_mbids.
+        Unfiltered queries over large catalogues are scored block by block (see
+        STREAM_MIN_CANDIDATES), their p95 stat is then read from a histogram and is approximate
+        even when "exact" stats are asked for. The mode that was used is reported in the stats.
+        Candidates that aren't a contiguous range of rows are ranked with the int8 matrix first
+        (see QUANTIZED_SHORTLIST), the returned similarities are exact but the mean/std/p95/max
+        stats come from the int8 scores.
+        If the feature file has no IVF index the "ivf" engine falls back to "exact", the engine
+        that answered is reported in the stats.
+        When delta segments were published after the feature file each one is searched too and
+        their top tracks merged, see `_recommend_segments`.
+        Exact requests with the options the neighbour graph was built for (see
+        `build_neighbours`: Rosamerica genre and decade filters, no feature weights, the same
+        similarity/popularity blend, stats other than "exact") are answered from the graph, the
+        engine is then "graph" and the stats are the ones of the whole partition computed when
+        it was built. They fall back to "exact" when the graph doesn't have k neighbours left.
+        With `diversify` a track's artist is its first credited one, fewer than k tracks are
+        returned only when the candidates don't have k distinct artists.
+        Feature files without an artist index ignore `diversify` and ones without a popularity
+        column rank by similarity alone, with a warning in the logs, see `_fit_options`.
+        Tracks are ranked by score, the similarity_weight/popularity_weight blend computed over
+        every candidate before picking the top k, the stats are about the similarities.
+        Results are cached per snapshot (see RESULT_CACHE_MAX_BYTES), a cached result has
+        `"cached": True` in its stats and reports the search time of the request that computed it.
+        With a latency budget, an exact search whose candidates would take longer than what's left
+        of the budget is answered by the "ivf" engine with as many lists as fit the budget, see
+        `_plan`. Without an IVF index it stays exact. The engine that answered is in the stats.
+        Disliked tracks steer the ranking without changing the search: the best candidates by
+        score are re-ranked once penalized (see `_pick`), requests with dislikes don't use the
+        neighbour graph. The returned `score` includes the penalty, `similarity` doesn't.
 
     Returns:
         dict: {
             "target_year": int,
             "target_genre_dortmund": str,
             "target_genre_rosamerica": str,
-            "top_tracks": list[dict],  # Each dict: {mbid, similarity, year, genre_dortmund, genre_rosamerica}
-            "stats": dict,  # {candidate_count, search_time, mean, std, p95, max}
+            "top_tracks": list[dict],  # Each dict: {mbid, similarity, score, year, genre_dortmund, genre_rosamerica}
+            "stats": dict,  # {candidate_count, search_time, engine, mode, mean, std, p95, max}
         }
     """
-    # Parse options
-    if options is None:
-        options = {}
-    if not isinstance(options, dict):
-        raise TypeError("options must be a dict")
-    
-    k = options.get("k", 50)
-    use_ros = options.get("use_ros", True)
-    exclude_mbids = options.get("exclude_mbids", [])
-    match_genre = options.get("match_genre", True)
-    match_decade = options.get("match_decade", True)
-    feature_weights = options.get("feature_weights", {})
+    started = time.perf_counter()
+    opts = _parse_options(options)
+    k = opts["k"]
+    # the whole request runs against this snapshot, even if a new one is published meanwhile
+    snapshot = get_snapshot()
+    opts = _fit_options(snapshot, opts)
+    if snapshot.deltas:
+        return _recommend_segments(snapshot, target_mbid, opts, started)
 
     # Identify the index, year and genre of the targeted track
-    idxs = np.where(mbid_to_idx == target_mbid)[0]
-    if idxs.size == 0:
+    with phase("lookup"):
+        target_index = snapshot.find_index(target_mbid)
+    if target_index < 0:
         raise ValueError(f"Target MBID not found: {target_mbid}")
-    target_index = int(idxs[0])
-
-    target_year = int(years[target_index])
-    target_genre_dortmund = genre_dortmund[target_index]
-    target_genre_rosamerica = genre_rosamerica[target_index]
-
-    # Filter the data to a subset of tracks which are in a += 10 year interval, same genre and
-    # aren't excluded
-    mask = np.ones_like(years, dtype=bool)
-    if match_decade:
-        target_decade = (target_year // 10) * 10
-        mask &= (years >= target_decade) & (years < target_decade + 10)
-
-    if match_genre:
-        if use_ros:
-            mask &= genre_rosamerica == target_genre_rosamerica
-        else:
-            mask &= genre_dortmund == target_genre_dortmund
 
-    if exclude_mbids:
-        # exclude list of provided mbids and target track
-        mask &= ~np.isin(mbid_to_idx, exclude_mbids + [target_mbid])
-    else:
-        # always exclude the target
-        mask &= ~np.isin(mbid_to_idx, [target_mbid])
-
-    # build a weight vector for the features, determines feature impact on similarity score
-    weights = np.ones(len(feature_names))
-    for i, name in enumerate(feature_names):
-        if name in feature_weights:
-            weights[i] = feature_weights[name]
-
-    # the features we're comparing against, make sure to keep 2D shape
-    query_vec = feature_matrix[target_index : target_index + 1]
-    # filter EVERYTHING with the same mask, DO NOT rebind globals
-    fm = feature_matrix[mask] * weights
-    mb = mbid_to_idx[mask]
-    yrs = years[mask]
-    gd = genre_dortmund[mask]
-    gr = genre_rosamerica[mask]
-
-    # Find similar tracks
+    # exclude list of provided mbids and the tracks of excluded artists, resolved to rows through
+    # the indexes, and always the target
+    excluded_rows, exclusion_key = _exclusions(snapshot, opts)
+    excluded = np.append(excluded_rows, target_index)
+    dislikes = _dislikes(snapshot, opts)
+
+    # build a weight vector for the features, determines feature impact on similarity score,
+    # None if all weights are 1
+    weights = feature_weights_vector(snapshot.feature_names, opts["feature_weights"])
+
+    engine = "ivf" if opts["engine"] == "ivf" and snapshot.ivf_index is not None else "exact"
+    if engine == "exact" and _uses_graph(snapshot, opts, weights):
+        engine = "graph"
+    engine, opts = _plan(snapshot, snapshot, target_index, opts, engine, started)
+
+    cache_key = _cache_key(target_index, opts, exclusion_key, weights, engine)
+    with phase("cache"):
+        cached = result_cache.get(snapshot, cache_key)
+    if cached is not None:
+        cached["stats"]["cached"] = True
+        return cached
+
+    # the features we're comparing against
+    query_vec = snapshot.feature_matrix[target_index]
+
     start = time.time()
-    similarities = cosine_similarity(query_vec, fm).flatten()
-    # `argsort` returns a list of indexes from the similarities array so that the values corresponding to
-    # those indexes are sorted in ascending order.
-    top_indexes = similarities.argsort()[::-1][:k]
+    picked = None
+    if engine == "graph":
+        # None when the exclusions or `diversify` leave fewer than k of the stored neighbours
+        picked = _graph_pick(snapshot, target_index, query_vec, k, opts, excluded)
+        if picked is None:
+            engine = "exact"
+    penalties = None
+    if picked is None:
+        norms = _profile_norms(snapshot, weights)
+        partition_key = _partition_key(snapshot, target_index, opts)
+
+        def select(n):
+            return _search(
+                snapshot, partition_key, query_vec, opts, excluded, weights, norms, engine, n
+            )
+
+        def penalty(rows):
+            return _dislike_penalty(snapshot, dislikes, rows, weights, norms)
+
+        steer = None
+        if dislikes is not None:
+            steer = (lambda rows, similarities: _blend(snapshot, similarities, rows, opts), penalty)
+        picked = _pick(snapshot, target_index, k, opts["diversify"], select, steer=steer)
+        if dislikes is not None:
+            penalties = penalty(picked[0])
+    top_rows, top_scores, candidate_count, similarity_stats = picked
     end = time.time()
 
-    # build a list of the top most similar tracks and their metadata
-    top_tracks = []
-    for index in top_indexes:
-        mbid = mb[index]
-
-        top_tracks.append(
-            {
-                "mbid": mbid,
-                "similarity": similarities[index],
-                "year": yrs[index],
-                "genre_dortmund": gd[index],
-                "genre_rosamerica": gr[index],
-            }
-        )
+    result = _result(snapshot, target_index, top_rows, top_scores, opts, {
+        "candidate_count": candidate_count,
+        "search_time": float(end - start),
+        "engine": engine,
+        **similarity_stats,
+    }, penalties)
+    result_cache.put(snapshot, cache_key, result)
+    return result
+
+
+def _recommend_segments(snapshot, target_mbid, opts, started):
+    """
+    `recommend()` over a snapshot with delta segments: every segment is searched for the
+    candidates of the target's partition and their top tracks are merged by score.
+
+    Notes:
+        Only the base is searched with the IVF index, delta segments are small and always searched
+        exactly, the neighbour graph isn't used until the deltas are compacted into the base.
+        A track replaced or removed by a later segment is excluded from the segments before it.
+        Ties are broken by segment then row. The mean/std/max stats are merged exactly from the
+        stats of each segment, the p95 is their average weighted by candidate count.
+    """
+    k = opts["k"]
+    segments = snapshot.segments
+    with phase("lookup"):
+        target_segment, target_index = snapshot.locate(target_mbid)
+    if target_segment is None:
+        raise ValueError(f"Target MBID not found: {target_mbid}")
+    target_position = next(i for i, segment in enumerate(segments) if segment is target_segment)
+
+    # the exclusions are resolved in every segment, rows hidden by a later segment are excluded
+    # too, and the target from its own segment
+    exclusions = [_exclusions(segment, opts) for segment in segments]
+    excluded = []
+    for position, (segment, (rows, _)) in enumerate(zip(segments, exclusions)):
+        parts = [rows, [] if segment.hidden_rows is None else segment.hidden_rows]
+        parts.append([target_index] if position == target_position else [])
+        excluded.append(np.concatenate(parts).astype(np.int64))
+    dislikes = _dislikes(snapshot, opts)
+
+    weights = feature_weights_vector(snapshot.feature_names, opts["feature_weights"])
+    engine = "ivf" if opts["engine"] == "ivf" and snapshot.ivf_index is not None else "exact"
+    # the budget is fitted to the base, delta segments are small
+    engine, opts = _plan(snapshot, target_segment, target_index, opts, engine, started)
+
+    exclusion_key = tuple(key for _, key in exclusions)
+    cache_key = (target_position, *_cache_key(target_index, opts, exclusion_key, weights, engine))
+    with phase("cache"):
+        cached = result_cache.get(snapshot, cache_key)
+    if cached is not None:
+        cached["stats"]["cached"] = True
+        return cached
+
+    query_vec = target_segment.feature_matrix[target_index]
+    partition_key = _partition_key(target_segment, target_index, opts)
+    # deltas are small, their weighted norms are computed per request rather than cached
+    norms = [_profile_norms(snapshot, weights)] + [None] * len(snapshot.deltas)
+
+    def select(n):
+        return _merge_segments(segments, [
+            _search(
+                segment, partition_key, query_vec, opts, excluded[position], weights,
+                norms[position], engine if position == 0 else "exact", n,
+            )
+            for position, segment in enumerate(segments)
+        ], opts, n)
+
+    start = time.time()
+    top_ids, top_scores, results = _pick(
+        snapshot, target_index, k, opts["diversify"], select,
+        diverse=lambda ids: _diverse_segments(segments, [(target_position, target_index)], ids),
+        steer=_steer_segments(segments, dislikes, weights, norms, opts),
+    )
+    end = time.time()
+
+    top_tracks = _segment_tracks(segments, top_ids, top_scores, opts, dislikes, weights, norms)
+    result = _response(target_segment, target_index, top_tracks, {
+        "candidate_count": sum(candidate_count for _, _, candidate_count, _ in results),
+        "search_time": float(end - start),
+        "engine": engine,
+        **_merge_stats(results),
+    })
+    result_cache.put(snapshot, cache_key, result)
+    return result
+
+
+@timed("results")
+def _segment_tracks(segments, ids, similarities, opts, dislikes, weights, norms) -> list:
+    """The `top_tracks` of a result from the (segment, row) of the picked candidates."""
+    scores = _blend_segments(segments, ids, similarities, opts)
+    if dislikes is not None:
+        scores = scores - _segment_penalty(segments, dislikes, ids, weights, norms)
+    return [
+        _track(segments[position], row, similarity, score)
+        for (position, row), similarity, score in zip(ids, similarities, scores)
+    ]
 
+
+def _merge_segments(segments, results, opts, n) -> tuple:
+    """
+    The n best candidates of several segments from the (top_rows, top_scores, ...) of each one.
+
+    Returns:
+        tuple: (ids, top_scores, results) where `ids` are the (segment, row) of the candidates,
+            ties are broken by segment then row.
+    """
+    row_limit = max(segment.row_count for segment in segments)
+    # (segment, row) of each segment's top rows
+    ids = np.concatenate([
+        np.column_stack([np.full(len(top_rows), position), top_rows]).astype(np.int64)
+        for position, (top_rows, *_) in enumerate(results)
+    ])
+    with phase("top_k"):
+        similarities = np.concatenate([top_scores for _, top_scores, *_ in results])
+        scores = _blend_segments(segments, ids, similarities, opts)
+        winners = top_k(scores, n, tiebreak=ids[:, 0] * row_limit + ids[:, 1])
+    return ids[winners], similarities[winners], results
+
+
+def _steer_segments(segments, dislikes, weights, norms, opts):
+    """The `steer` of `_pick` for candidates identified by (segment, row), None if no dislikes."""
+    if dislikes is None:
+        return None
+    return (
+        lambda ids, similarities: _blend_segments(segments, ids, similarities, opts),
+        lambda ids: _segment_penalty(segments, dislikes, ids, weights, norms),
+    )
+
+
+def _segment_penalty(segments, dislikes, ids, weights, norms) -> np.ndarray:
+    """`_dislike_penalty` of candidates identified by (segment, row)."""
+    penalties = np.zeros(len(ids), dtype=np.float32)
+    for position, segment in enumerate(segments):
+        mask = ids[:, 0] == position
+        if mask.any():
+            penalties[mask] = _dislike_penalty(
+                segment, dislikes, ids[mask, 1], weights, norms[position]
+            )
+    return penalties
+
+
+def _blend_segments(segments, ids, similarities, opts) -> np.ndarray:
+    """`_blend` of candidates identified by (segment, row)."""
+    if not _blends(opts):
+        return similarities
+    scores = np.empty_like(similarities)
+    for position, segment in enumerate(segments):
+        mask = ids[:, 0] == position
+        scores[mask] = _blend(segment, similarities[mask], ids[mask, 1], opts)
+    return scores
+
+
+@timed("diversify")
+def _diverse_segments(segments, targets, ids) -> np.ndarray:
+    """
+    `_diverse` over candidates identified by (segment, row), artists are compared by MBID since
+    each segment has its own artist codes. `targets` are the (segment, row) of the target tracks,
+    the song of any of them by the same artist is left out.
+    """
+    artists = np.zeros(len(ids), dtype=KEY_DTYPE)
+    titles = np.zeros(len(ids), dtype=np.uint64)
+    has_titles = all(segment.title_hashes is not None for segment in segments)
+    for position, segment in enumerate(segments):
+        mask = ids[:, 0] == position
+        artists[mask] = _artist_keys(segment, ids[mask, 1])
+        if has_titles:
+            titles[mask] = segment.title_hashes[ids[mask, 1]]
+
+    same_song = np.zeros(len(ids), dtype=bool)
+    for target_position, target_index in targets:
+        target_segment = segments[target_position]
+        target_artist = _artist_keys(target_segment, [target_index])[0]
+        if target_artist != b"" and has_titles:
+            same_song |= (artists == target_artist) & (
+                titles == target_segment.title_hashes[target_index]
+            )
+    return _first_per_artist(artists, same_song)
+
+
+def _artist_keys(snapshot, rows) -> np.ndarray:
+    """
+    MBID key of the first credited artist of each row, b"" for tracks without an artist.
+
+    Raises:
+        ValueError: If the feature file has no artist index.
+    """
+    if snapshot.artist_index is None:
+        raise ValueError("The feature file has no artist index, rebuild it to diversify artists")
+    codes = snapshot.artist_index.primary_artists[np.asarray(rows, dtype=np.int64)]
+    keys = np.zeros(len(codes), dtype=KEY_DTYPE)
+    keys[codes >= 0] = snapshot.artist_index.artist_keys[codes[codes >= 0]]
+    return keys
+
+
+@timed("stats")
+def _merge_stats(results) -> dict:
+    """
+    Similarity stats of the candidates of several segments from the (top_rows, top_scores,
+    candidate_count, similarity_stats) of each one, see `_recommend_segments`.
+    """
+    parts = [
+        (candidate_count, stats) for _, _, candidate_count, stats in results
+        if candidate_count > 0 and stats["mean"] is not None
+    ]
+    if not parts:
+        return results[0][3]
+    if len(parts) == 1:
+        return parts[0][1]
+    counts = np.array([candidate_count for candidate_count, _ in parts], dtype=np.float64)
+    means = np.array([stats["mean"] for _, stats in parts])
+    stds = np.array([stats["std"] for _, stats in parts])
+    p95s = np.array([stats["p95"] for _, stats in parts])
+    mean = float((counts * means).sum() / counts.sum())
+    variance = float((counts * (stds**2 + means**2)).sum() / counts.sum()) - mean**2
     return {
-        "target_year": target_year,
-        "target_genre_dortmund": target_genre_dortmund,
-        "target_genre_rosamerica": target_genre_rosamerica,
+        "mode": "approx",
+        "mean": mean,
+        "std": float(np.sqrt(max(variance, 0.0))),
+        "p95": float((counts * p95s).sum() / counts.sum()),
+        "max": max(stats["max"] for _, stats in parts),
+    }
+
+
+def _search(snapshot, partition_key, query_vec, opts, excluded, weights, norms, engine, n):
+    """
+    Score the candidates of a target track and pick the n most similar ones, `partition_key` says
+    which tracks are candidates (see `_partition_key`) and `norms` are the weighted norms of every
+    row (see `_profile_norms`).
+
+    Returns:
+        tuple: (top_rows, top_scores, candidate_count, similarity_stats)
+    """
+    if engine == "ivf":
+        # Approximate search, only the tracks in the lists closest to the target are scored,
+        # the genre/decade filters and exclusions are applied to those
+        rows = _ivf_candidates(snapshot, query_vec, partition_key, excluded, opts["nprobe"])
+        similarities = _similarities(snapshot, query_vec, rows, weights, norms)
+        top_rows, top_scores, similarities = _select(snapshot, similarities, rows, None, n, opts)
+        candidate_count = len(similarities)
+        similarity_stats = _similarity_stats(similarities, top_scores, opts)
+    else:
+        # Select the tracks which are in the same decade and genre, each (genre, decade) partition
+        # is stored as a contiguous range of rows so this doesn't need a mask over the catalogue
+        rows = _candidate_rows(snapshot, partition_key)
+        keep = _keep_mask(rows, excluded)
+
+        # Find similar tracks, only the n best candidates are sorted
+        is_full_scan = isinstance(rows, slice) and rows == slice(0, snapshot.row_count)
+        if is_full_scan and rows.stop >= STREAM_MIN_CANDIDATES:
+            # No filters over a large catalogue, score it block by block so only one block of
+            # similarities is held in memory at a time (per shard when the scan is parallel)
+            top_rows, top_scores, running_stats = _scan(
+                snapshot, query_vec, weights, norms, keep, opts, n
+            )
+            if _blends(opts):
+                # blocks are ranked by score, only the similarities of the top rows are needed
+                top_scores = _similarities(snapshot, query_vec, top_rows, weights, norms)
+            candidate_count = rows.stop if keep is None else int(np.count_nonzero(keep))
+            if running_stats is None:
+                similarity_stats = {"mode": "none", **empty_stats()}
+            else:
+                similarity_stats = {"mode": "approx", **running_stats.result()}
+        elif _use_quantized(snapshot, rows, n):
+            # scattered rows (Dortmund partitions, decade across genres), gather them from the
+            # int8 matrix and only re-score the best ones with the float32 features
+            with phase("score"):
+                similarities = snapshot.quantized_matrix.cosine(
+                    query_vec, rows, weights, _candidate_norms(snapshot, rows, weights, norms)
+                )
+            top_rows, top_scores, similarities = _rerank(
+                snapshot, query_vec, similarities, rows, keep, n, weights, norms, opts
+            )
+            candidate_count = len(similarities)
+            similarity_stats = _similarity_stats(similarities, top_scores, opts)
+        else:
+            # score the whole partition (a view of the matrix when it's a slice) and drop excluded
+            # tracks from the scores afterwards, instead of copying the candidate rows
+            similarities = _similarities(snapshot, query_vec, rows, weights, norms)
+            top_rows, top_scores, similarities = _select(
+                snapshot, similarities, rows, keep, n, opts
+            )
+            candidate_count = len(similarities)
+            similarity_stats = _similarity_stats(similarities, top_scores, opts)
+
+    return top_rows, top_scores, candidate_count, similarity_stats
+
+
+def recommend_many(target_mbids, options=None):
+    """
+    Returns k similar tracks for each of several target tracks, same as calling `recommend()` for
+    each one but seeds that share the same candidate tracks are scored together with one
+    matrix-matrix product.
+
+    Args:
+        target_mbids (list[str]): MusicBrainz IDs of the target tracks.
+        options (dict, optional): Same options as `recommend()`, applied to every target.
+
+    Returns:
+        list[dict]: One `recommend()` result per target, in the same order as `target_mbids`.
+
+    Raises:
+        ValueError: If any of the targets isn't in the feature matrix.
+
+    Notes:
+        `budget_ms` isn't applied, a batch is one request whose cost grows with its targets. Batches
+        over delta segments or with `disliked_mbids` are searched one target at a time, each with
+        its own budget.
+    """
+    opts = _parse_options(options)
+    k = opts["k"]
+    snapshot = get_snapshot()
+    opts = _fit_options(snapshot, opts)
+    if snapshot.deltas or len(opts["disliked_mbids"]) > 0:
+        # the targets' candidates are spread over the segments, or re-ranked by their penalty,
+        # each target is searched on its own
+        return [recommend(mbid, options) for mbid in target_mbids]
+
+    with phase("lookup"):
+        target_indexes = [snapshot.find_index(mbid) for mbid in target_mbids]
+    missing = [mbid for mbid, index in zip(target_mbids, target_indexes) if index < 0]
+    if missing:
+        raise ValueError(f"Target MBID not found: {', '.join(missing)}")
+
+    if opts["engine"] == "ivf" and snapshot.ivf_index is not None:
+        # every target probes its own IVF lists, there's no shared set of candidates to batch
+        return [recommend(mbid, options) for mbid in target_mbids]
+
+    excluded, exclusion_key = _exclusions(snapshot, opts)
+    weights = feature_weights_vector(snapshot.feature_names, opts["feature_weights"])
+
+    # Answer the targets that are cached, group the others by the partition they're compared
+    # against
+    results = [None] * len(target_mbids)
+    cache_keys = [None] * len(target_mbids)
+    groups = defaultdict(list)
+    for position, target_index in enumerate(target_indexes):
+        cache_keys[position] = _cache_key(target_index, opts, exclusion_key, weights, "exact")
+        with phase("cache"):
+            cached = result_cache.get(snapshot, cache_keys[position])
+        if cached is not None:
+            cached["stats"]["cached"] = True
+            results[position] = cached
+        else:
+            groups[_partition_key(snapshot, target_index, opts)].append(position)
+
+    norms = _profile_norms(snapshot, weights) if groups else None
+    for (use_ros, genre, decade), positions in groups.items():
+        partitions = snapshot.ros_partitions if use_ros else snapshot.dortmund_partitions
+        rows = partitions.rows(genre=genre, decade=decade)
+        candidate_total = _row_count(rows)
+
+        # score as many targets at once as fit in the BATCH_MAX_SCORES budget
+        chunk_size = max(1, BATCH_MAX_SCORES // max(candidate_total, 1))
+        for chunk_start in range(0, len(positions), chunk_size):
+            chunk = positions[chunk_start:chunk_start + chunk_size]
+            chunk_indexes = [target_indexes[position] for position in chunk]
+
+            start = time.time()
+            # one row of similarities per target
+            scores = _similarities_many(
+                snapshot, snapshot.feature_matrix[chunk_indexes], rows, weights, norms
+            )
+            shared_time = (time.time() - start) / len(chunk)
+
+            for i, (position, target_index) in enumerate(zip(chunk, chunk_indexes)):
+                start = time.time()
+                keep = _keep_mask(rows, np.append(excluded, target_index))
+                top_rows, top_scores, similarities = _pick(
+                    snapshot, target_index, k, opts["diversify"],
+                    lambda n: _select(snapshot, scores[i], rows, keep, n, opts),
+                )
+                similarity_stats = _similarity_stats(similarities, top_scores, opts)
+                end = time.time()
+
+                results[position] = _result(snapshot, target_index, top_rows, top_scores, opts, {
+                    "candidate_count": len(similarities),
+                    "search_time": float(shared_time + end - start),
+                    "engine": "exact",
+                    **similarity_stats,
+                })
+                result_cache.put(snapshot, cache_keys[position], results[position])
+
+    return results
+
+
+def recommend_profile(seed_mbids, seed_weights=None, options=None):
+    """
+    Returns k tracks similar to a taste profile made of several seed tracks, ex: a listening
+    history, in a single ranked list.
+
+    Args:
+        seed_mbids (list[str]): MusicBrainz IDs of the seed tracks.
+        seed_weights (list[float], optional): Weight of each seed, ex: higher for recent plays
+            (default: all 1).
+        options (dict, optional): Same options as `recommend()`, plus:
+            - profile (str): "centroid" scores candidates against the weighted mean of the seeds,
+              "max" against their most similar seed, its similarity scaled by the seed's weight
+              relative to the largest one (default: "centroid").
+
+    Returns:
+        dict: {
+            "top_tracks": list[dict],  # same as `recommend()`
+            "stats": dict,  # {candidate_count, search_time, engine, mode, mean, std, p95, max}
+        }
+
+    Raises:
+        ValueError: If a seed isn't in the feature matrix or the weights don't match the seeds.
+
+    Notes:
+        The candidates are the tracks that pass the genre/decade filters of at least one seed,
+        the seeds are always excluded. Ties are broken by the order of the seeds' partitions,
+        then by row. With `diversify` the song of any seed by the same artist
+        is left out. Profiles are searched exactly ("engine", "nprobe" and "budget_ms" are
+        ignored), the max profile scores every seed against every candidate with one
+        matrix-matrix product per block of BATCH_MAX_SCORES scores.
+    """
+    opts = _parse_options(options)
+    k = opts["k"]
+    snapshot = get_snapshot()
+    opts = _fit_options(snapshot, opts)
+    segments = snapshot.segments
+
+    with phase("lookup"):
+        located = [snapshot.locate(mbid) for mbid in seed_mbids]
+    missing = [mbid for mbid, (segment, _) in zip(seed_mbids, located) if segment is None]
+    if missing:
+        raise ValueError(f"Seed MBID not found: {', '.join(missing)}")
+    if not located:
+        raise ValueError("At least one seed MBID is needed")
+    seed_weights = _seed_weights(seed_weights, len(located))
+    positions = {id(segment): position for position, segment in enumerate(segments)}
+    seeds = [(positions[id(segment)], int(row)) for segment, row in located]
+
+    # the exclusions of every segment, plus the rows hidden by a later segment and the seeds
+    exclusions = [_exclusions(segment, opts) for segment in segments]
+    excluded = []
+    for position, (segment, (rows, _)) in enumerate(zip(segments, exclusions)):
+        parts = [rows, [] if segment.hidden_rows is None else segment.hidden_rows]
+        parts.append([row for seed_position, row in seeds if seed_position == position])
+        excluded.append(np.concatenate(parts).astype(np.int64))
+
+    dislikes = _dislikes(snapshot, opts)
+    weights = feature_weights_vector(snapshot.feature_names, opts["feature_weights"])
+    cache_key = (
+        "profile", tuple(seeds), seed_weights.tobytes(), opts["profile"],
+        *_cache_key(-1, opts, tuple(key for _, key in exclusions), weights, "exact"),
+    )
+    with phase("cache"):
+        cached = result_cache.get(snapshot, cache_key)
+    if cached is not None:
+        cached["stats"]["cached"] = True
+        return cached
+
+    seed_vecs = np.stack([
+        np.asarray(segments[position].feature_matrix[row], dtype=np.float32)
+        for position, row in seeds
+    ])
+    if opts["profile"] == "centroid":
+        # one query, the weighted mean direction of the seeds
+        queries = (seed_weights @ seed_vecs / seed_weights.sum())[None, :]
+        query_weights = np.ones(1, dtype=np.float32)
+    else:
+        queries, query_weights = seed_vecs, seed_weights / seed_weights.max()
+    # the genre/decade partitions of the seeds, the same keys select them in every segment
+    partition_keys = list(dict.fromkeys(
+        _partition_key(segments[position], row, opts) for position, row in seeds
+    ))
+    norms = [_profile_norms(snapshot, weights)] + [None] * len(snapshot.deltas)
+
+    def select(n):
+        return _merge_segments(segments, [
+            _profile_search(
+                segment, partition_keys, queries, query_weights, opts, excluded[position],
+                weights, norms[position], n,
+            )
+            for position, segment in enumerate(segments)
+        ], opts, n)
+
+    start = time.time()
+    top_ids, top_scores, results = _pick(
+        snapshot, None, k, opts["diversify"], select,
+        diverse=lambda ids: _diverse_segments(segments, seeds, ids),
+        steer=_steer_segments(segments, dislikes, weights, norms, opts),
+    )
+    end = time.time()
+
+    top_tracks = _segment_tracks(segments, top_ids, top_scores, opts, dislikes, weights, norms)
+    result = {
         "top_tracks": top_tracks,
         "stats": {
-            "candidate_count": len(mb),
+            "candidate_count": sum(candidate_count for _, _, candidate_count, _ in results),
             "search_time": float(end - start),
-            "mean": float(similarities.mean()),
-            "std": float(similarities.std()),
-            "p95": float(np.quantile(similarities, 0.95)),
-            "max": float(similarities.max()),
+            "engine": "exact",
+            **_merge_stats(results),
         },
     }
+    result_cache.put(snapshot, cache_key, result)
+    return result
+
+
+def _seed_weights(seed_weights, count) -> np.ndarray:
+    """Validate the weights of the seeds of a profile, all 1 when they aren't given."""
+    if seed_weights is None:
+        return np.ones(count, dtype=np.float32)
+    seed_weights = np.asarray(seed_weights, dtype=np.float32)
+    if seed_weights.shape != (count,):
+        raise ValueError(f"Expected {count} seed weights, got {len(seed_weights)}")
+    if np.any(seed_weights < 0) or not np.any(seed_weights > 0):
+        raise ValueError("Seed weights can't be negative and at least one must be positive")
+    return seed_weights
+
+
+def _profile_search(snapshot, partition_keys, queries, query_weights, opts, excluded, weights,
+                    norms, n):
+    """
+    `_search` of the candidates of a taste profile: the rows of the seeds' partitions scored by
+    their best weighted similarity to the queries.
+
+    Returns:
+        tuple: (top_rows, top_scores, candidate_count, similarity_stats)
+    """
+    if len(queries) == 1 and len(partition_keys) == 1:
+        # a single query over a single partition, same as a one target request
+        return _search(
+            snapshot, partition_keys[0], queries[0], opts, excluded, weights, norms, "exact", n
+        )
+    # each partition is scored on its own, a Rosamerica partition is then a slice of the matrix
+    # read in place instead of rows gathered from all over it
+    parts = [_candidate_rows(snapshot, key) for key in partition_keys]
+    similarities = np.concatenate([
+        _max_similarities(snapshot, queries, query_weights, rows, weights, norms)
+        for rows in parts
+    ])
+    rows = _concat_rows(parts)
+    keep = _keep_mask(rows, excluded)
+    top_rows, top_scores, similarities = _select(snapshot, similarities, rows, keep, n, opts)
+    similarity_stats = _similarity_stats(similarities, top_scores, opts)
+    return top_rows, top_scores, len(similarities), similarity_stats
+
+
+def _concat_rows(parts):
+    """Rows of several partitions in a single array, a slice when there's only one."""
+    if len(parts) == 1:
+        return parts[0]
+    return np.concatenate([
+        np.arange(part.start, part.stop) if isinstance(part, slice) else part for part in parts
+    ])
+
+
+def _max_similarities(snapshot, queries, query_weights, rows, weights, norms) -> np.ndarray:
+    """
+    Best similarity of each candidate to the queries, each query's similarities scaled by its
+    weight, the queries are scored together one block of BATCH_MAX_SCORES scores at a time.
+    """
+    count = _row_count(rows)
+    block_size = max(1, BATCH_MAX_SCORES // len(queries))
+    similarities = np.empty(count, dtype=np.float32)
+    for start in range(0, count, block_size):
+        stop = min(start + block_size, count)
+        block = (
+            slice(rows.start + start, rows.start + stop) if isinstance(rows, slice)
+            else rows[start:stop]
+        )
+        scores = _similarities_many(snapshot, queries, block, weights, norms)
+        scores *= query_weights[:, None]
+        similarities[start:stop] = scores.max(axis=0)
+    return similarities
+
+
+def _parse_options(options) -> dict:
+    """Validate the options passed to `recommend()` and fill in the defaults."""
+    if options is None:
+        options = {}
+    if not isinstance(options, dict):
+        raise TypeError("options must be a dict")
+
+    return {
+        "k": options.get("k", 50),
+        "use_ros": options.get("use_ros", True),
+        "exclude_mbids": options.get("exclude_mbids", []),
+        "exclude_artists": options.get("exclude_artists", []),
+        "diversify": bool(options.get("diversify", False)),
+        "match_genre": options.get("match_genre", True),
+        "match_decade": options.get("match_decade", True),
+        "feature_weights": options.get("feature_weights", {}),
+        "similarity_weight": float(options.get("similarity_weight", 1.0)),
+        "popularity_weight": float(options.get("popularity_weight", 0.0)),
+        "engine": options.get("engine", "exact"),
+        "nprobe": options.get("nprobe", IVF_NPROBE),
+        "stats": _stats_mode(options.get("stats", "approx")),
+        "budget_ms": _budget_ms(options.get("budget_ms")),
+        "profile": _profile_mode(options.get("profile", "centroid")),
+        "disliked_mbids": options.get("disliked_mbids", []),
+        "dislike_weight": _dislike_weight(options.get("dislike_weight", DISLIKE_WEIGHT)),
+    }
+
+
+def _stats_mode(mode) -> str:
+    """Validate the `stats` option."""
+    if mode not in STATS_MODES:
+        raise ValueError(f"Unknown stats mode: {mode}, expected one of {', '.join(STATS_MODES)}")
+    return mode
+
+
+def _profile_mode(mode) -> str:
+    """Validate the `profile` option."""
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile: {mode}, expected one of {', '.join(PROFILE_MODES)}")
+    return mode
+
+
+def _dislike_weight(weight) -> float:
+    """Validate the `dislike_weight` option."""
+    if float(weight) < 0:
+        raise ValueError(f"The dislike weight can't be negative, got {weight}")
+    return float(weight)
+
+
+def _budget_ms(budget_ms):
+    """Validate the `budget_ms` option."""
+    if budget_ms is None:
+        return None
+    if float(budget_ms) <= 0:
+        raise ValueError(f"The latency budget must be positive, got {budget_ms}")
+    return float(budget_ms)
+
+
+def _fit_options(snapshot, opts) -> dict:
+    """
+    Ignore the options a snapshot doesn't have the arrays for, ex: a legacy NPZ feature file.
+
+    Notes:
+        Without an artist index `diversify` is ignored (plain top-k), without a popularity column
+        the scores aren't blended (similarity alone). A warning is logged the first time an
+        option is ignored for a snapshot. `exclude_artists` still raises, leaving the tracks in
+        would return the very artists the caller asked to remove.
+    """
+    ignored = []
+    if opts["diversify"] and any(segment.artist_index is None for segment in snapshot.segments):
+        ignored.append(("artist index", "diversify", {"diversify": False}))
+    if opts["popularity_weight"] != 0 and any(
+        segment.popularity is None for segment in snapshot.segments
+    ):
+        ignored.append((
+            "popularity column", "popularity_weight",
+            {"similarity_weight": 1.0, "popularity_weight": 0.0},
+        ))
+    if not ignored:
+        return opts
+    opts = dict(opts)
+    for array, option, values in ignored:
+        opts.update(values)
+        if (snapshot.generation, option) not in _ignored_options:
+            _ignored_options.add((snapshot.generation, option))
+            log.warning(
+                "The feature file has no %s, %s is ignored until it's rebuilt", array, option
+            )
+    return opts
+
+
+@timed("plan")
+def _plan(snapshot, target, target_index, opts, engine, started) -> tuple:
+    """
+    Fit an exact request to its latency budget, from the number of candidates of its partition.
+
+    Args:
+        snapshot (RecommenderSnapshot): The snapshot searched, the base when it has deltas.
+        target (RecommenderSnapshot): The snapshot or delta segment of the target row.
+        target_index (int): Row of the target track.
+        opts (dict): The parsed options.
+        engine (str): The engine picked from the options.
+        started (float): `time.perf_counter()` when the request started, the time spent before
+            the search counts against the budget.
+
+    Returns:
+        tuple: (engine, opts) the request is searched with.
+
+    Notes:
+        Only "exact" requests with a budget are planned, the graph and an asked for "ivf" engine
+        are cheap already. A request over its budget is searched with the "ivf" engine when
+        there's an IVF index, probing as many lists as the rest of the budget affords and at least
+        IVF_NPROBE, or enough for DIVERSE_POOL_FACTOR * k candidates to pass the filters. Without
+        one it stays "exact" and goes over its budget, the filters the caller turned off are never
+        turned back on to make it fit.
+    """
+    if engine != "exact" or opts["budget_ms"] is None or snapshot.ivf_index is None:
+        return engine, opts
+    remaining_ms = opts["budget_ms"] - (time.perf_counter() - started) * 1e3
+    rows = _candidate_rows(snapshot, _partition_key(target, target_index, opts))
+    candidate_count = _row_count(rows)
+    # a target only in a delta segment can have no candidates in the base
+    if candidate_count == 0 or _estimate_ms(snapshot, rows, opts["k"]) <= remaining_ms:
+        return engine, opts
+
+    nlist = snapshot.ivf_index.nlist
+    list_size = snapshot.row_count / nlist
+    # share of the probed rows expected to pass the genre/decade filters
+    share = candidate_count / snapshot.row_count
+    nprobe = max(
+        cost_model.affordable(remaining_ms, "gather") / list_size,
+        DIVERSE_POOL_FACTOR * opts["k"] / (list_size * share),
+        IVF_NPROBE,
+    )
+    return "ivf", {**opts, "nprobe": int(min(nprobe, nlist))}
+
+
+def _estimate_ms(snapshot, rows, k) -> float:
+    """Estimated time of an exact search of the candidate rows, see `budget.CostModel`."""
+    if isinstance(rows, slice):
+        estimate = cost_model.estimate_ms(_row_count(rows), "slice")
+        if rows == slice(0, snapshot.row_count) and rows.stop >= STREAM_MIN_CANDIDATES:
+            # the scan is split over the threads of the parallel scan
+            estimate /= SCAN_THREADS
+        return estimate
+    kind = "quantized" if _use_quantized(snapshot, rows, k) else "gather"
+    return cost_model.estimate_ms(len(rows), kind)
+
+
+def _partition_key(snapshot, target_index, opts) -> tuple:
+    """
+    Identifies the candidates of a target track: (use_ros, genre, decade) where genre and decade
+    are None when they aren't filtered on.
+    """
+    use_ros = opts["use_ros"]
+    genres = snapshot.genre_rosamerica if use_ros else snapshot.genre_dortmund
+    return (
+        use_ros,
+        _genre_label(genres[target_index]) if opts["match_genre"] else None,
+        int(decade_of(int(snapshot.years[target_index]))) if opts["match_decade"] else None,
+    )
+
+
+@timed("exclusions")
+def _exclusions(snapshot, opts) -> tuple:
+    """
+    Rows of the tracks in `exclude_mbids` and of the tracks credited to `exclude_artists`.
+
+    Returns:
+        tuple: (rows, key) where `key` identifies the exclusions in the result cache, a hash of
+            the excluded track rows and artist codes (None if nothing is excluded). A few
+            artists can have tens of thousands of rows, those aren't part of the key.
+
+    Raises:
+        ValueError: If artists are excluded but the feature file has no artist index.
+    """
+    track_rows = np.unique(
+        lookup_many(snapshot.mbid_keys, snapshot.mbid_rows, opts["exclude_mbids"])
+    ).astype(np.int64)
+    # disliked tracks are excluded too, they're part of the key on their own since they also
+    # change the ranking
+    disliked_rows = np.unique(
+        lookup_many(snapshot.mbid_keys, snapshot.mbid_rows, opts["disliked_mbids"])
+    ).astype(np.int64)
+    codes = np.empty(0, dtype=np.int64)
+    rows = np.concatenate([track_rows, disliked_rows])
+    if len(opts["exclude_artists"]) > 0:
+        if snapshot.artist_index is None:
+            raise ValueError("The feature file has no artist index, rebuild it to exclude artists")
+        codes = np.unique(snapshot.artist_index.codes_of(opts["exclude_artists"])).astype(np.int64)
+        rows = np.concatenate([rows, snapshot.artist_index.rows_of_codes(codes)])
+
+    if track_rows.size == 0 and codes.size == 0 and disliked_rows.size == 0:
+        return rows, None
+    key = hashlib.sha1(np.r_[len(track_rows), track_rows, codes].tobytes())
+    if disliked_rows.size > 0:
+        key.update(np.r_[opts["dislike_weight"], disliked_rows].tobytes())
+    return rows, key.hexdigest()
+
+
+@timed("dislikes")
+def _dislikes(snapshot, opts):
+    """
+    The disliked tracks of a request: (features, weight) where `features` is the feature vector
+    of each disliked track found in the snapshot (or its deltas), None if there's no penalty.
+    """
+    if len(opts["disliked_mbids"]) == 0 or opts["dislike_weight"] == 0:
+        return None
+    vectors = [
+        segment.feature_matrix[row]
+        for segment, row in map(snapshot.locate, opts["disliked_mbids"])
+        if segment is not None
+    ]
+    if not vectors:
+        return None
+    return np.stack(vectors).astype(np.float32), opts["dislike_weight"]
+
+
+@timed("dislikes")
+def _dislike_penalty(snapshot, dislikes, rows, weights, norms) -> np.ndarray:
+    """
+    Penalty of candidate rows: the dislike weight times their best similarity to a disliked
+    track, 0 when that's negative. One (disliked, rows) matrix-matrix product.
+    """
+    features, weight = dislikes
+    rows = np.asarray(rows, dtype=np.int64)
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.float32)
+    similarities = _similarities_many(snapshot, features, rows, weights, norms)
+    return weight * np.maximum(similarities.max(axis=0), 0)
+
+
+def _cache_key(target_index, opts, exclusion_key, weights, engine) -> tuple:
+    """
+    Canonical form of a request for the result cache, equivalent requests get the same key.
+
+    Notes:
+        MBIDs are resolved to rows/codes first, the order of the exclusions, duplicates or
+        unknown MBIDs don't change the key. Weights are compared as the vector they resolve to.
+    """
+    return (
+        int(target_index),
+        int(opts["k"]),
+        bool(opts["use_ros"]),
+        bool(opts["match_genre"]),
+        bool(opts["match_decade"]),
+        opts["diversify"],
+        None if weights is None else weights.tobytes(),
+        opts["similarity_weight"],
+        opts["popularity_weight"],
+        exclusion_key,
+        engine,
+        int(opts["nprobe"]) if engine == "ivf" else None,
+        opts["stats"],
+    )
+
+
+@timed("candidates")
+def _candidate_rows(snapshot, partition_key):
+    """Rows of the feature matrix that a target track is compared against."""
+    use_ros, genre, decade = partition_key
+    partitions = snapshot.ros_partitions if use_ros else snapshot.dortmund_partitions
+    return partitions.rows(genre=genre, decade=decade)
+
+
+@timed("candidates")
+def _ivf_candidates(snapshot, query_vec, partition_key, excluded, nprobe) -> np.ndarray:
+    """Rows in the IVF lists closest to the query that pass the genre/decade filters."""
+    use_ros, genre, decade = partition_key
+    partitions = snapshot.ros_partitions if use_ros else snapshot.dortmund_partitions
+    rows = snapshot.ivf_index.probe(query_vec, nprobe)
+    keep = partitions.contains(rows, genre=genre, decade=decade) & ~np.isin(rows, excluded)
+    return rows[keep]
+
+
+@timed("top_k")
+def _select(snapshot, similarities, rows, keep, k, opts):
+    """
+    Drop the excluded candidates and pick the k with the best score (see `_blend`).
+
+    Returns:
+        tuple: (top_rows, top_scores, similarities) where `top_scores` are the similarities of
+            the top rows and `similarities` the ones of the candidates that weren't excluded.
+    """
+    if keep is not None:
+        similarities = similarities[keep]
+        rows = _rows_at(rows, np.flatnonzero(keep))
+    top_indexes = top_k(_blend(snapshot, similarities, rows, opts), k)
+    return _rows_at(rows, top_indexes), similarities[top_indexes], similarities
+
+
+def _blends(opts) -> bool:
+    """Whether candidates are ranked by a blended score rather than by similarity alone."""
+    return opts["similarity_weight"] != 1 or opts["popularity_weight"] != 0
+
+
+def _blend(snapshot, similarities, rows, opts) -> np.ndarray:
+    """
+    Score of the candidates, `similarity_weight * similarity + popularity_weight * popularity`,
+    the similarities themselves when they're not blended.
+
+    Raises:
+        ValueError: If popularity counts but the feature file has no popularity column.
+    """
+    if not _blends(opts):
+        return similarities
+    scores = opts["similarity_weight"] * similarities
+    if opts["popularity_weight"] != 0:
+        if snapshot.popularity is None:
+            raise ValueError(
+                "The feature file has no popularity column, rebuild it to blend scores"
+            )
+        scores += opts["popularity_weight"] * snapshot.popularity[rows]
+    return scores
+
+
+def _pick(snapshot, target_index, k, diversify, select, diverse=None, steer=None):
+    """
+    Pick the k results from `select(n)`, which returns (top_rows, top_scores, *rest) for the n
+    most similar candidates.
+
+    With `diversify` the candidates are taken from a larger pool and only the best track of each
+    artist is kept (see `_diverse`, or `diverse(top_rows)` when given), the pool grows until it
+    has k of them or holds every candidate. `rest` comes from the last call.
+
+    With `steer`, a (blend, penalty) pair, the pool is ranked by `blend(top_rows, top_scores)`
+    minus `penalty(top_rows)`, the dislike penalty of the candidates.
+
+    Notes:
+        The penalty is never negative: a candidate outside of the best n by score can't beat the
+        n-th one once penalized. A steered pool starts at k + DISLIKE_POOL_SIZE candidates and
+        grows DISLIKE_POOL_GROWTH times until the last picked penalized score is at least the n-th
+        score or the pool holds every candidate, the picks are then the same as penalizing every
+        candidate. Only the k picks have to be exact, not the whole pool `diversify` looks at.
+    """
+    if not diversify and steer is None:
+        return select(k)
+    n = DIVERSE_POOL_FACTOR * k if diversify else k
+    if steer is not None:
+        n = max(n, k + DISLIKE_POOL_SIZE)
+    while True:
+        top_rows, top_scores, *rest = select(n)
+        exact = True
+        if steer is not None:
+            blend, penalty = steer
+            scores = blend(top_rows, top_scores)
+            penalized = scores - penalty(top_rows)
+            order = top_k(penalized, len(penalized))
+            top_rows, top_scores, penalized = top_rows[order], top_scores[order], penalized[order]
+        if diversify:
+            keep = (
+                _diverse(snapshot, target_index, top_rows) if diverse is None
+                else diverse(top_rows)
+            )
+            positions = np.flatnonzero(keep)[:k]
+        else:
+            positions = np.arange(min(k, len(top_rows)))
+        if steer is not None and len(positions) > 0:
+            exact = penalized[positions[-1]] >= scores[-1]
+        if len(top_rows) < n or (len(positions) >= k and exact):
+            return (top_rows[positions], top_scores[positions], *rest)
+        n *= DIVERSE_POOL_GROWTH if steer is None else DISLIKE_POOL_GROWTH
+
+
+@timed("diversify")
+def _diverse(snapshot, target_index, top_rows) -> np.ndarray:
+    """
+    Mask of the ranked rows that are the best track of their artist, leaving out the target's
+    song (same title) by the same artist. Tracks without an artist count as one artist.
+
+    Raises:
+        ValueError: If the feature file has no artist index.
+    """
+    if snapshot.artist_index is None:
+        raise ValueError("The feature file has no artist index, rebuild it to diversify artists")
+    primary_artists = snapshot.artist_index.primary_artists
+    artists = primary_artists[top_rows]
+
+    target_artist = primary_artists[target_index]
+    same_song = np.zeros(len(top_rows), dtype=bool)
+    if target_artist >= 0 and snapshot.title_hashes is not None:
+        same_song = (artists == target_artist) & (
+            snapshot.title_hashes[top_rows] == snapshot.title_hashes[target_index]
+        )
+    return _first_per_artist(artists, same_song)
+
+
+def _first_per_artist(artists, same_song) -> np.ndarray:
+    """Mask of the first position of each artist in a ranked array, skipping `same_song`."""
+    # rows are ranked best first, np.unique returns the first position of each artist
+    candidates = np.flatnonzero(~same_song)
+    _, first = np.unique(artists[candidates], return_index=True)
+    keep = np.zeros(len(artists), dtype=bool)
+    keep[candidates[first]] = True
+    return keep
+
+
+def _uses_graph(snapshot, opts, weights) -> bool:
+    """Whether the neighbour graph was built for the options of a request."""
+    graph = snapshot.neighbour_graph
+    return (
+        graph is not None
+        and weights is None
+        and opts["use_ros"]
+        and opts["match_genre"]
+        and opts["match_decade"]
+        and opts["stats"] != "exact"
+        and len(opts["disliked_mbids"]) == 0
+        and opts["similarity_weight"] == graph.similarity_weight
+        and opts["popularity_weight"] == graph.popularity_weight
+    )
+
+
+@timed("graph")
+def _graph_pick(snapshot, target_index, query_vec, k, opts, excluded):
+    """
+    Pick the k results from the target's neighbours in the graph, dropping the excluded ones and,
+    with `diversify`, the ones `_diverse` leaves out.
+
+    Returns:
+        tuple: (top_rows, top_scores, candidate_count, similarity_stats) like `_search`, None when
+            fewer than k neighbours are left and the graph doesn't hold the whole partition.
+    """
+    graph = snapshot.neighbour_graph
+    _, genre, decade = _partition_key(snapshot, target_index, opts)
+    partition_size = _row_count(snapshot.ros_partitions.rows(genre=genre, decade=decade))
+    neighbours = graph.neighbours_of(target_index).astype(np.int64)
+    is_complete = len(neighbours) >= partition_size - 1
+    neighbours = neighbours[~np.isin(neighbours, excluded)]
+    if opts["diversify"]:
+        neighbours = neighbours[_diverse(snapshot, target_index, neighbours)]
+    if len(neighbours) < k and not is_complete:
+        return None
+
+    top_rows = neighbours[:k]
+    # the graph stores float16 scores, the similarities of the k results are computed exactly
+    top_scores = _similarities(snapshot, query_vec, top_rows, None)
+    # excluded rows are looked up in the partition index, not the other way around
+    excluded_candidates = snapshot.ros_partitions.contains(
+        np.unique(excluded), genre=genre, decade=decade
+    )
+    candidate_count = partition_size - int(np.count_nonzero(excluded_candidates))
+    if opts["stats"] == "none" or partition_size <= 1:
+        similarity_stats = {"mode": opts["stats"], **empty_stats()}
+    else:
+        mean, std, p95, max_score = (float(value) for value in graph.stats[target_index])
+        similarity_stats = {
+            "mode": "approx", "mean": mean, "std": std, "p95": p95, "max": max_score,
+        }
+    return top_rows, top_scores, candidate_count, similarity_stats
+
+
+def _use_quantized(snapshot, rows, k) -> bool:
+    """Whether the candidates are scattered rows worth ranking with the int8 matrix first."""
+    return (
+        snapshot.quantized_matrix is not None
+        and not isinstance(rows, slice)
+        and len(rows) > _shortlist_size(k)
+    )
+
+
+def _shortlist_size(k) -> int:
+    """Number of candidates re-scored exactly after the int8 first pass."""
+    return max(QUANTIZED_SHORTLIST, QUANTIZED_SHORTLIST_FACTOR * k)
+
+
+@timed("rerank")
+def _rerank(snapshot, query_vec, approximate, rows, keep, k, weights, norms, opts):
+    """
+    Keep the best candidates by approximate score, re-score them with the float32 features
+    and pick the k best ones.
+
+    Returns:
+        tuple: (top_rows, top_scores, similarities) like `_select`, `similarities` are the
+            approximate scores of the candidates that weren't excluded.
+    """
+    if keep is not None:
+        approximate = approximate[keep]
+        rows = rows[keep]
+    # back in candidate order, ties are then broken the same way as a full exact search
+    shortlist = np.sort(top_k(_blend(snapshot, approximate, rows, opts), _shortlist_size(k)))
+    similarities = _similarities(snapshot, query_vec, rows[shortlist], weights, norms)
+    top_indexes = top_k(_blend(snapshot, similarities, rows[shortlist], opts), k)
+    return rows[shortlist[top_indexes]], similarities[top_indexes], approximate
+
+
+@timed("results")
+def _result(snapshot, target_index, top_rows, top_scores, opts, stats, penalties=None) -> dict:
+    """Build the dict returned by `recommend()`, `penalties` are the dislike penalties if any."""
+    # build a list of the top most similar tracks and their metadata
+    scores = _blend(snapshot, top_scores, top_rows, opts)
+    if penalties is not None:
+        scores = scores - penalties
+    top_tracks = [
+        _track(snapshot, row, similarity, score)
+        for row, similarity, score in zip(top_rows, top_scores, scores)
+    ]
+    return _response(snapshot, target_index, top_tracks, stats)
+
+
+def _track(snapshot, row, similarity, score) -> dict:
+    """One of the `top_tracks` of a result."""
+    return {
+        "mbid": snapshot.mbid_at(row),
+        "similarity": similarity,
+        "score": score,
+        "year": snapshot.years[row],
+        "genre_dortmund": snapshot.genre_dortmund[row],
+        "genre_rosamerica": snapshot.genre_rosamerica[row],
+    }
+
+
+def _response(snapshot, target_index, top_tracks, stats) -> dict:
+    """The dict returned by `recommend()` for a target row of a snapshot (or delta segment)."""
+    return {
+        "target_year": int(snapshot.years[target_index]),
+        "target_genre_dortmund": snapshot.genre_dortmund[target_index],
+        "target_genre_rosamerica": snapshot.genre_rosamerica[target_index],
+        "top_tracks": top_tracks,
+        "stats": stats,
+    }
+
+
+@timed("score")
+def _similarities(snapshot, query_vec, rows, weights, norms=None) -> np.ndarray:
+    """Cosine similarity between the query and each (weighted) candidate row."""
+    candidate_norms = _candidate_norms(snapshot, rows, weights, norms)
+    return weighted_cosine(
+        query_vec,
+        snapshot.feature_matrix[rows],
+        _candidates_sq(snapshot, rows, candidate_norms),
+        weights=weights,
+        candidate_norms=candidate_norms,
+    )
+
 
+@timed("score")
+def _similarities_many(snapshot, query_vecs, rows, weights, norms=None) -> np.ndarray:
+    """Cosine similarity between several queries and each candidate row, one row per query."""
+    candidate_norms = _candidate_norms(snapshot, rows, weights, norms)
+    return weighted_cosine_many(
+        query_vecs,
+        snapshot.feature_matrix[rows],
+        _candidates_sq(snapshot, rows, candidate_norms),
+        weights=weights,
+        candidate_norms=candidate_norms,
+    )
 
-def get_feature_stats():
+
+@timed("norms")
+def _profile_norms(snapshot, weights):
+    """
+    Weighted norms of every row for a weight profile from the norm cache, None when the weights
+    are all 1 (the exported norms are used) or the profile isn't cached.
+    """
+    if weights is None:
+        return None
+    return norm_cache.get(snapshot, weights)
+
+
+def _candidate_norms(snapshot, rows, weights, norms):
+    """Weighted norms of the candidate rows, None if they have to be computed."""
+    if weights is None:
+        return snapshot.feature_norms[rows]
+    return None if norms is None else norms[rows]
+
+
+def _candidates_sq(snapshot, rows, candidate_norms):
+    """
+    Squared features of the candidate rows, only gathered when their norms have to be computed:
+    indexing with an array of rows copies them.
+    """
+    return snapshot.feature_matrix_sq[rows] if candidate_norms is None else None
+
+
+@timed("stats")
+def _similarity_stats(similarities, top_scores, opts) -> dict:
+    """Stats about the similarity scores of the candidates, computed as the `stats` option says."""
+    mode = opts["stats"]
+    if mode == "none":
+        return {"mode": "none", **empty_stats()}
+    if mode == "exact" or len(similarities) <= SAMPLE_SIZE:
+        return {"mode": "exact", **exact_stats(similarities)}
+    # the best similarity is already known from the top-k when it's ranked by similarity alone,
+    # only the sample is read
+    return {"mode": "approx", **sample_stats(
+        similarities,
+        max_score=top_scores.max() if len(top_scores) and not _blends(opts) else None,
+    )}
+
+
+@timed("scan")
+def _scan(snapshot, query_vec, weights, norms, keep, opts, n):
+    """
+    Top n candidates of the whole feature matrix, scored block by block. With SCAN_THREADS > 1
+    the rows are split into shards of SCAN_SHARD_SIZE scanned by the thread pool.
+
+    Returns:
+        tuple: (top_rows, top_scores, running_stats), the stats of the similarities or None when
+            the `stats` option is "none".
+    """
+    def scan_rows(start, stop):
+        running_stats = None if opts["stats"] == "none" else RunningStats()
+        top_rows, top_scores = stream_top_k(
+            _score_blocks(
+                snapshot, query_vec, weights, norms, keep, running_stats, opts, start, stop
+            ),
+            n,
+        )
+        return top_rows, top_scores, running_stats
+
+    if SCAN_THREADS <= 1 or snapshot.row_count <= SCAN_SHARD_SIZE:
+        return scan_rows(0, snapshot.row_count)
+
+    shards = [
+        (start, min(start + SCAN_SHARD_SIZE, snapshot.row_count))
+        for start in range(0, snapshot.row_count, SCAN_SHARD_SIZE)
+    ]
+    results = list(_get_scan_pool().map(lambda shard: scan_rows(*shard), shards))
+
+    # merge the local top n of each shard, ties are broken by row like in a single scan
+    rows = np.concatenate([top_rows for top_rows, _, _ in results])
+    scores = np.concatenate([top_scores for _, top_scores, _ in results])
+    winners = top_k(scores, n, tiebreak=rows)
+    running_stats = None
+    if opts["stats"] != "none":
+        running_stats = RunningStats()
+        for _, _, shard_stats in results:
+            running_stats.merge(shard_stats)
+    return rows[winners], scores[winners], running_stats
+
+
+def _score_blocks(
+    snapshot, query_vec, weights, norms, keep, running_stats, opts, start=0, stop=None
+):
     """
-    Compute general stats about the audio features across all tracks.
+    Yields (rows, scores) for consecutive blocks of the feature matrix rows [start, stop) (all
+    of them by default), skipping the rows dropped by `keep`, see `_blend`. Stats about the
+    similarities are collected into `running_stats` unless it's None.
+    """
+    stop = snapshot.row_count if stop is None else stop
+    for block_start in range(start, stop, STREAM_BLOCK_SIZE):
+        block_end = min(block_start + STREAM_BLOCK_SIZE, stop)
+        block_rows = np.arange(block_start, block_end)
+        block = slice(block_start, block_end)
+        similarities = _similarities(snapshot, query_vec, block, weights, norms)
+        if keep is not None:
+            block_keep = keep[block_start:block_end]
+            block_rows, similarities = block_rows[block_keep], similarities[block_keep]
+            block = block_rows
+        if running_stats is not None:
+            running_stats.update(similarities)
+        yield block_rows, _blend(snapshot, similarities, block, opts)
+
+
+def _genre_label(genre) -> str:
+    """Genre as it's stored in the partition index, missing genres are ""."""
+    return "" if genre is None else str(genre)
+
+
+def _row_count(rows) -> int:
+    """Number of candidates in a slice or index array of rows."""
+    if isinstance(rows, slice):
+        return rows.stop - rows.start
+    return len(rows)
+
+
+def _rows_at(rows, positions) -> np.ndarray:
+    """Feature matrix rows at the given positions of the candidates (a slice or an index array)."""
+    if isinstance(rows, slice):
+        return positions + rows.start
+    return rows[positions]
+
+
+@timed("candidates")
+def _keep_mask(rows, excluded):
+    """
+    Boolean mask over the candidate rows that drops the excluded ones, sized to the candidates
+    rather than the catalogue. Returns None if none of the excluded rows are candidates.
+    """
+    if isinstance(rows, slice):
+        excluded = excluded[(excluded >= rows.start) & (excluded < rows.stop)]
+        if excluded.size == 0:
+            return None
+        keep = np.ones(rows.stop - rows.start, dtype=bool)
+        keep[excluded - rows.start] = False
+        return keep
+
+    keep = ~np.isin(rows, excluded)
+    return None if keep.all() else keep
+
+
+def get_feature_stats(recompute=False):
+    """
+    General stats about the audio features across all tracks, see `catalogue_stats`.
+
+    Args:
+        recompute (bool): Compute the stats from the feature matrix instead of reading the ones
+            `build_database` stored with it.
 
     Returns:
-        dict: A dictionary containing:
+        dict: A dictionary containing (among others):
             - "unique_track_count" (int): Total number of tracks in the dataset.
             - "unique_vector_count" (int): Number of unique feature vectors.
             - "near_zero_col_count" (int): Number of feature columns with
               near-zero variance (< 1e-6 standard deviation).
             - "total_col_count" (int): Total number of feature columns.
-    """
-    # How many unique vectors exist, to check if multiple tracks have the same features
-    rounded = np.round(feature_matrix, 4)
-    _, unique_idx = np.unique(rounded, axis=0, return_index=True)
 
-    # Column-wise variance (near-zero variance columns kill discrimination)
-    col_std = feature_matrix.std(axis=0)
-    zero_var_cols = (col_std < 1e-6).sum()
-
-    return {
-        "unique_track_count": len(mbid_to_idx),
-        "unique_vector_count": unique_idx.size,
-        "near_zero_col_count": int(zero_var_cols),
-        "total_col_count": col_std.size,
-    }
+    Notes:
+        Recomputing the stats sorts the whole feature matrix, feature files exported before the
+        stats were stored are always recomputed.
+    """
+    snapshot = get_snapshot()
+    if snapshot.catalogue_stats is not None and not recompute:
+        return snapshot.catalogue_stats
+    return catalogue_stats(np.asarray(snapshot.feature_matrix), snapshot.feature_names)
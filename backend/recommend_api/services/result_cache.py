@@ -0,0 +1,133 @@
+# In-process LRU cache of `recommend()` results
+# Popular seed tracks are requested over and over with the same options, their ranked results are
+# kept in memory for a while. Entries are bounded by an estimate of their size in bytes and by age.
+# The cache belongs to one snapshot, publishing a new feature file version clears it. Requests still
+# running on the previous snapshot after a reload bypass the cache instead of clearing it again.
+import sys, threading, time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Least recently used cache with a time to live and a size bound in bytes.
+
+    Notes:
+        Results are copied on the way in and out, callers are free to modify what they get.
+        A `max_bytes` of 0 disables the cache (every lookup is a miss, nothing is stored).
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, result)
+        self._snapshot = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, snapshot, key):
+        """
+        Returns a copy of the cached result for a key, None if it isn't cached.
+
+        Args:
+            snapshot (RecommenderSnapshot): The snapshot the result would be computed from.
+            key (tuple): Canonical form of the request.
+        """
+        with self._lock:
+            entry = self._entries.get(key) if self._check_snapshot(snapshot) else None
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, result = entry
+            if time.monotonic() >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return _copy_result(result)
+
+    def put(self, snapshot, key, result):
+        """
+        Store a copy of a result, least recently used entries are evicted to make room for it.
+        """
+        size = _result_size(result)
+        if size > self.max_bytes:
+            return
+        result = _copy_result(result)
+        with self._lock:
+            if not self._check_snapshot(snapshot):
+                return
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self._size + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (time.monotonic() + self.ttl, size, result)
+            self._size += size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        """Counters used to size the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "version": None if self._snapshot is None else self._snapshot.version,
+            }
+
+    def _check_snapshot(self, snapshot) -> bool:
+        """
+        Drop every entry when results start coming from a newer snapshot. Returns False for an
+        older snapshot than the cache's (a request that started before a reload), which bypasses
+        the cache.
+        """
+        if snapshot is self._snapshot:
+            return True
+        if self._snapshot is not None and snapshot.generation < self._snapshot.generation:
+            return False
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+        self._size = 0
+        self._snapshot = snapshot
+        return True
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+
+def _copy_result(result) -> dict:
+    """Copy of a result's dicts and track list, the values themselves are immutable."""
+    return {
+        **result,
+        "top_tracks": [dict(track) for track in result["top_tracks"]],
+        "stats": dict(result["stats"]),
+    }
+
+
+def _result_size(result) -> int:
+    """Approximate memory used by a `recommend()` result."""
+    size = sys.getsizeof(result) + sys.getsizeof(result["stats"])
+    for track in result["top_tracks"]:
+        size += sys.getsizeof(track) + sum(sys.getsizeof(value) for value in track.values())
+    return size
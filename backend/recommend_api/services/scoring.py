@@ -0,0 +1,100 @@
+# Weighted cosine similarity kernel used by the recommender
+# Both the query and the candidates are weighted, the weights are folded into the query vector
+# instead of being multiplied into a copy of the candidate rows, the weighted norm of each
+# candidate comes from the squared features:
+#
+#   cos(q * w, x * w) = sum(w_i^2 * q_i * x_i) / (|q * w| * sqrt(sum(w_i^2 * x_i^2)))
+#
+# The numerator is one matrix-vector product over the candidate rows, so is the denominator when
+# the weights aren't all 1 and the weighted norms aren't given (the recommender caches them per
+# weight profile). Only the output arrays (one float32 per candidate) are allocated.
+import numpy as np
+
+
+def feature_weights_vector(feature_names, feature_weights: dict):
+    """
+    Build the weight of each feature column from a dict of weights keyed by feature name, missing
+    features default to 1. Returns None when every weight is 1 (no weighting needed).
+    """
+    weights = np.ones(len(feature_names), dtype=np.float32)
+    for i, name in enumerate(feature_names):
+        if name in feature_weights:
+            weights[i] = feature_weights[name]
+    return None if np.all(weights == 1) else weights
+
+
+def row_norms(feature_matrix_sq) -> np.ndarray:
+    """
+    L2 norm of each row, computed from the squared features.
+    """
+    return np.sqrt(feature_matrix_sq.sum(axis=1, dtype=np.float32))
+
+
+def weighted_norms(feature_matrix_sq, weights=None) -> np.ndarray:
+    """
+    L2 norm of each weighted row `|x * w|`, computed from the squared features.
+    """
+    if weights is None:
+        return row_norms(feature_matrix_sq)
+    return np.sqrt(feature_matrix_sq @ np.square(weights, dtype=np.float32))
+
+
+def weighted_cosine(query, candidates, candidates_sq, weights=None, candidate_norms=None):
+    """
+    Cosine similarity between the weighted query vector and each weighted candidate row,
+    `cos(q * w, x * w)`.
+
+    Args:
+        query (np.ndarray): 1D feature vector of the target track.
+        candidates (np.ndarray): 2D matrix of candidate rows, usually a view of the feature matrix.
+        candidates_sq (np.ndarray): Element-wise square of `candidates`, only used (and can be
+            None) when the norms aren't given, see `candidate_norms`.
+        weights (np.ndarray, optional): Weight of each feature, None means all weights are 1.
+        candidate_norms (np.ndarray, optional): Precomputed norms of the weighted candidates
+            (see `weighted_norms`), computed from `candidates_sq` if they aren't given.
+
+    Returns:
+        np.ndarray: float32 similarity of each candidate, 0 for zero vectors.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    if weights is not None:
+        query = query * weights
+    # the candidates' weights are folded into the query: (x * w) . (q * w) = x . (q * w^2)
+    scores = candidates @ (query if weights is None else query * weights)
+    if candidate_norms is None:
+        candidate_norms = weighted_norms(candidates_sq, weights)
+
+    scores = scores.astype(np.float32, copy=False)
+    scores *= _inverse(candidate_norms)
+    scores *= _inverse(np.linalg.norm(query))
+    return scores
+
+
+def weighted_cosine_many(queries, candidates, candidates_sq, weights=None, candidate_norms=None):
+    """
+    Same as `weighted_cosine` for several query vectors at once, the scores come from a single
+    matrix-matrix product.
+
+    Args:
+        queries (np.ndarray): 2D matrix with one query vector per row.
+
+    Returns:
+        np.ndarray: float32 matrix of shape (queries, candidates), one row of scores per query.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    if weights is not None:
+        queries = queries * weights
+    scores = (queries if weights is None else queries * weights) @ candidates.T
+    if candidate_norms is None:
+        candidate_norms = weighted_norms(candidates_sq, weights)
+
+    scores = scores.astype(np.float32, copy=False)
+    scores *= _inverse(candidate_norms)[None, :]
+    scores *= _inverse(np.linalg.norm(queries, axis=1))[:, None]
+    return scores
+
+
+def _inverse(norms):
+    """1 / norm as float32, 0 for zero norms so zero vectors get a similarity of 0."""
+    norms = np.asarray(norms, dtype=np.float32)
+    return np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)
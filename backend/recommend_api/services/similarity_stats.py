@@ -0,0 +1,103 @@
+# Summary statistics of similarity scores that can be updated one block of scores at a time
+import numpy as np
+
+# Number of scores `sample_stats` estimates the mean, std and percentile from
+SAMPLE_SIZE = 4096
+
+
+class RunningStats:
+    """
+    Mean, standard deviation, max and an approximate 95th percentile of similarity scores.
+
+    Notes:
+        The percentile is read from a fixed histogram over [-1, 1] (cosine similarity range), it's
+        accurate to about 1 / BINS. Mean, std and max are exact.
+    """
+    BINS = 2048
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.max = -np.inf
+        self.histogram = np.zeros(self.BINS, dtype=np.int64)
+
+    def update(self, scores):
+        if len(scores) == 0:
+            return
+        self.count += len(scores)
+        self.total += float(scores.sum(dtype=np.float64))
+        self.total_sq += float(np.dot(scores, scores))
+        self.max = max(self.max, float(scores.max()))
+        bins = ((np.clip(scores, -1.0, 1.0) + 1.0) * (self.BINS / 2)).astype(np.int64)
+        self.histogram += np.bincount(np.minimum(bins, self.BINS - 1), minlength=self.BINS)
+
+    def merge(self, other: "RunningStats"):
+        """Add the scores collected by another instance, ex: one per shard of a parallel scan."""
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.max = max(self.max, other.max)
+        self.histogram += other.histogram
+
+    def quantile(self, q: float):
+        if self.count == 0:
+            return None
+        cumulative = np.cumsum(self.histogram)
+        bin_index = int(np.searchsorted(cumulative, q * self.count))
+        # report the middle of the bin
+        return (bin_index + 0.5) * (2.0 / self.BINS) - 1.0
+
+    def result(self) -> dict:
+        if self.count == 0:
+            return empty_stats()
+        mean = self.total / self.count
+        return {
+            "mean": mean,
+            "std": float(np.sqrt(max(self.total_sq / self.count - mean * mean, 0.0))),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+        }
+
+
+def empty_stats() -> dict:
+    """Stats of a request that didn't ask for them (or had no candidates)."""
+    return {"mean": None, "std": None, "p95": None, "max": None}
+
+
+def exact_stats(scores) -> dict:
+    """
+    Mean, standard deviation, 95th percentile and max of an array of similarity scores.
+    """
+    if len(scores) == 0:
+        return empty_stats()
+    return {
+        "mean": float(scores.mean()),
+        "std": float(scores.std()),
+        "p95": float(np.quantile(scores, 0.95)),
+        "max": float(scores.max()),
+    }
+
+
+def sample_stats(scores, max_score=None, sample_size: int = SAMPLE_SIZE, seed: int = 0) -> dict:
+    """
+    Mean, standard deviation and 95th percentile estimated from a uniform sample of the scores.
+
+    Args:
+        scores (np.ndarray): Similarity scores.
+        max_score (float, optional): Max of the scores if the caller already knows it (ex: the best
+            top-k score), otherwise it's computed over every score.
+        sample_size (int): Number of scores sampled (with replacement).
+        seed (int): Random seed, the same scores always give the same stats.
+
+    Notes:
+        Arrays of up to `sample_size` scores get exact stats. With the default sample size the mean
+        and p95 are within about 0.01 of the exact values for cosine similarities.
+    """
+    if len(scores) <= sample_size:
+        return exact_stats(scores)
+    sample = scores[np.random.default_rng(seed).integers(0, len(scores), sample_size)]
+    return {
+        **exact_stats(sample),
+        "max": float(scores.max() if max_score is None else max_score),
+    }
@@ -0,0 +1,232 @@
+# Immutable view of one version of the feature file and the indexes built on top of it
+# The recommender serves every request from a single snapshot, a newly published feature file is
+# loaded into a new snapshot and swapped in while requests in flight finish on the old one.
+import itertools
+import numpy as np
+from dataclasses import dataclass, replace
+from typing import Mapping, Optional
+from .artist_index import ArtistIndex
+from .columns import CategoricalColumn
+from .ivf import IVFIndex
+from .mbid_index import build_mbid_index, key_to_mbid, lookup, lookup_many
+from .neighbours import NeighbourGraph
+from .partitions import PartitionIndex
+from .quantize import QuantizedMatrix
+from .scoring import row_norms
+
+# order in which snapshots are loaded, see `RecommenderSnapshot.generation`
+_generations = itertools.count(1)
+
+
+@dataclass
+class RecommenderSnapshot:
+    # content hash of the artifact the snapshot was loaded from, None for arrays loaded otherwise
+    version: Optional[str]
+    # all arrays of the feature file, the ones only some requests need (ex: raw features) are
+    # read from here on demand
+    data: Mapping
+    feature_matrix: np.ndarray
+    feature_names: np.ndarray
+    # squared features and the unweighted norm of each row, see `scoring.weighted_cosine`
+    feature_matrix_sq: np.ndarray
+    feature_norms: np.ndarray
+    # int8 copy of the features, a quarter of the bytes to read when candidates are scattered rows
+    quantized_matrix: Optional[QuantizedMatrix]
+    # MBID of each row, 16-byte binary keys (strings in older feature files), see `mbid_at`
+    mbids: np.ndarray
+    # sorted MBID keys + the row each one points to, used for O(log n) lookups
+    mbid_keys: np.ndarray
+    mbid_rows: np.ndarray
+    years: np.ndarray  # release year
+    # genre classifications, a small integer code per row + the list of genre labels
+    genre_dortmund: CategoricalColumn
+    genre_rosamerica: CategoricalColumn
+    # rows grouped by (genre, decade) for each classification
+    ros_partitions: PartitionIndex
+    dortmund_partitions: PartitionIndex
+    # optional approximate search index, None if the file doesn't have one
+    ivf_index: Optional[IVFIndex]
+    # artists credited on each row and the rows of each artist, None for older feature files
+    artist_index: Optional[ArtistIndex] = None
+    # 64-bit hash of each track's title, see `columns.hash_strings`, None for older feature files
+    title_hashes: Optional[np.ndarray] = None
+    # log1p(submissions) of each track, float32, None for older feature files
+    popularity: Optional[np.ndarray] = None
+    # best neighbours of every row for the default options, added by `build_neighbours`, None if
+    # the feature file doesn't have them
+    neighbour_graph: Optional[NeighbourGraph] = None
+    # stats about the whole catalogue computed by `build_database`, None for older feature files
+    # and arrays that don't come from an artifact, see `catalogue_stats`
+    catalogue_stats: Optional[dict] = None
+    # delta segments published after this (base) snapshot, oldest first, each one is a snapshot
+    # of its own rows, see `artifacts.save_delta`
+    deltas: tuple = ()
+    # MBID keys of the tracks a delta segment removes or replaces in the segments before it
+    tombstones: Optional[np.ndarray] = None
+    # sorted rows of this segment removed by the tombstones of a later one, None if there are none
+    hidden_rows: Optional[np.ndarray] = None
+    # increases with every snapshot loaded, the caches tell the snapshot requests still running
+    # after a reload from the new one by it
+    generation: int = 0
+
+    @classmethod
+    def load(cls, data, version: str = None, deltas=()):
+        """
+        Build a snapshot from the arrays exported by `build_database`.
+
+        Args:
+            data (Mapping): An `ArtifactStore`, a legacy NPZ file or a dict of arrays.
+            version (str, optional): Version of the arrays, ex: the artifact's content hash.
+            deltas (list[Mapping], optional): Arrays of the delta segments, oldest first.
+
+        Notes:
+            The MBID index (`mbid_keys`, `mbid_rows`), the (genre, decade) partitions, the squared
+            features and the int8 matrix are built on the fly if they're missing, genres stored as
+            strings are dictionary-encoded, this keeps feature files exported before them usable.
+        """
+        if isinstance(data, np.lib.npyio.NpzFile):
+            # an NPZ file decompresses a whole array on every access, they're read once here so
+            # the ones read on demand (ex: raw features) don't decompress it again for each row
+            data = {name: data[name] for name in data.files}
+        feature_matrix = data["feature_matrix"]
+        years = data["years"]
+
+        if "feature_matrix_sq" in data:
+            feature_matrix_sq = data["feature_matrix_sq"]
+        else:
+            feature_matrix_sq = np.square(feature_matrix)
+        if "feature_norms" in data:
+            feature_norms = data["feature_norms"]
+        else:
+            feature_norms = row_norms(feature_matrix_sq)
+
+        mbids = data["mbids"]
+        if "mbid_keys" in data and "mbid_rows" in data:
+            mbid_keys, mbid_rows = data["mbid_keys"], data["mbid_rows"]
+        else:
+            mbid_keys, mbid_rows = build_mbid_index(mbids)
+
+        genre_dortmund = CategoricalColumn.from_arrays(data, "genre_dortmund")
+        genre_rosamerica = CategoricalColumn.from_arrays(data, "genre_rosamerica")
+
+        # the export stores the matrix sorted by Rosamerica partition so those are plain slices,
+        # Dortmund goes through a row permutation
+        ros_partitions = (
+            PartitionIndex.from_arrays(data, "ros")
+            or PartitionIndex.build(genre_rosamerica.labels(), years)
+        )
+        dortmund_partitions = (
+            PartitionIndex.from_arrays(data, "dortmund")
+            or PartitionIndex.build(genre_dortmund.labels(), years)
+        )
+
+        snapshot = cls(
+            version=version,
+            data=data,
+            feature_matrix=feature_matrix,
+            feature_names=data["feature_names"],
+            feature_matrix_sq=feature_matrix_sq,
+            feature_norms=feature_norms,
+            quantized_matrix=(
+                QuantizedMatrix.from_arrays(data) or QuantizedMatrix.build(feature_matrix)
+            ),
+            mbids=mbids,
+            mbid_keys=mbid_keys,
+            mbid_rows=mbid_rows,
+            years=years,
+            genre_dortmund=genre_dortmund,
+            genre_rosamerica=genre_rosamerica,
+            ros_partitions=ros_partitions,
+            dortmund_partitions=dortmund_partitions,
+            ivf_index=IVFIndex.from_arrays(data),
+            artist_index=ArtistIndex.from_arrays(data),
+            title_hashes=data["title_hashes"] if "title_hashes" in data else None,
+            popularity=data["popularity"] if "popularity" in data else None,
+            neighbour_graph=NeighbourGraph.from_arrays(data),
+            catalogue_stats=getattr(data, "metadata", {}).get("catalogue_stats"),
+            tombstones=data["tombstones"] if "tombstones" in data else None,
+            generation=next(_generations),
+        )
+        if deltas:
+            snapshot = snapshot.with_deltas([cls.load(delta) for delta in deltas])
+        return snapshot
+
+    def with_deltas(self, deltas):
+        """
+        A copy of this (base) snapshot with delta segments after it, the rows each segment's
+        tombstones remove from the segments before it are resolved once here.
+        """
+        segments = [replace(self, deltas=()), *deltas]
+        for i, segment in enumerate(segments):
+            later = [d.tombstones for d in segments[i + 1:] if d.tombstones is not None]
+            hidden = None
+            if later:
+                rows = lookup_many(segment.mbid_keys, segment.mbid_rows, np.concatenate(later))
+                hidden = np.unique(rows) if len(rows) else None
+            segments[i] = replace(segment, hidden_rows=hidden)
+        return replace(segments[0], deltas=tuple(segments[1:]))
+
+    @property
+    def segments(self) -> tuple:
+        """This snapshot followed by its delta segments."""
+        return (self, *self.deltas)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.feature_matrix)
+
+    def find_index(self, mbid) -> int:
+        """
+        Returns the row of a track in the feature matrix, or -1 if the MBID is unknown.
+        """
+        return lookup(self.mbid_keys, self.mbid_rows, mbid)
+
+    def locate(self, mbid) -> tuple:
+        """
+        Returns (segment, row) of a track in the newest segment that has it, (None, -1) if the
+        MBID is unknown or was removed by a tombstone.
+        """
+        for segment in reversed(self.segments):
+            row = segment.find_index(mbid)
+            if row >= 0:
+                return (None, -1) if segment.is_hidden(row) else (segment, row)
+        return None, -1
+
+    def is_hidden(self, row) -> bool:
+        """Whether a row was removed by the tombstones of a later segment."""
+        if self.hidden_rows is None:
+            return False
+        position = int(np.searchsorted(self.hidden_rows, row))
+        return position < len(self.hidden_rows) and self.hidden_rows[position] == row
+
+    def mbid_at(self, row) -> str:
+        """
+        Returns the MBID of a row in the feature matrix.
+        """
+        mbid = self.mbids[row]
+        return key_to_mbid(mbid) if isinstance(mbid, bytes) else str(mbid)
+
+    def raw_features(self, row):
+        """
+        Returns the unscaled features of a row, or None if the feature file doesn't have them.
+
+        Notes:
+            The raw matrix isn't used for recommendations, it's only read (one page of a
+            memory-mapped file) when a track's raw features are requested. Legacy NPZ files are
+            read into memory when the snapshot is loaded.
+        """
+        if "feature_matrix_raw" not in self.data:
+            return None
+        return self.data["feature_matrix_raw"][row]
+
+    def warm_up(self):
+        """
+        Read the arrays every query scans so their pages are in memory before the snapshot serves
+        requests, a memory-mapped artifact is otherwise read from disk by the first queries.
+        """
+        for array in [self.feature_matrix, self.feature_matrix_sq, self.feature_norms, self.years]:
+            np.asarray(array).sum()
+        if self.quantized_matrix is not None:
+            self.quantized_matrix.codes.sum()
+        for delta in self.deltas:
+            delta.warm_up()
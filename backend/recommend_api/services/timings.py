@@ -0,0 +1,93 @@
+# Per-phase timing of a request, reported in the response and its `Server-Timing` header
+# A request activates a `PhaseTimer` for its thread with `collect()`, the functions it goes through
+# are wrapped with `@timed(name)` (or a `with phase(name)` block) and add their time to it. Phases
+# nest: a phase's time doesn't include the phases it calls, so the phases add up to the time
+# they cover. Without an active timer a phase costs one thread-local lookup.
+import functools, threading, time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class PhaseTimer:
+    def __init__(self):
+        # seconds spent in each phase, in the order they first ran
+        self.phases = {}
+        # [name, start, time spent in nested phases] of the phases that are running
+        self._stack = []
+        self.start = time.perf_counter()
+
+    def add(self, name, seconds):
+        """Add time to a phase, ex: measured outside of a `phase` block."""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def total(self) -> float:
+        """Seconds since the timer was created."""
+        return time.perf_counter() - self.start
+
+    def as_ms(self) -> dict:
+        """Milliseconds spent in each phase."""
+        return {name: seconds * 1e3 for name, seconds in self.phases.items()}
+
+
+def current():
+    """The timer of the request running in this thread, None if it isn't timed."""
+    return getattr(_local, "timer", None)
+
+
+@contextmanager
+def collect():
+    """
+    Time the phases that run in this thread until the block exits.
+
+    Yields:
+        PhaseTimer: The timer the phases are added to.
+    """
+    previous = current()
+    timer = _local.timer = PhaseTimer()
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block (minus its nested phases) to a phase of the timer."""
+    timer = current()
+    if timer is None:
+        yield
+        return
+    timer.phases.setdefault(name, 0.0)
+    frame = [name, time.perf_counter(), 0.0]
+    timer._stack.append(frame)
+    try:
+        yield
+    finally:
+        timer._stack.pop()
+        elapsed = time.perf_counter() - frame[1]
+        timer.add(name, elapsed - frame[2])
+        if timer._stack:
+            timer._stack[-1][2] += elapsed
+
+
+def timed(name):
+    """Decorator, times every call of a function as a phase."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current() is None:
+                return fn(*args, **kwargs)
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(timer) -> str:
+    """
+    `Server-Timing` header value of a timer: one metric per phase plus the total, in ms.
+    """
+    metrics = [f"{name};dur={ms:.3f}" for name, ms in timer.as_ms().items()]
+    metrics.append(f"total;dur={timer.total() * 1e3:.3f}")
+    return ", ".join(metrics)
@@ -0,0 +1,66 @@
+# Top-k selection of similarity scores
+# Only the k best candidates are ever sorted: `argpartition` finds them in linear time, then the
+# k winners are ordered. Ties are broken by candidate order (or an explicit tiebreak key) so results
+# are deterministic and the same whether the scores are ranked at once or block by block.
+import numpy as np
+
+
+def top_k(scores, k: int, tiebreak=None) -> np.ndarray:
+    """
+    Returns the positions of the `k` highest scores, best first.
+
+    Args:
+        scores (np.ndarray): 1D array of scores.
+        k (int): Number of positions to return.
+        tiebreak (np.ndarray, optional): Equal scores are ordered by ascending `tiebreak`, defaults
+            to the position in `scores`.
+
+    Returns:
+        np.ndarray: Positions in `scores`, at most `k` of them.
+    """
+    n = len(scores)
+    k = min(int(k), n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if k < n:
+        # value of the k-th best score, everything above it is a winner, ties at that value are
+        # filled in by tiebreak order so the cut-off doesn't depend on how argpartition split them
+        kth = scores[np.argpartition(scores, n - k)[n - k]]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)
+        if tiebreak is not None:
+            ties = ties[np.argsort(tiebreak[ties], kind="stable")]
+        winners = np.concatenate([above, ties[: k - len(above)]])
+    else:
+        winners = np.arange(n)
+
+    # sort only the winners, by score descending then tiebreak ascending
+    order = np.lexsort((winners if tiebreak is None else tiebreak[winners], -scores[winners]))
+    return winners[order]
+
+
+def stream_top_k(blocks, k: int):
+    """
+    Top-k over candidates that are scored one block at a time, only the current block and the k
+    best candidates so far are held in memory.
+
+    Args:
+        blocks (Iterable[tuple[np.ndarray, np.ndarray]]): (rows, scores) pairs, `rows` identifies
+            each candidate and is also used to break ties.
+        k (int): Number of candidates to keep.
+
+    Returns:
+        tuple: (rows, scores) of the best `k` candidates, best first.
+    """
+    best_rows = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+
+    for rows, scores in blocks:
+        local = top_k(scores, k, tiebreak=rows)
+        merged_rows = np.concatenate([best_rows, rows[local]])
+        merged_scores = np.concatenate([best_scores, scores[local]])
+        winners = top_k(merged_scores, k, tiebreak=merged_rows)
+        best_rows, best_scores = merged_rows[winners], merged_scores[winners]
+
+    return best_rows, best_scores
@@ -0,0 +1,212 @@
+import os, tempfile, time
+import numpy as np
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services.artifacts import (
+    ArtifactStore, current_deltas, current_version, has_artifacts, published_segments,
+    save_artifacts, save_delta,
+)
+from recommend_api.services.catalogue_stats import catalogue_stats
+from recommend_api.services.mbid_index import encode_mbids
+
+
+def make_arrays(**overrides):
+    arrays = {
+        "feature_matrix": np.array([[1.0, 0.0], [0.6, 0.8], [0.0, 1.0]], dtype=np.float32),
+        "feature_matrix_raw": np.array([[2.0, 0.0], [3.0, 4.0], [0.0, 5.0]], dtype=np.float32),
+        "feature_names": np.array(["danceability", "brightness"]),
+        "mbids": np.array(["A", "B", "C"], dtype=object),
+        "years": np.array([1991, 1992, 1983], dtype=np.int16),
+        "genre_rosamerica": np.array(["roc", None, "roc"], dtype=object),
+        "genre_dortmund": np.array(["rock", "jazz", "rock"], dtype=object),
+        "empty": np.array([], dtype=object),
+    }
+    arrays.update(overrides)
+    return arrays
+
+
+class ArtifactTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, "features")
+        self.arrays = make_arrays()
+        self.version = save_artifacts(self.directory, self.arrays, metadata={"source": "test"})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        self.assertTrue(has_artifacts(self.directory))
+        store = ArtifactStore(self.directory)
+        self.assertEqual(store.version, self.version)
+        self.assertEqual(store.metadata, {"source": "test"})
+        self.assertSetEqual(set(store), set(self.arrays))
+
+        matrix = store["feature_matrix"]
+        self.assertIsInstance(matrix, np.memmap)
+        self.assertFalse(matrix.flags.writeable)
+        np.testing.assert_array_equal(matrix, self.arrays["feature_matrix"])
+
+        # object arrays are stored as fixed-width strings, None becomes ""
+        self.assertEqual(store["mbids"].dtype.kind, "U")
+        self.assertListEqual(store["genre_rosamerica"].tolist(), ["roc", "", "roc"])
+        self.assertEqual(len(store["empty"]), 0)
+
+    def test_arrays_opened_on_demand(self):
+        store = ArtifactStore(self.directory)
+        self.assertIn("feature_matrix_raw", store)
+        self.assertNotIn("feature_matrix_raw", store._arrays)
+        store["feature_matrix_raw"]
+        self.assertIn("feature_matrix_raw", store._arrays)
+
+    def test_versions(self):
+        # same content, same version, the metadata is part of the content
+        metadata = {"source": "test"}
+        self.assertEqual(save_artifacts(self.directory, self.arrays, metadata), self.version)
+        self.assertNotEqual(save_artifacts(self.directory, self.arrays), self.version)
+
+        second = save_artifacts(self.directory, make_arrays(years=np.array([2001, 2002, 2003])))
+        third = save_artifacts(self.directory, make_arrays(years=np.array([1971, 1972, 1973])))
+        self.assertEqual(current_version(self.directory), third)
+        self.assertListEqual(ArtifactStore(self.directory)["years"].tolist(), [1971, 1972, 1973])
+
+        # the previous version is kept for readers still opening it, older ones are removed
+        self.assertListEqual(ArtifactStore(self.directory, second)["years"].tolist(), [2001, 2002, 2003])
+        self.assertListEqual(sorted(os.listdir(self.directory)), sorted(["CURRENT", second, third]))
+
+    def test_deltas(self):
+        self.assertListEqual(current_deltas(self.directory), [])
+        first = save_delta(self.directory, make_arrays(mbids=np.array(["D", "E", "F"])))
+        second = save_delta(self.directory, make_arrays(mbids=np.array(["G", "H", "I"])))
+        # the same segment isn't published twice
+        same = save_delta(self.directory, make_arrays(mbids=np.array(["D", "E", "F"])))
+        self.assertEqual(same, first)
+        self.assertEqual(published_segments(self.directory), (self.version, [first, second]))
+        store = ArtifactStore(self.directory, second)
+        self.assertEqual(store.metadata, {"base": self.version})
+        self.assertListEqual(store["mbids"].tolist(), ["G", "H", "I"])
+
+        # a new base drops the deltas of the previous one
+        base = save_artifacts(self.directory, make_arrays(years=np.array([2001, 2002, 2003])))
+        self.assertEqual(published_segments(self.directory), (base, []))
+        self.assertNotIn(first, os.listdir(self.directory))
+
+        empty = os.path.join(self.tmp.name, "empty")
+        with self.assertRaises(FileNotFoundError):
+            save_delta(empty, make_arrays())
+
+    def test_recommender_loads_artifacts(self):
+        store = ArtifactStore(self.directory)
+        snapshot = rec.load_features(store, version=store.version)
+        self.assertEqual(snapshot.version, self.version)
+        self.assertNotIn("feature_matrix_raw", store._arrays)
+
+        out = rec.recommend("A", options={"k": 1, "match_genre": False, "match_decade": False})
+        self.assertEqual(out["top_tracks"][0]["mbid"], "B")
+        np.testing.assert_array_equal(snapshot.raw_features(snapshot.find_index("B")), [3.0, 4.0])
+
+        arrays = {k: v for k, v in self.arrays.items() if k != "feature_matrix_raw"}
+        self.assertIsNone(rec.load_features(arrays).raw_features(0))
+
+    def test_legacy_npz(self):
+        path = os.path.join(self.tmp.name, "features_and_index.npz")
+        np.savez(path, **self.arrays)
+        with np.load(path, allow_pickle=True) as npz:
+            snapshot = rec.load_features(npz)
+        # the arrays were read when the snapshot was loaded, the file isn't needed anymore
+        np.testing.assert_array_equal(snapshot.raw_features(snapshot.find_index("B")), [3.0, 4.0])
+        out = rec.recommend("A", options={"k": 1, "match_genre": False, "match_decade": False})
+        self.assertEqual(out["top_tracks"][0]["mbid"], "B")
+
+    def test_stored_catalogue_stats(self):
+        stats = catalogue_stats(self.arrays["feature_matrix"], self.arrays["feature_names"])
+        save_artifacts(self.directory, self.arrays, metadata={"catalogue_stats": stats})
+        store = ArtifactStore(self.directory)
+        rec.load_features(store, version=store.version)
+
+        with patch("recommend_api.services.recommender.catalogue_stats") as compute:
+            self.assertEqual(rec.get_feature_stats(), stats)
+            compute.assert_not_called()
+        self.assertEqual(rec.get_feature_stats(recompute=True), stats)
+        # arrays without stats compute them
+        self.assertEqual(rec.load_features(self.arrays).catalogue_stats, None)
+        self.assertEqual(rec.get_feature_stats()["unique_track_count"], 3)
+
+class SnapshotReloadTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, "features")
+        # start with no snapshot, loaded from the temporary artifact directory
+        for name, value in [
+            ("DEFAULT_DIRECTORY", self.directory),
+            ("LEGACY_FILENAME", os.path.join(self.tmp.name, "missing.npz")),
+            ("RELOAD_CHECK_INTERVAL", 0),
+            ("_snapshot", None),
+            ("_watched_directory", None),
+        ]:
+            patcher = patch.object(rec, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def wait_for_reload(self):
+        deadline = time.monotonic() + 10
+        while rec._reloading and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_missing_feature_file(self):
+        with self.assertRaises(FileNotFoundError):
+            rec.get_snapshot()
+
+    def test_lazy_load_and_hot_reload(self):
+        first_version = save_artifacts(self.directory, make_arrays())
+        first = rec.get_snapshot()
+        self.assertEqual(first.version, first_version)
+        self.assertIs(rec.get_snapshot(), first)
+
+        second_version = save_artifacts(
+            self.directory, make_arrays(years=np.array([2001, 2002, 2003], dtype=np.int16))
+        )
+        # the request that notices the new version is still served by the current snapshot
+        self.assertIs(rec.get_snapshot(), first)
+        self.wait_for_reload()
+        second = rec.get_snapshot()
+        self.assertEqual(second.version, second_version)
+        self.assertEqual(rec.recommend("A", {"k": 1})["target_year"], 2001)
+
+        # a request that started on the old snapshot keeps using it
+        self.assertEqual(int(first.years[0]), 1991)
+
+    def test_reload_deltas(self):
+        version = save_artifacts(self.directory, make_arrays())
+        self.assertEqual(rec.get_snapshot().version, version)
+
+        delta = save_delta(self.directory, make_arrays(
+            mbids=np.array(["D", "E", "F"]), tombstones=encode_mbids(["A"])
+        ))
+        self.assertEqual(rec.get_snapshot().version, version)
+        self.wait_for_reload()
+        snapshot = rec.get_snapshot()
+        self.assertEqual(snapshot.version, f"{version}+{delta}")
+        self.assertEqual(len(snapshot.deltas), 1)
+        # "A" was removed by the delta, ties are broken by segment
+        self.assertEqual(snapshot.locate("A"), (None, -1))
+        self.assertIs(snapshot.locate("D")[0], snapshot.deltas[0])
+        out = rec.recommend("D", {"k": 5, "match_genre": False, "match_decade": False})
+        self.assertListEqual(
+            [track["mbid"] for track in out["top_tracks"]], ["B", "E", "C", "F"]
+        )
+
+    def test_published_snapshot_isnt_replaced(self):
+        save_artifacts(self.directory, make_arrays())
+        snapshot = rec.load_features(make_arrays(years=np.array([1971, 1972, 1973])))
+        save_artifacts(self.directory, make_arrays(years=np.array([2001, 2002, 2003])))
+        self.assertIs(rec.get_snapshot(), snapshot)
+        self.wait_for_reload()
+        self.assertIs(rec.get_snapshot(), snapshot)
@@ -0,0 +1,70 @@
+import numpy as np
+from django.test import SimpleTestCase
+from recommend_api.services.artist_index import ArtistIndex
+
+METALLICA = "65f4f0c5-ef9e-490c-aee3-909e7ae6b2ab"
+LOU_REED = "9d6a1a55-5bd4-4ed3-a6d7-0e3ebc4ce7d0"
+MEGADETH = "a9044915-8be3-4c7e-b11f-9e2d2ea0a91e"
+
+
+class ArtistIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = ArtistIndex.build([
+            [METALLICA],
+            [MEGADETH],
+            [LOU_REED, METALLICA],
+            [],
+            [METALLICA],
+        ])
+
+    def test_build(self):
+        self.assertEqual(self.index.artist_count, 3)
+        self.assertListEqual(self.index.track_offsets.tolist(), [0, 1, 2, 4, 4, 5])
+        # credit order is kept
+        self.assertListEqual(
+            self.index.artists_of(2).tolist(), self.index.codes_of([LOU_REED, METALLICA]).tolist()
+        )
+        self.assertEqual(len(self.index.artists_of(3)), 0)
+        # first credited artist, -1 without artists
+        metallica, megadeth, lou_reed = self.index.codes_of([METALLICA, MEGADETH, LOU_REED])
+        self.assertListEqual(
+            self.index.primary_artists.tolist(), [metallica, megadeth, lou_reed, -1, metallica]
+        )
+
+    def test_rows_of(self):
+        self.assertListEqual(self.index.rows_of([METALLICA]).tolist(), [0, 2, 4])
+        self.assertListEqual(sorted(self.index.rows_of([MEGADETH, LOU_REED]).tolist()), [1, 2])
+        # unknown artists are skipped
+        unknown = "ffffffff-0000-0000-0000-000000000000"
+        self.assertListEqual(self.index.rows_of([unknown]).tolist(), [])
+        self.assertListEqual(self.index.rows_of([]).tolist(), [])
+
+    def test_from_arrays(self):
+        restored = ArtistIndex.from_arrays(self.index.to_arrays())
+        self.assertListEqual(restored.rows_of([METALLICA]).tolist(), [0, 2, 4])
+        # files saved without the primary artists derive them from the CSR arrays
+        arrays = self.index.to_arrays()
+        del arrays["primary_artists"]
+        np.testing.assert_array_equal(
+            ArtistIndex.from_arrays(arrays).primary_artists, self.index.primary_artists
+        )
+        self.assertIsNone(ArtistIndex.from_arrays({}))
+
+    def test_empty(self):
+        index = ArtistIndex.build([[], []])
+        self.assertEqual(index.artist_count, 0)
+        self.assertListEqual(index.rows_of([METALLICA]).tolist(), [])
+
+    def test_take_and_concatenate(self):
+        taken = self.index.take([4, 2, 3])
+        self.assertListEqual(taken.rows_of([METALLICA]).tolist(), [0, 1])
+        self.assertListEqual(taken.rows_of([LOU_REED]).tolist(), [1])
+        lou_reed, metallica = taken.codes_of([LOU_REED, METALLICA])
+        self.assertListEqual(taken.artists_of(1).tolist(), [lou_reed, metallica])
+        self.assertEqual(taken.primary_artists[2], -1)
+        self.assertEqual(self.index.take([]).artist_count, 0)
+
+        merged = ArtistIndex.concatenate([self.index, ArtistIndex.build([[], [MEGADETH]])])
+        self.assertListEqual(merged.track_offsets.tolist(), [0, 1, 2, 4, 4, 5, 5, 6])
+        self.assertListEqual(merged.rows_of([MEGADETH]).tolist(), [1, 6])
+        self.assertListEqual(merged.rows_of([METALLICA]).tolist(), [0, 2, 4])
@@ -0,0 +1,100 @@
+import numpy as np
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services.budget import CostModel
+from recommend_api.services.ivf import IVFIndex
+
+
+class CostModelTests(SimpleTestCase):
+    def test_estimate(self):
+        model = CostModel(slice_ns=20.0, quantized_ns=50.0, gather_ns=200.0)
+        self.assertAlmostEqual(model.estimate_ms(1_000_000, "slice"), 20.0)
+        self.assertAlmostEqual(model.estimate_ms(1_000_000, "gather"), 200.0)
+        self.assertEqual(model.affordable(10.0, "quantized"), 200_000)
+        self.assertEqual(model.affordable(-1.0, "slice"), 0)
+
+
+class BudgetTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        rng = np.random.default_rng(0)
+        n = 4000
+        matrix = rng.normal(size=(n, 8)).astype(np.float32)
+        self.data = {
+            "feature_matrix": matrix / np.linalg.norm(matrix, axis=1, keepdims=True),
+            "mbids": np.array([f"T{i}" for i in range(n)]),
+            "years": rng.choice([1975, 1985, 1995], size=n),
+            "genre_rosamerica": rng.choice(["roc", "pop", "jaz"], size=n),
+            "genre_dortmund": rng.choice(["rock", "jazz"], size=n),
+            "feature_names": np.array([f"f{i}" for i in range(8)]),
+        }
+        self.unfiltered = {"k": 10, "match_genre": False, "match_decade": False}
+
+    def test_within_budget(self):
+        rec.load_features(self.data)
+        exact = rec.recommend("T0", self.unfiltered)
+        out = rec.recommend("T0", {**self.unfiltered, "budget_ms": 1000})
+        self.assertEqual(out['stats']['engine'], "exact")
+        self.assertListEqual(out['top_tracks'], exact['top_tracks'])
+        with self.assertRaises(ValueError):
+            rec.recommend("T0", {"budget_ms": 0})
+
+    def test_ivf(self):
+        snapshot = rec.load_features({
+            **self.data, **IVFIndex.build(self.data["feature_matrix"], nlist=40).to_arrays()
+        })
+        out = rec.recommend("T0", {**self.unfiltered, "budget_ms": 1e-6})
+        self.assertEqual(out['stats']['engine'], "ivf")
+        # the minimum number of lists, about 100 rows each
+        self.assertLess(out['stats']['candidate_count'], (rec.IVF_NPROBE + 4) * 100)
+
+        # the rest of the budget is spent on more lists
+        with patch.object(rec, "cost_model", CostModel(slice_ns=1e4, gather_ns=1e4)):
+            out = rec.recommend("T0", {**self.unfiltered, "budget_ms": 20})
+        self.assertEqual(out['stats']['engine'], "ivf")
+        self.assertGreater(out['stats']['candidate_count'], 1600)
+        self.assertLess(out['stats']['candidate_count'], snapshot.row_count - 1)
+
+        # the lists probed by an "ivf" request aren't changed
+        options = {**self.unfiltered, "engine": "ivf", "nprobe": 2}
+        out = rec.recommend("T0", {**options, "budget_ms": 1e-6})
+        self.assertListEqual(out['top_tracks'], rec.recommend("T0", options)['top_tracks'])
+        self.assertLess(out['stats']['candidate_count'], 400)
+
+    def test_no_ivf(self):
+        # without an IVF index the request stays exact, over its budget
+        rec.load_features(self.data)
+        exact = rec.recommend("T0", self.unfiltered)
+        out = rec.recommend("T0", {**self.unfiltered, "budget_ms": 1e-6})
+        self.assertEqual(out['stats']['engine'], "exact")
+        self.assertListEqual(out['top_tracks'], exact['top_tracks'])
+
+    def test_target_only_in_delta(self):
+        # no track of the base shares the target's genre, there's nothing to plan
+        delta = {
+            **{name: self.data[name][:1] for name in ["feature_matrix", "years", "genre_dortmund"]},
+            "mbids": np.array(["D0"]),
+            "genre_rosamerica": np.array(["blu"]),
+            "feature_names": self.data["feature_names"],
+        }
+        rec.publish(rec.RecommenderSnapshot.load({
+            **self.data, **IVFIndex.build(self.data["feature_matrix"], nlist=40).to_arrays()
+        }, deltas=[delta]))
+        out = rec.recommend("D0", {"k": 10, "budget_ms": 1e-6})
+        self.assertEqual(out['stats']['engine'], "exact")
+        self.assertListEqual(out['top_tracks'], [])
+
+    def test_cache(self):
+        rec.load_features({
+            **self.data, **IVFIndex.build(self.data["feature_matrix"], nlist=40).to_arrays()
+        })
+        with patch.object(rec.result_cache, "max_bytes", 2**20):
+            budgeted = rec.recommend("T0", {**self.unfiltered, "budget_ms": 1e-6})
+            out = rec.recommend("T0", self.unfiltered)
+        self.assertEqual(budgeted['stats']['engine'], "ivf")
+        self.assertEqual(out['stats']['engine'], "exact")
+        self.assertNotIn("cached", out['stats'])
@@ -0,0 +1,39 @@
+import numpy as np
+from django.test import SimpleTestCase
+from recommend_api.services.catalogue_stats import catalogue_stats, duplicate_groups
+
+
+class CatalogueStatsTests(SimpleTestCase):
+    def setUp(self):
+        self.matrix = np.array([
+            [1.0, 0.0, 0.5],
+            [0.0, 1.0, 0.5],
+            [1.0, 0.00001, 0.5],  # same as row 0 once rounded
+            [0.2, 0.3, 0.5],
+            [0.0, 1.0, 0.5],
+            [1.0, -0.0, 0.5],
+        ], dtype=np.float32)
+        self.names = ["danceability", "aggressiveness", "brightness"]
+
+    def test_duplicate_groups(self):
+        offsets, rows = duplicate_groups(self.matrix)
+        groups = [rows[offsets[g]:offsets[g + 1]].tolist() for g in range(len(offsets) - 1)]
+        self.assertListEqual(groups, [[0, 2, 5], [1, 4]])
+
+        offsets, rows = duplicate_groups(np.eye(3, dtype=np.float32))
+        self.assertListEqual(offsets.tolist(), [0])
+        self.assertEqual(len(rows), 0)
+
+    def test_stats(self):
+        stats = catalogue_stats(self.matrix, self.names)
+        _, unique_idx = np.unique(np.round(self.matrix, 4), axis=0, return_index=True)
+        self.assertEqual(stats["unique_track_count"], 6)
+        self.assertEqual(stats["unique_vector_count"], unique_idx.size)
+        self.assertEqual(stats["total_col_count"], 3)
+        # brightness is the same for every track
+        self.assertEqual(stats["near_zero_col_count"], 1)
+        self.assertEqual(stats["duplicate_group_count"], 2)
+        self.assertEqual(stats["duplicate_track_count"], 5)
+        self.assertListEqual(stats["largest_duplicate_groups"], [3, 2])
+        self.assertAlmostEqual(stats["features"]["aggressiveness"]["mean"], 2.3 / 6, places=5)
+        self.assertEqual(stats["features"]["danceability"]["max"], 1.0)
@@ -0,0 +1,47 @@
+import numpy as np
+from django.test import SimpleTestCase
+from recommend_api.services.columns import CategoricalColumn, hash_strings
+
+
+class CategoricalColumnTests(SimpleTestCase):
+    def setUp(self):
+        self.values = np.array(["roc", "pop", None, "roc", "jaz"], dtype=object)
+        self.column = CategoricalColumn.encode(self.values)
+
+    def test_encode(self):
+        self.assertEqual(self.column.codes.dtype, np.uint8)
+        self.assertListEqual(self.column.vocabulary.tolist(), ["", "jaz", "pop", "roc"])
+        self.assertListEqual(self.column.labels().tolist(), ["roc", "pop", "", "roc", "jaz"])
+        self.assertEqual(len(self.column), 5)
+
+    def test_getitem(self):
+        self.assertEqual(self.column[0], "roc")
+        self.assertIs(type(self.column[0]), str)
+        self.assertEqual(self.column[2], "")
+        self.assertListEqual(self.column[np.array([4, 1])].tolist(), ["jaz", "pop"])
+
+    def test_code_of(self):
+        self.assertListEqual(
+            np.flatnonzero(self.column.codes == self.column.code_of("roc")).tolist(), [0, 3]
+        )
+        self.assertEqual(self.column.code_of("cla"), -1)
+
+    def test_from_arrays(self):
+        restored = CategoricalColumn.from_arrays(self.column.to_arrays("genre"), "genre")
+        np.testing.assert_array_equal(restored.codes, self.column.codes)
+        # plain string columns are encoded on load
+        encoded = CategoricalColumn.from_arrays({"genre": self.values}, "genre")
+        np.testing.assert_array_equal(encoded.codes, self.column.codes)
+        self.assertIsNone(CategoricalColumn.from_arrays({}, "genre"))
+
+
+class HashStringsTests(SimpleTestCase):
+    def test_hash_strings(self):
+        hashes = hash_strings(["Enter Sandman", "One", "Enter Sandman", None, ""])
+        self.assertEqual(hashes.dtype, np.uint64)
+        self.assertEqual(hashes[0], hashes[2])
+        self.assertNotEqual(hashes[0], hashes[1])
+        self.assertEqual(hashes[3], hashes[4])
+        # stable across processes, the pipeline and the recommender compare them
+        self.assertEqual(hashes[1], hash_strings(["One"])[0])
+        self.assertEqual(len(hash_strings([])), 0)
@@ -0,0 +1,144 @@
+import numpy as np
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.columns import hash_strings
+from recommend_api.services.mbid_index import encode_mbids
+
+
+class RecommendDeltaSegmentsTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        rng = np.random.default_rng(0)
+        n = 1200
+        matrix = rng.normal(size=(n + 20, 8)).astype(np.float32)
+        self.table = {
+            "feature_matrix": matrix / np.linalg.norm(matrix, axis=1, keepdims=True),
+            "mbids": np.array([f"T{i}" for i in range(n)] + [f"T{i}" for i in range(10, 30)]),
+            "years": rng.choice([1985, 1995], size=n + 20),
+            "genre_rosamerica": rng.choice(["roc", "pop"], size=n + 20),
+            "genre_dortmund": rng.choice(["rock", "jazz"], size=n + 20),
+            "popularity": np.log1p(rng.integers(0, 1000, size=n + 20)).astype(np.float32),
+            "artists": [[f"A{i}"] for i in rng.integers(0, 60, size=n + 20)],
+            "titles": [f"S{i}" for i in rng.integers(0, 400, size=n + 20)],
+        }
+        # the base, a delta adding tracks and re-ingesting T10-T29 (new features), and a delta
+        # adding more tracks and removing T30-T39 and T1005 (added by the first delta)
+        segments = [
+            (np.arange(0, 1000), []),
+            (np.r_[1000:1100, n:n + 20], [f"T{i}" for i in range(10, 30)]),
+            (np.arange(1100, n), [f"T{i}" for i in range(30, 40)] + ["T1005"]),
+        ]
+        removed = {f"T{i}" for i in range(30, 40)} | {"T1005"}
+        base, *deltas = [self.arrays(rows, tombstones) for rows, tombstones in segments]
+        self.segmented = rec.RecommenderSnapshot.load(base, deltas=deltas)
+
+        # the same visible tracks in a single snapshot
+        visible = [
+            row for rows, _ in segments for row in rows
+            if self.table["mbids"][row] not in removed
+            and not (row < 1000 and 10 <= row < 30)
+        ]
+        self.merged = rec.RecommenderSnapshot.load(self.arrays(np.array(visible), []))
+        self.seeds = [f"T{i}" for i in range(0, n, 40)] + ["T15", "T1010", "T1150"]
+
+    def arrays(self, rows, tombstones):
+        arrays = {
+            name: self.table[name][rows]
+            for name in [
+                "feature_matrix", "mbids", "years", "genre_rosamerica", "genre_dortmund",
+                "popularity",
+            ]
+        }
+        arrays["feature_names"] = np.array([f"f{i}" for i in range(8)])
+        arrays["title_hashes"] = hash_strings([self.table["titles"][row] for row in rows])
+        arrays.update(ArtistIndex.build([self.table["artists"][row] for row in rows]).to_arrays())
+        if tombstones:
+            arrays["tombstones"] = encode_mbids(tombstones)
+        return arrays
+
+    def recommend_both(self, options):
+        rec.publish(self.segmented)
+        segmented = [rec.recommend(mbid, options) for mbid in self.seeds]
+        rec.publish(self.merged)
+        merged = [rec.recommend(mbid, options) for mbid in self.seeds]
+        return segmented, merged
+
+    def test_locate(self):
+        segment, row = self.segmented.locate("T15")
+        self.assertIs(segment, self.segmented.deltas[0])
+        features = self.table["feature_matrix"][1205]
+        np.testing.assert_array_equal(segment.feature_matrix[row], features)
+        self.assertIs(self.segmented.locate("T5")[0], self.segmented)
+        self.assertEqual(self.segmented.locate("T35"), (None, -1))
+        self.assertEqual(self.segmented.locate("T1005"), (None, -1))
+        self.assertEqual(self.segmented.locate("unknown"), (None, -1))
+        self.assertListEqual(self.segmented.hidden_rows.tolist(), list(range(10, 40)))
+
+    def test_matches_single_snapshot(self):
+        for options in [
+            {"k": 10},
+            {"k": 10, "match_genre": False, "match_decade": False},
+            {"k": 10, "use_ros": False},
+            {"k": 10, "diversify": True},
+            {"k": 10, "feature_weights": {"f0": 2.0, "f3": 0.0}},
+            {"k": 10, "similarity_weight": 0.8, "popularity_weight": 0.2},
+            {"k": 10, "exclude_mbids": ["T1", "T2", "T15", "T1101"], "exclude_artists": ["A1"]},
+            {"k": 10, "disliked_mbids": ["T4", "T15", "T1150"], "dislike_weight": 0.8},
+        ]:
+            segmented, merged = self.recommend_both(options)
+            for s, m in zip(segmented, merged):
+                self.assertListEqual(
+                    [t["mbid"] for t in s["top_tracks"]], [t["mbid"] for t in m["top_tracks"]],
+                    options,
+                )
+                np.testing.assert_allclose(
+                    [t["score"] for t in s["top_tracks"]], [t["score"] for t in m["top_tracks"]],
+                    rtol=1e-6,
+                )
+                self.assertEqual(s["stats"]["candidate_count"], m["stats"]["candidate_count"])
+                self.assertEqual(s["target_year"], m["target_year"])
+
+    def test_stats(self):
+        # merged from the exact stats of each segment, the p95 is an average of theirs
+        segmented, merged = self.recommend_both({"k": 5, "stats": "exact"})
+        for s, m in zip(segmented, merged):
+            self.assertEqual(s["stats"]["mode"], "approx")
+            for name in ["mean", "std", "max"]:
+                self.assertAlmostEqual(s["stats"][name], m["stats"][name], places=5)
+            self.assertAlmostEqual(s["stats"]["p95"], m["stats"]["p95"], delta=0.05)
+
+    def test_recommend_many(self):
+        rec.publish(self.segmented)
+        options = {"k": 5}
+        self.assertListEqual(
+            [out["top_tracks"] for out in rec.recommend_many(["T15", "T3"], options)],
+            [rec.recommend(mbid, options)["top_tracks"] for mbid in ["T15", "T3"]],
+        )
+        with self.assertRaises(ValueError):
+            rec.recommend("T35")
+
+    def test_profile(self):
+        seeds, seed_weights = ["T3", "T15", "T1010", "T1150"], [1.0, 2.0, 0.5, 1.0]
+        for options in [
+            {"k": 10},
+            {"k": 10, "profile": "max", "diversify": True},
+            {"k": 10, "profile": "max", "match_genre": False, "match_decade": False},
+            {"k": 10, "disliked_mbids": ["T4", "T20", "T1105"], "dislike_weight": 1.0},
+        ]:
+            rec.publish(self.segmented)
+            segmented = rec.recommend_profile(seeds, seed_weights, options)
+            rec.publish(self.merged)
+            merged = rec.recommend_profile(seeds, seed_weights, options)
+            self.assertListEqual(
+                [t["mbid"] for t in segmented["top_tracks"]],
+                [t["mbid"] for t in merged["top_tracks"]],
+                options,
+            )
+            self.assertEqual(
+                segmented["stats"]["candidate_count"], merged["stats"]["candidate_count"]
+            )
@@ -0,0 +1,138 @@
+import numpy as np
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.columns import hash_strings
+
+
+class RecommendDislikesTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        rng = np.random.default_rng(0)
+        n = 3000
+        matrix = rng.normal(size=(n, 8)).astype(np.float32)
+        self.matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.genres = rng.choice(["roc", "pop"], size=n)
+        self.years = rng.choice([1985, 1995], size=n)
+        self.popularity = np.log1p(rng.integers(0, 1000, size=n)).astype(np.float32)
+        self.snapshot = rec.load_features({
+            "feature_matrix": self.matrix,
+            "mbids": np.array([f"T{i}" for i in range(n)]),
+            "years": self.years,
+            "genre_rosamerica": self.genres,
+            "genre_dortmund": rng.choice(["rock", "jazz"], size=n),
+            "feature_names": np.array([f"f{i}" for i in range(8)]),
+            "popularity": self.popularity,
+            "title_hashes": hash_strings([f"S{i}" for i in rng.integers(0, 1000, size=n)]),
+            **ArtistIndex.build([[f"A{i}"] for i in rng.integers(0, 50, size=n)]).to_arrays(),
+        })
+        # the nearest neighbours of T0 are disliked, plus one track missing from the catalogue
+        self.disliked = [f"T{row}" for row in self.neighbours(0)[:3]] + ["unknown"]
+
+    def neighbours(self, row):
+        candidates = self.partition(row)
+        return candidates[np.argsort(-(self.matrix[candidates] @ self.matrix[row]))]
+
+    def partition(self, row):
+        return np.flatnonzero(
+            (self.genres == self.genres[row]) & (self.years == self.years[row])
+            & (np.arange(len(self.matrix)) != row)
+        )
+
+    def brute_force(self, row, k, weight, popularity_weight=0.0):
+        """The k best tracks of the target's partition by blended score minus their penalty."""
+        disliked = np.array([int(mbid[1:]) for mbid in self.disliked if mbid != "unknown"])
+        candidates = np.setdiff1d(self.partition(row), disliked)
+        similarities = self.matrix[candidates] @ self.matrix[row]
+        popularity = self.snapshot.popularity[candidates]
+        scores = (1 - popularity_weight) * similarities + popularity_weight * popularity
+        penalties = np.maximum((self.matrix[candidates] @ self.matrix[disliked].T).max(axis=1), 0)
+        scores = scores - weight * penalties
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [f"T{row}" for row in candidates[order]], scores[order]
+
+    def test_penalized_ranking(self):
+        for weight in [0.25, 0.5, 1.0]:
+            expected, scores = self.brute_force(0, 10, weight)
+            out = rec.recommend(
+                "T0", {"k": 10, "disliked_mbids": self.disliked, "dislike_weight": weight}
+            )
+            self.assertListEqual([t['mbid'] for t in out['top_tracks']], expected)
+            np.testing.assert_allclose([t['score'] for t in out['top_tracks']], scores, rtol=1e-5)
+        # the similarity isn't penalized
+        track = out['top_tracks'][0]
+        self.assertAlmostEqual(
+            track['similarity'],
+            float(self.matrix[int(track['mbid'][1:])] @ self.matrix[0]),
+            places=5,
+        )
+
+    def test_pool_growth(self):
+        # a pool of k + 1 candidates has to grow for the ranking to be exact
+        expected, _ = self.brute_force(0, 10, 1.0)
+        self.enterContext(patch.object(rec, "DISLIKE_POOL_SIZE", 1))
+        self.enterContext(patch.object(rec, "DISLIKE_POOL_GROWTH", 2))
+        search = self.enterContext(patch.object(rec, "_search", wraps=rec._search))
+        out = rec.recommend("T0", {"k": 10, "disliked_mbids": self.disliked, "dislike_weight": 1.0})
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], expected)
+        self.assertGreater(search.call_count, 1)
+
+    def test_blend(self):
+        options = {"similarity_weight": 0.8, "popularity_weight": 0.2}
+        expected, _ = self.brute_force(0, 10, 0.5, popularity_weight=0.2)
+        out = rec.recommend("T0", {"k": 10, "disliked_mbids": self.disliked, **options})
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], expected)
+
+    def test_excluded(self):
+        # disliked tracks are never recommended, without a weight they're only excluded
+        out = rec.recommend("T0", {"k": 10, "disliked_mbids": self.disliked, "dislike_weight": 0})
+        excluded = rec.recommend("T0", {"k": 10, "exclude_mbids": self.disliked})
+        self.assertListEqual(out['top_tracks'], excluded['top_tracks'])
+        self.assertEqual(out['stats']['candidate_count'], len(self.partition(0)) - 3)
+        with self.assertRaises(ValueError):
+            rec.recommend("T0", {"disliked_mbids": self.disliked, "dislike_weight": -1})
+
+    def test_diversify(self):
+        out = rec.recommend(
+            "T0", {"k": 10, "disliked_mbids": self.disliked, "dislike_weight": 1.0,
+                   "diversify": True},
+        )
+        self.assertEqual(len(out['top_tracks']), 10)
+        self.assertTrue(set(self.disliked).isdisjoint(t['mbid'] for t in out['top_tracks']))
+        # still ranked by penalized score
+        scores = [t['score'] for t in out['top_tracks']]
+        self.assertListEqual(scores, sorted(scores, reverse=True))
+
+    def test_cache(self):
+        rec.publish(self.snapshot)
+        with patch.object(rec.result_cache, "max_bytes", 1 << 20):
+            rec.result_cache.clear()
+            excluded = rec.recommend("T0", {"k": 10, "exclude_mbids": self.disliked})
+            disliked = rec.recommend("T0", {"k": 10, "disliked_mbids": self.disliked})
+            heavier = rec.recommend(
+                "T0", {"k": 10, "disliked_mbids": self.disliked, "dislike_weight": 1.0}
+            )
+        self.assertNotEqual(excluded['top_tracks'], disliked['top_tracks'])
+        self.assertNotEqual(disliked['top_tracks'], heavier['top_tracks'])
+
+    def test_recommend_many(self):
+        options = {"k": 5, "disliked_mbids": self.disliked}
+        self.assertListEqual(
+            [out['top_tracks'] for out in rec.recommend_many(["T0", "T7"], options)],
+            [rec.recommend(mbid, options)['top_tracks'] for mbid in ["T0", "T7"]],
+        )
+
+    def test_profile(self):
+        seeds = ["T0", "T5"]
+        out = rec.recommend_profile(
+            seeds, None, {"k": 10, "disliked_mbids": self.disliked, "dislike_weight": 1.0}
+        )
+        plain = rec.recommend_profile(seeds, None, {"k": 10, "exclude_mbids": self.disliked})
+        self.assertEqual(len(out['top_tracks']), 10)
+        self.assertNotEqual(out['top_tracks'], plain['top_tracks'])
+        scores = [t['score'] for t in out['top_tracks']]
+        self.assertListEqual(scores, sorted(scores, reverse=True))
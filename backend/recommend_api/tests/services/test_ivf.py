@@ -0,0 +1,35 @@
+import numpy as np
+from django.test import SimpleTestCase
+from recommend_api.services.ivf import IVFIndex
+
+
+class IVFIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(size=(2000, 16)).astype(np.float32)
+        self.matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.index = IVFIndex.build(self.matrix, nlist=20, sample_size=1000)
+
+    def test_lists_cover_every_row_once(self):
+        self.assertEqual(self.index.nlist, 20)
+        self.assertEqual(self.index.offsets[-1], len(self.matrix))
+        self.assertListEqual(sorted(self.index.rows.tolist()), list(range(len(self.matrix))))
+
+    def test_probe_all_lists(self):
+        rows = self.index.probe(self.matrix[0], nprobe=100)
+        self.assertListEqual(rows.tolist(), list(range(len(self.matrix))))
+
+    def test_probe_finds_nearest_neighbours(self):
+        recalls = []
+        for target in range(50):
+            exact = np.argsort(-(self.matrix @ self.matrix[target]))[:10]
+            probed = self.index.probe(self.matrix[target], nprobe=5)
+            self.assertTrue(np.all(probed[:-1] < probed[1:]))
+            recalls.append(np.isin(exact, probed).mean())
+        # 5 of 20 lists cover a quarter of the rows but most of the true neighbours
+        self.assertGreater(np.mean(recalls), 0.5)
+
+    def test_round_trip(self):
+        restored = IVFIndex.from_arrays(self.index.to_arrays())
+        np.testing.assert_array_equal(restored.rows, self.index.rows)
+        self.assertIsNone(IVFIndex.from_arrays({}))
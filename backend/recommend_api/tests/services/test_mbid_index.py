@@ -0,0 +1,48 @@
+import numpy as np
+from django.test import SimpleTestCase
+from recommend_api.services.mbid_index import (
+    build_mbid_index, encode_mbids, key_to_mbid, lookup, lookup_many, mbid_to_key
+)
+
+
+class MbidIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.mbids = np.array([
+            "62c2e20a-559e-422f-a44c-9afa7882f0c4",
+            "9420c245-10aa-43bf-a583-08f0219e5666",
+            "00000000-0000-0000-0000-000000000000",
+            "1b6a2f3c-0000-4000-8000-000000000100",
+        ], dtype=object)
+        self.keys, self.rows = build_mbid_index(self.mbids)
+
+    def test_keys_are_16_bytes(self):
+        self.assertEqual(encode_mbids(self.mbids).dtype.itemsize, 16)
+        self.assertEqual(len(mbid_to_key(self.mbids[0])), 16)
+
+    def test_keys_are_sorted(self):
+        self.assertTrue(np.all(self.keys[:-1] <= self.keys[1:]))
+
+    def test_lookup(self):
+        for row, mbid in enumerate(self.mbids):
+            self.assertEqual(lookup(self.keys, self.rows, mbid), row)
+
+    def test_lookup_is_case_insensitive(self):
+        self.assertEqual(lookup(self.keys, self.rows, self.mbids[0].upper()), 0)
+
+    def test_lookup_missing(self):
+        self.assertEqual(lookup(self.keys, self.rows, "ffffffff-ffff-4fff-bfff-ffffffffffff"), -1)
+        self.assertEqual(lookup(self.keys, self.rows, "not-an-mbid"), -1)
+
+    def test_lookup_many_skips_unknown(self):
+        rows = lookup_many(self.keys, self.rows, [self.mbids[3], "missing", self.mbids[1]])
+        self.assertListEqual(sorted(rows.tolist()), [1, 3])
+
+    def test_lookup_many_empty(self):
+        self.assertEqual(lookup_many(self.keys, self.rows, []).size, 0)
+
+    def test_key_to_mbid(self):
+        keys = encode_mbids(self.mbids)
+        for key, mbid in zip(keys, self.mbids):
+            self.assertEqual(key_to_mbid(key), mbid)
+        # an already encoded array is used as is
+        self.assertIs(encode_mbids(keys), keys)
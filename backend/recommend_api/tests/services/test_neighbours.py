@@ -0,0 +1,191 @@
+import os, pickle, tempfile
+import numpy as np
+from dataclasses import replace
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.neighbours import NeighbourGraph, _MappedArray
+from recommend_api.services.partitions import PartitionIndex
+from recommend_api.services.scoring import row_norms
+from recommend_api.services.topk import top_k
+
+
+class NeighbourGraphTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 400
+        matrix = rng.normal(size=(n, 8)).astype(np.float32)
+        self.matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.norms = row_norms(np.square(self.matrix))
+        # rows aren't stored in partition order, one partition has a single track
+        genres = rng.choice(["roc", "pop"], size=n)
+        years = rng.choice([1985, 1995], size=n)
+        genres[7], years[7] = "jaz", 2005
+        self.partitions = PartitionIndex.build(genres, years)
+        self.popularity = rng.random(n).astype(np.float32)
+
+    def brute_force(self, row, k, popularity_weight=0.0):
+        """Neighbours of a row ranked like `recommend()` ranks its partition."""
+        position = self.partitions._rank()[row]
+        partition = np.searchsorted(self.partitions.offsets, position, side="right") - 1
+        candidates = self.partitions.order[
+            self.partitions.offsets[partition]:self.partitions.offsets[partition + 1]
+        ]
+        candidates = candidates[candidates != row]
+        similarities = self.matrix[candidates] @ self.matrix[row] / self.norms[candidates]
+        scores = (
+            (1 - popularity_weight) * similarities + popularity_weight * self.popularity[candidates]
+        )
+        return candidates[top_k(scores, k)]
+
+    def test_build(self):
+        graph = NeighbourGraph.build(self.matrix, self.norms, self.partitions, k=20, block_size=16)
+        self.assertEqual(graph.rows.dtype, np.int32)
+        self.assertEqual(graph.scores.dtype, np.float16)
+        for row in range(0, 400, 7):
+            self.assertListEqual(
+                graph.neighbours_of(row).tolist(), self.brute_force(row, 20).tolist()
+            )
+        # the only track of its partition has no neighbours
+        self.assertEqual(len(graph.neighbours_of(7)), 0)
+        self.assertListEqual(graph.rows[7].tolist(), [-1] * 20)
+        # similarities are stored at float16 precision
+        neighbours = graph.neighbours_of(0)
+        np.testing.assert_allclose(
+            graph.scores[0].astype(np.float32), self.matrix[neighbours] @ self.matrix[0], atol=1e-3
+        )
+
+    def test_blend(self):
+        graph = NeighbourGraph.build(
+            self.matrix, self.norms, self.partitions, k=10, similarity_weight=0.7,
+            popularity_weight=0.3, popularity=self.popularity,
+        )
+        for row in range(0, 400, 13):
+            self.assertListEqual(
+                graph.neighbours_of(row).tolist(), self.brute_force(row, 10, 0.3).tolist()
+            )
+        with self.assertRaises(ValueError):
+            NeighbourGraph.build(self.matrix, self.norms, self.partitions, popularity_weight=0.1)
+
+    def test_workers(self):
+        graph = NeighbourGraph.build(self.matrix, self.norms, self.partitions, k=20, block_size=32)
+        parallel = NeighbourGraph.build(
+            self.matrix, self.norms, self.partitions, k=20, block_size=32, workers=2
+        )
+        np.testing.assert_array_equal(parallel.rows, graph.rows)
+        np.testing.assert_array_equal(parallel.stats, graph.stats)
+
+    def test_workers_map_artifacts(self):
+        # memory-mapped arrays reach the workers as their path, not as a pickled copy
+        tmp = self.enterContext(tempfile.TemporaryDirectory())
+        mapped = []
+        for name, array in [("matrix", self.matrix), ("norms", self.norms)]:
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+            mapped.append(np.load(os.path.join(tmp, f"{name}.npy"), mmap_mode="r"))
+        shared = _MappedArray.of(mapped[0])
+        self.assertIsInstance(shared, _MappedArray)
+        self.assertLess(len(pickle.dumps(shared)), 1024)
+        np.testing.assert_array_equal(shared.open(), self.matrix)
+        self.assertIs(_MappedArray.of(self.matrix), self.matrix)
+
+        graph = NeighbourGraph.build(self.matrix, self.norms, self.partitions, k=20, block_size=32)
+        parallel = NeighbourGraph.build(*mapped, self.partitions, k=20, block_size=32, workers=2)
+        np.testing.assert_array_equal(parallel.rows, graph.rows)
+
+    def test_from_arrays(self):
+        graph = NeighbourGraph.build(
+            self.matrix, self.norms, self.partitions, k=5, similarity_weight=0.9,
+            popularity_weight=0.1, popularity=self.popularity,
+        )
+        restored = NeighbourGraph.from_arrays(graph.to_arrays())
+        np.testing.assert_array_equal(restored.rows, graph.rows)
+        self.assertEqual((restored.similarity_weight, restored.popularity_weight), (0.9, 0.1))
+        self.assertIsNone(NeighbourGraph.from_arrays({}))
+
+
+class RecommendFromGraphTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        rng = np.random.default_rng(0)
+        n = 3000
+        matrix = rng.normal(size=(n, 8)).astype(np.float32)
+        snapshot = rec.RecommenderSnapshot.load({
+            "feature_matrix": matrix / np.linalg.norm(matrix, axis=1, keepdims=True),
+            "mbids": np.array([f"T{i}" for i in range(n)]),
+            "years": rng.choice([1985, 1995], size=n),
+            "genre_rosamerica": rng.choice(["roc", "pop"], size=n),
+            "genre_dortmund": rng.choice(["rock", "jazz"], size=n),
+            "feature_names": np.array([f"f{i}" for i in range(8)]),
+            "popularity": np.log1p(rng.integers(0, 1000, size=n)).astype(np.float32),
+        })
+        snapshot = replace(
+            snapshot,
+            artist_index=ArtistIndex.build([[f"A{i}"] for i in rng.integers(0, 100, size=n)]),
+        )
+        self.exact = snapshot
+        self.graph = NeighbourGraph.build(
+            snapshot.feature_matrix, snapshot.feature_norms, snapshot.ros_partitions, k=40,
+            similarity_weight=0.9, popularity_weight=0.1, popularity=snapshot.popularity,
+        )
+        self.snapshot = replace(snapshot, neighbour_graph=self.graph)
+        self.defaults = {"similarity_weight": 0.9, "popularity_weight": 0.1}
+        self.seeds = [f"T{i}" for i in range(0, n, 150)]
+
+    def recommend_both(self, options):
+        rec.publish(self.snapshot)
+        from_graph = [rec.recommend(mbid, options) for mbid in self.seeds]
+        rec.publish(self.exact)
+        exact = [rec.recommend(mbid, options) for mbid in self.seeds]
+        return from_graph, exact
+
+    def test_matches_exact_search(self):
+        for options in [
+            {**self.defaults, "k": 10},
+            {**self.defaults, "k": 10, "diversify": True},
+            {**self.defaults, "k": 10, "exclude_mbids": [f"T{i}" for i in range(0, 3000, 2)]},
+            {**self.defaults, "k": 10, "exclude_artists": ["A1", "A2", "A3"], "diversify": True},
+        ]:
+            from_graph, exact = self.recommend_both(options)
+            for g, e in zip(from_graph, exact):
+                self.assertEqual(g['stats']['engine'], "graph")
+                self.assertListEqual(
+                    [t['mbid'] for t in g['top_tracks']], [t['mbid'] for t in e['top_tracks']]
+                )
+                np.testing.assert_allclose(
+                    [t['similarity'] for t in g['top_tracks']],
+                    [t['similarity'] for t in e['top_tracks']],
+                    rtol=1e-6,
+                )
+                self.assertEqual(g['stats']['candidate_count'], e['stats']['candidate_count'])
+
+    def test_falls_back_to_search(self):
+        # more results than the graph keeps, other options than the ones it was built for
+        for options in [
+            {**self.defaults, "k": 50},
+            {**self.defaults, "k": 30, "exclude_mbids": [f"T{i}" for i in range(0, 3000, 2)]},
+            {"k": 10},
+            {**self.defaults, "k": 10, "use_ros": False},
+            {**self.defaults, "k": 10, "feature_weights": {"f0": 2.0}},
+            {**self.defaults, "k": 10, "stats": "exact"},
+        ]:
+            from_graph, exact = self.recommend_both(options)
+            for g, e in zip(from_graph, exact):
+                self.assertEqual(g['stats']['engine'], "exact", options)
+                self.assertListEqual(g['top_tracks'], e['top_tracks'])
+
+    def test_stats(self):
+        # computed over the whole partition when the graph was built, at float16 precision
+        from_graph, exact = self.recommend_both({**self.defaults, "k": 5, "stats": "approx"})
+        for g, e in zip(from_graph, exact):
+            self.assertEqual(g['stats']['mode'], "approx")
+            for name in ["mean", "std", "p95", "max"]:
+                self.assertAlmostEqual(g['stats'][name], e['stats'][name], places=2)
+
+        rec.publish(self.snapshot)
+        out = rec.recommend("T0", {**self.defaults, "k": 5, "stats": "none"})
+        self.assertEqual(out['stats']['engine'], "graph")
+        self.assertIsNone(out['stats']['mean'])
@@ -0,0 +1,113 @@
+import numpy as np
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services.norm_cache import NormCache
+from recommend_api.services.scoring import weighted_norms
+
+
+class NormCacheTests(SimpleTestCase):
+    def setUp(self):
+        matrix = np.random.default_rng(0).normal(size=(50, 4)).astype(np.float32)
+        self.snapshot = SimpleNamespace(feature_matrix_sq=np.square(matrix), generation=1)
+        self.cache = NormCache(max_profiles=2)
+        self.profiles = [np.array([1, 2, 1, 1], np.float32), np.array([0, 1, 1, 1], np.float32)]
+
+    def test_admitted_on_second_request(self):
+        weights = self.profiles[0]
+        self.assertIsNone(self.cache.get(self.snapshot, weights))
+        norms = self.cache.get(self.snapshot, weights)
+        np.testing.assert_array_equal(
+            norms, weighted_norms(self.snapshot.feature_matrix_sq, weights)
+        )
+        self.assertIs(self.cache.get(self.snapshot, weights.copy()), norms)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["profiles"]), (1, 2, 1))
+        self.assertEqual(stats["size_bytes"], norms.nbytes)
+
+    def test_evicts_least_recently_used(self):
+        cache = NormCache(max_profiles=2, admit_after=1)
+        third = np.array([1, 1, 1, 3], np.float32)
+        for weights in [*self.profiles, self.profiles[0], third]:
+            cache.get(self.snapshot, weights)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        # the second profile was the least recently used
+        self.assertEqual(cache.stats()["hits"], 1)
+        cache.get(self.snapshot, self.profiles[0])
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_new_snapshot_clears_profiles(self):
+        self.cache.admit_after = 1
+        self.cache.get(self.snapshot, self.profiles[0])
+        new_snapshot = SimpleNamespace(
+            feature_matrix_sq=self.snapshot.feature_matrix_sq * 4, generation=2
+        )
+        norms = self.cache.get(new_snapshot, self.profiles[0])
+        np.testing.assert_array_equal(
+            norms, weighted_norms(new_snapshot.feature_matrix_sq, self.profiles[0])
+        )
+        self.assertEqual(self.cache.stats()["hits"], 0)
+
+    def test_old_snapshot_bypasses(self):
+        # requests on the old and new snapshot overlap during a reload
+        self.cache.admit_after = 1
+        new_snapshot = SimpleNamespace(
+            feature_matrix_sq=self.snapshot.feature_matrix_sq * 4, generation=2
+        )
+        self.cache.get(self.snapshot, self.profiles[0])
+        self.cache.get(new_snapshot, self.profiles[0])
+        for _ in range(3):
+            self.assertIsNone(self.cache.get(self.snapshot, self.profiles[0]))
+            np.testing.assert_array_equal(
+                self.cache.get(new_snapshot, self.profiles[0]),
+                weighted_norms(new_snapshot.feature_matrix_sq, self.profiles[0]),
+            )
+        self.assertEqual((self.cache.stats()["hits"], self.cache.stats()["profiles"]), (3, 1))
+
+    def test_disabled(self):
+        self.cache.max_profiles = 0
+        for _ in range(3):
+            self.assertIsNone(self.cache.get(self.snapshot, self.profiles[0]))
+        self.assertEqual(self.cache.stats()["profiles"], 0)
+
+
+class RecommendNormCacheTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        self.enterContext(patch.object(rec, "norm_cache", NormCache(max_profiles=2)))
+        rng = np.random.default_rng(0)
+        n = 3000
+        self.snapshot = rec.load_features({
+            "feature_matrix": rng.normal(size=(n, 4)).astype(np.float32),
+            "mbids": np.array([f"T{i}" for i in range(n)]),
+            "years": rng.choice([1985, 1995], size=n),
+            "genre_rosamerica": rng.choice(["roc", "pop"], size=n),
+            "genre_dortmund": rng.choice(["rock", "jazz"], size=n),
+            "feature_names": np.array(["f0", "f1", "f2", "f3"]),
+        })
+
+    def test_cached_norms_give_same_results(self):
+        for options in [
+            {"k": 10, "feature_weights": {"f0": 3.0, "f2": 0.5}},
+            # scattered rows, int8 first pass (its stats use the exact norms once they're cached)
+            {"k": 10, "use_ros": False, "feature_weights": {"f1": 0.0}},
+            {"k": 10, "match_genre": False, "match_decade": False, "feature_weights": {"f3": 2.0}},
+        ]:
+            computed = rec.recommend("T0", options)
+            cached = rec.recommend("T0", options)
+            self.assertListEqual(
+                [t["mbid"] for t in cached["top_tracks"]],
+                [t["mbid"] for t in computed["top_tracks"]],
+            )
+            np.testing.assert_allclose(
+                [t["similarity"] for t in cached["top_tracks"]],
+                [t["similarity"] for t in computed["top_tracks"]],
+                rtol=1e-6,
+            )
+        # each profile was admitted on its second request, the first one was then evicted
+        stats = rec.norm_cache.stats()
+        self.assertEqual((stats["profiles"], stats["evictions"]), (2, 1))
@@ -0,0 +1,64 @@
+import numpy as np
+from django.test import SimpleTestCase
+from recommend_api.services.partitions import PartitionIndex, decade_of
+
+
+class PartitionIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.genres = np.array(["roc", "pop", "roc", "pop", "roc", None], dtype=object)
+        self.years = np.array([1991, 1985, 1983, 1999, 1995, 0], dtype=np.int16)
+        self.index = PartitionIndex.build(self.genres, self.years)
+
+    def rows(self, **kwargs):
+        rows = self.index.rows(**kwargs)
+        if isinstance(rows, slice):
+            rows = np.arange(rows.start, rows.stop)
+        return sorted(rows.tolist())
+
+    def test_decade_of(self):
+        self.assertEqual(decade_of(1994), 1990)
+        self.assertEqual(decade_of(0), 0)
+
+    def test_partitions(self):
+        # ("", 0), (pop, 1980), (pop, 1990), (roc, 1980), (roc, 1990)
+        self.assertListEqual(self.index.genres.tolist(), ["", "pop", "pop", "roc", "roc"])
+        self.assertListEqual(self.index.decades.tolist(), [0, 1980, 1990, 1980, 1990])
+        self.assertListEqual(self.index.offsets.tolist(), [0, 1, 2, 3, 4, 6])
+
+    def test_rows_genre_and_decade(self):
+        self.assertListEqual(self.rows(genre="roc", decade=1990), [0, 4])
+        self.assertListEqual(self.rows(genre="pop", decade=1980), [1])
+        self.assertListEqual(self.rows(genre="", decade=0), [5])
+
+    def test_rows_genre_only(self):
+        self.assertListEqual(self.rows(genre="roc"), [0, 2, 4])
+
+    def test_rows_decade_only(self):
+        self.assertListEqual(self.rows(decade=1980), [1, 2])
+
+    def test_rows_no_filter(self):
+        self.assertListEqual(self.rows(), [0, 1, 2, 3, 4, 5])
+
+    def test_rows_missing_partition(self):
+        self.assertListEqual(self.rows(genre="jaz", decade=1990), [])
+
+    def test_sorted_rows_are_slices(self):
+        order = self.index.order
+        index = PartitionIndex.build(self.genres[order], self.years[order])
+        self.assertIsNone(index.order)
+        self.assertEqual(index.rows(genre="roc", decade=1990), slice(4, 6))
+        self.assertEqual(index.rows(genre="roc"), slice(3, 6))
+
+    def test_round_trip(self):
+        restored = PartitionIndex.from_arrays(self.index.to_arrays("ros"), "ros")
+        self.assertListEqual(restored.order.tolist(), self.index.order.tolist())
+        self.assertListEqual(restored.offsets.tolist(), self.index.offsets.tolist())
+        self.assertIsNone(PartitionIndex.from_arrays({}, "ros"))
+
+    def test_contains(self):
+        rows = np.arange(6)
+        for kwargs in [{"genre": "roc", "decade": 1990}, {"genre": "pop"}, {"decade": 1980}, {}]:
+            expected = self.rows(**kwargs)
+            self.assertListEqual(
+                rows[self.index.contains(rows, **kwargs)].tolist(), expected, kwargs
+            )
@@ -0,0 +1,103 @@
+import numpy as np
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.columns import hash_strings
+
+
+class RecommendProfileTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        rng = np.random.default_rng(0)
+        n = 3000
+        matrix = rng.normal(size=(n, 8)).astype(np.float32)
+        self.matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.genres = rng.choice(["roc", "pop", "jaz"], size=n)
+        self.years = rng.choice([1985, 1995], size=n)
+        self.artists = [[f"A{i}"] for i in rng.integers(0, 50, size=n)]
+        self.snapshot = rec.load_features({
+            "feature_matrix": self.matrix,
+            "mbids": np.array([f"T{i}" for i in range(n)]),
+            "years": self.years,
+            "genre_rosamerica": self.genres,
+            "genre_dortmund": rng.choice(["rock", "jazz"], size=n),
+            "feature_names": np.array([f"f{i}" for i in range(8)]),
+            "title_hashes": hash_strings([f"S{i}" for i in rng.integers(0, 1000, size=n)]),
+            **ArtistIndex.build(self.artists).to_arrays(),
+        })
+        self.seeds = [0, 1, 2, 3]
+        self.seed_weights = np.array([1.0, 0.5, 2.0, 1.0], dtype=np.float32)
+
+    def brute_force(self, scores, k):
+        """The k best rows sharing the genre and decade of a seed, seeds left out."""
+        partitions = {(self.genres[row], self.years[row]) for row in self.seeds}
+        candidates = np.array([
+            row for row in range(len(self.matrix))
+            if (self.genres[row], self.years[row]) in partitions and row not in self.seeds
+        ])
+        order = np.argsort(-scores[candidates], kind="stable")[:k]
+        return [f"T{row}" for row in candidates[order]], len(candidates)
+
+    def test_centroid(self):
+        centroid = self.seed_weights @ self.matrix[self.seeds]
+        expected, candidate_count = self.brute_force(
+            self.matrix @ centroid / np.linalg.norm(centroid), 10
+        )
+        out = rec.recommend_profile(
+            [f"T{row}" for row in self.seeds], self.seed_weights.tolist(), {"k": 10}
+        )
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], expected)
+        self.assertEqual(out['stats']['candidate_count'], candidate_count)
+        self.assertEqual(out['stats']['engine'], "exact")
+
+    def test_max(self):
+        scaled = self.seed_weights / self.seed_weights.max()
+        scores = (self.matrix @ self.matrix[self.seeds].T * scaled).max(axis=1)
+        expected, _ = self.brute_force(scores, 10)
+        # blocks smaller than the catalogue
+        with patch.object(rec, "BATCH_MAX_SCORES", 1000):
+            out = rec.recommend_profile(
+                [f"T{row}" for row in self.seeds], self.seed_weights.tolist(),
+                {"k": 10, "profile": "max"},
+            )
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], expected)
+        np.testing.assert_allclose(
+            [t['similarity'] for t in out['top_tracks']],
+            np.sort(scores[[int(t['mbid'][1:]) for t in out['top_tracks']]])[::-1],
+            rtol=1e-5,
+        )
+
+    def test_single_seed(self):
+        for options in [
+            {"k": 10},
+            {"k": 10, "match_genre": False, "match_decade": False, "diversify": True},
+            {"k": 10, "exclude_mbids": ["T5", "T6"], "profile": "max"},
+        ]:
+            self.assertListEqual(
+                rec.recommend_profile(["T7"], None, options)['top_tracks'],
+                rec.recommend("T7", options)['top_tracks'],
+            )
+
+    def test_diversify(self):
+        out = rec.recommend_profile(
+            [f"T{row}" for row in self.seeds], None, {"k": 20, "diversify": True}
+        )
+        artists = [self.artists[int(t['mbid'][1:])][0] for t in out['top_tracks']]
+        self.assertEqual(len(artists), 20)
+        self.assertEqual(len(set(artists)), 20)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            rec.recommend_profile(["T0", "unknown"])
+        with self.assertRaises(ValueError):
+            rec.recommend_profile([])
+        with self.assertRaises(ValueError):
+            rec.recommend_profile(["T0", "T1"], [1.0])
+        with self.assertRaises(ValueError):
+            rec.recommend_profile(["T0", "T1"], [0.0, -1.0])
+        with self.assertRaises(ValueError):
+            rec.recommend_profile(["T0"], options={"profile": "median"})
@@ -0,0 +1,40 @@
+import numpy as np
+from django.test import SimpleTestCase
+from recommend_api.services.quantize import QuantizedMatrix
+from recommend_api.services.scoring import weighted_cosine, weighted_norms
+
+
+class QuantizedMatrixTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(size=(500, 16)).astype(np.float32)
+        self.matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix[7] = 0  # zero vector
+        self.quantized = QuantizedMatrix.build(self.matrix)
+
+    def test_codes(self):
+        self.assertEqual(self.quantized.codes.dtype, np.int8)
+        self.assertEqual(np.abs(self.quantized.codes).max(), 127)
+        np.testing.assert_allclose(
+            self.quantized.codes * self.quantized.scales, self.matrix, atol=self.quantized.scales.max()
+        )
+
+    def test_cosine_close_to_exact(self):
+        query = self.matrix[0]
+        rows = np.arange(0, 500, 3)
+        for weights in [None, np.linspace(0.5, 2, 16, dtype=np.float32)]:
+            exact = weighted_cosine(query, self.matrix[rows], np.square(self.matrix[rows]), weights)
+            approximate = self.quantized.cosine(query, rows, weights)
+            self.assertEqual(approximate.dtype, np.float32)
+            np.testing.assert_allclose(approximate, exact, atol=0.03)
+            # exact norms only leave the error of the dot products
+            norms = weighted_norms(np.square(self.matrix[rows]), weights)
+            np.testing.assert_allclose(
+                self.quantized.cosine(query, rows, weights, candidate_norms=norms), exact, atol=0.03
+            )
+        self.assertEqual(self.quantized.cosine(query, [7])[0], 0)
+
+    def test_round_trip(self):
+        restored = QuantizedMatrix.from_arrays(self.quantized.to_arrays())
+        np.testing.assert_array_equal(restored.codes, self.quantized.codes)
+        self.assertIsNone(QuantizedMatrix.from_arrays({}))
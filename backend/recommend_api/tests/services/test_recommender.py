@@ -1,6 +1,14 @@
 import numpy as np
+from dataclasses import replace
+from django.apps import apps
 from django.test import SimpleTestCase
+from unittest.mock import ANY, patch
 import recommend_api.services.recommender as rec
+from recommend_api.api import recommend_options
+from recommend_api.services.artist_index import ArtistIndex
+from recommend_api.services.columns import CategoricalColumn, hash_strings
+from recommend_api.services.ivf import IVFIndex
+from recommend_api.services.mbid_index import encode_mbids
 
 class RecommenderTests(SimpleTestCase):
     responseKeys = [
@@ -8,24 +16,31 @@ class RecommenderTests(SimpleTestCase):
     ]
 
     def setUp(self):
-        # Override the local variables of the module, removes the need to load feature matrix 
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        # Results are computed by every call, the tests compare code paths against each other
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+
+        # Publish a snapshot built from these arrays, removes the need to load feature matrix
         # and metadata from disk
 
         # 4 tracks, 3-dim features
-        rec.feature_matrix = np.array([
-            [1.0, 0.0, 0.0],  # A
-            [0.9, 0.1, 0.0],  # B  (most similar to A)
-            [0.2, 1.0, 0.0],  # C
-            [0.1, 0.0, 1.0],  # D
-        ], dtype=float)
-
-        rec.mbid_to_idx = np.array(['A', 'B', 'C', 'D'])
-        # A,B,C in 1990s decade; D in 1980s
-        rec.years = np.array([1991, 1992, 1994, 1983])  
-        # Put A,B,C in same Rosamerica genre, D different
-        rec.genre_rosamerica = np.array(['alt', 'alt', 'alt', 'roc'])
-        rec.genre_dortmund = np.array(['metal', 'jazz', 'metal', 'metal'])
-        rec.feature_names = np.array(['danceability', 'aggressiveness', 'brightness'])
+        self.snapshot = rec.load_features({
+            "feature_matrix": np.array([
+                [1.0, 0.0, 0.0],  # A
+                [0.9, 0.1, 0.0],  # B  (most similar to A)
+                [0.2, 1.0, 0.0],  # C
+                [0.1, 0.0, 1.0],  # D
+            ], dtype=float),
+            "mbids": np.array(['A', 'B', 'C', 'D']),
+            # A,B,C in 1990s decade; D in 1980s
+            "years": np.array([1991, 1992, 1994, 1983]),
+            # Put A,B,C in same Rosamerica genre, D different
+            "genre_rosamerica": np.array(['alt', 'alt', 'alt', 'roc']),
+            "genre_dortmund": np.array(['metal', 'jazz', 'metal', 'metal']),
+            "feature_names": np.array(['danceability', 'aggressiveness', 'brightness']),
+        })
     
     def test_recommend_rosamerica(self):
         out = rec.recommend('A', options={"k":2, "use_ros":True})
@@ -54,6 +69,26 @@ class RecommenderTests(SimpleTestCase):
         self.assertEqual(out['top_tracks'][0]['mbid'], 'C')
         self.assertEqual(len(out['top_tracks']), 1)
 
+    def test_squared_rows_gathered_for_norms_only(self):
+        # scattered (Dortmund) candidates have known norms, only weights without cached norms
+        # read their squared features
+        reads = []
+
+        class Squares:
+            def __getitem__(_, rows):
+                reads.append(rows)
+                return self.snapshot.feature_matrix_sq[rows]
+
+        rec.publish(replace(self.snapshot, feature_matrix_sq=Squares()))
+        out = rec.recommend('A', options={"k": 2, "use_ros": False})
+        self.assertEqual(out['top_tracks'][0]['mbid'], 'C')
+        self.assertListEqual(reads, [])
+        with patch.object(rec.norm_cache, "get", return_value=None):
+            rec.recommend('A', options={
+                "k": 2, "use_ros": False, "feature_weights": {"danceability": 0.5},
+            })
+        self.assertEqual(len(reads), 1)
+
     def test_genre_guardrails_off(self):
         out = rec.recommend('A', options={"k":2, "use_ros": False, "match_genre": False})
 
@@ -72,13 +107,324 @@ class RecommenderTests(SimpleTestCase):
         self.assertEqual(out['top_tracks'][1]['mbid'], 'D')
         self.assertEqual(len(out['top_tracks']), 2)
 
+    def test_decade_only_rosamerica(self):
+        out = rec.recommend('A', options={"k":5, "use_ros": True, "match_genre": False})
+
+        # D is the only track outside the 1990s
+        self.assertEqual(out['stats']['candidate_count'], 2)
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['B', 'C'])
+
+    def test_no_candidates(self):
+        out = rec.recommend('D', options={"k":5, "use_ros": True})
+
+        self.assertEqual(out['stats']['candidate_count'], 0)
+        self.assertListEqual(out['top_tracks'], [])
+        self.assertIsNone(out['stats']['max'])
+
+    def test_feature_weights(self):
+        out = rec.recommend('B', options={"k":2})
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['A', 'C'])
+
+        # without danceability A has nothing in common with B
+        out = rec.recommend('B', options={"k":2, "feature_weights": {"danceability": 0}})
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['C', 'A'])
+        self.assertEqual(out['top_tracks'][1]['similarity'], 0)
+
+    def test_streaming_scan(self):
+        options = {"k": 3, "match_genre": False, "match_decade": False, "exclude_mbids": ['C']}
+        expected = rec.recommend('A', options=options)
+
+        # force the block-by-block scan on the tiny test catalogue
+        with patch.object(rec, "STREAM_MIN_CANDIDATES", 0), patch.object(rec, "STREAM_BLOCK_SIZE", 2):
+            out = rec.recommend('A', options=options)
+
+        self.assertListEqual(
+            [t['mbid'] for t in out['top_tracks']], [t['mbid'] for t in expected['top_tracks']]
+        )
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['B', 'D'])
+        self.assertEqual(out['stats']['candidate_count'], 2)
+        self.assertAlmostEqual(out['stats']['mean'], expected['stats']['mean'], places=5)
+
+    def test_parallel_scan(self):
+        options = {"k": 3, "match_genre": False, "match_decade": False, "exclude_mbids": ['C']}
+        with patch.object(rec, "STREAM_MIN_CANDIDATES", 0), patch.object(rec, "STREAM_BLOCK_SIZE", 2):
+            expected = rec.recommend('B', options=options)
+            # one shard per row, scored by 3 threads
+            self.addCleanup(
+                rec.configure_scan, threads=rec.SCAN_THREADS, shard_size=rec.SCAN_SHARD_SIZE
+            )
+            rec.configure_scan(threads=3, shard_size=1)
+            out = rec.recommend('B', options=options)
+
+        self.assertListEqual(out['top_tracks'], expected['top_tracks'])
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['A', 'D'])
+        self.assertEqual(out['stats']['candidate_count'], 2)
+        for name in ['mean', 'std', 'p95', 'max']:
+            self.assertAlmostEqual(out['stats'][name], expected['stats'][name], places=6)
+
+        with self.assertRaises(ValueError):
+            rec.configure_scan(threads=0)
+
+    def test_stats_modes(self):
+        options = {"k": 2, "match_genre": False, "match_decade": False}
+        exact = rec.recommend('A', options={**options, "stats": "exact"})['stats']
+        self.assertEqual(exact['mode'], 'exact')
+        self.assertIsNotNone(exact['p95'])
+
+        none = rec.recommend('A', options={**options, "stats": "none"})['stats']
+        self.assertEqual(none['mode'], 'none')
+        self.assertIsNone(none['mean'])
+        self.assertEqual(none['candidate_count'], exact['candidate_count'])
+
+        # too few candidates to sample, the default gives exact stats
+        self.assertEqual(rec.recommend('A', options=options)['stats'], {**exact, "search_time": ANY})
+
+        with patch.object(rec, "STREAM_MIN_CANDIDATES", 0), patch.object(rec, "STREAM_BLOCK_SIZE", 2):
+            streamed = rec.recommend('A', options={**options, "stats": "none"})['stats']
+        self.assertEqual(streamed['candidate_count'], exact['candidate_count'])
+        self.assertIsNone(streamed['max'])
+
+        with self.assertRaises(ValueError):
+            rec.recommend('A', options={"stats": "median"})
+
+    def test_recommend_many_matches_recommend(self):
+        for options in [
+            {"k": 2},
+            {"k": 2, "use_ros": False},
+            {"k": 3, "match_genre": False, "exclude_mbids": ['C']},
+            {"k": 3, "match_decade": False, "feature_weights": {"danceability": 0.2}},
+        ]:
+            many = rec.recommend_many(['A', 'B', 'D', 'A'], options=options)
+            self.assertEqual(len(many), 4)
+            for mbid, out in zip(['A', 'B', 'D', 'A'], many):
+                expected = rec.recommend(mbid, options=options)
+                self.assertListEqual(list(out.keys()), self.responseKeys)
+                self.assertListEqual(
+                    [t['mbid'] for t in out['top_tracks']],
+                    [t['mbid'] for t in expected['top_tracks']],
+                )
+                self.assertEqual(out['stats']['candidate_count'], expected['stats']['candidate_count'])
+
+    def test_recommend_many_chunks(self):
+        expected = rec.recommend_many(['A', 'B', 'C'], options={"k": 2})
+        with patch.object(rec, "BATCH_MAX_SCORES", 1):
+            out = rec.recommend_many(['A', 'B', 'C'], options={"k": 2})
+        self.assertListEqual(
+            [[t['mbid'] for t in r['top_tracks']] for r in out],
+            [[t['mbid'] for t in r['top_tracks']] for r in expected],
+        )
+
+    def test_recommend_many_unknown_target(self):
+        with self.assertRaises(ValueError):
+            rec.recommend_many(['A', 'missing'])
+
+    def test_ivf_engine(self):
+        options = {"k": 3, "match_genre": False, "match_decade": False, "exclude_mbids": ['C']}
+        exact = rec.recommend('A', options=options)
+        self.assertEqual(exact['stats']['engine'], 'exact')
+
+        # no IVF index loaded, falls back to exact search
+        out = rec.recommend('A', options={**options, "engine": "ivf"})
+        self.assertEqual(out['stats']['engine'], 'exact')
+
+        ivf_index = IVFIndex.build(self.snapshot.feature_matrix, nlist=2)
+        with patch.object(self.snapshot, "ivf_index", ivf_index):
+            # probing every list is an exhaustive search
+            out = rec.recommend('A', options={**options, "engine": "ivf", "nprobe": 2})
+            self.assertEqual(out['stats']['engine'], 'ivf')
+            self.assertListEqual(
+                [t['mbid'] for t in out['top_tracks']], [t['mbid'] for t in exact['top_tracks']]
+            )
+
+            # filters still apply to the probed lists
+            out = rec.recommend('A', options={"k": 3, "engine": "ivf", "nprobe": 2})
+            self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['B', 'C'])
+
+            many = rec.recommend_many(['A'], options={**options, "engine": "ivf", "nprobe": 2})
+            self.assertEqual(many[0]['stats']['engine'], 'ivf')
+
+    def test_encoded_columns(self):
+        # same tracks as exported by build_db: binary MBIDs and dictionary-encoded genres
+        mbids = [
+            "00000000-0000-0000-0000-000000000000",
+            "62c2e20a-559e-422f-a44c-9afa7882f0c4",
+            "1b0c0e3a-7c3a-4d5e-9a36-2b1f1b6a4f10",
+            "9f3e1a7e-8e0b-4d2c-8a1f-5c6d7e8f9a0b",
+        ]
+        rec.load_features({
+            "feature_matrix": self.snapshot.feature_matrix,
+            "mbids": encode_mbids(mbids),
+            "years": self.snapshot.years,
+            **CategoricalColumn.encode(['alt', 'alt', 'alt', 'roc']).to_arrays("genre_rosamerica"),
+            **CategoricalColumn.encode(['metal', 'jazz', 'metal', 'metal']).to_arrays("genre_dortmund"),
+            "feature_names": self.snapshot.feature_names,
+        })
+        out = rec.recommend(mbids[0], options={"k": 2, "exclude_mbids": [mbids[2]]})
+        self.assertEqual(out['target_genre_rosamerica'], 'alt')
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], [mbids[1]])
+        self.assertEqual(out['top_tracks'][0]['genre_dortmund'], 'jazz')
+        self.assertEqual(rec.get_snapshot().mbid_at(3), mbids[3])
+
+    def test_exclude_artists(self):
+        # A and C by artist X, B by X and Y, D by Z
+        artist_index = ArtistIndex.build([['X'], ['X', 'Y'], ['X'], ['Z']])
+        rec.publish(replace(self.snapshot, artist_index=artist_index))
+        options = {"k": 3, "match_genre": False, "match_decade": False}
+        out = rec.recommend('A', options={**options, "exclude_artists": ['Y']})
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['C', 'D'])
+        out = rec.recommend('A', options={**options, "exclude_artists": ['X', 'unknown']})
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['D'])
+        self.assertEqual(out['stats']['candidate_count'], 1)
+
+        many = rec.recommend_many(['A', 'D'], options={**options, "exclude_artists": ['Z']})
+        self.assertListEqual([t['mbid'] for t in many[0]['top_tracks']], ['B', 'C'])
+        self.assertListEqual([t['mbid'] for t in many[1]['top_tracks']], ['A', 'B', 'C'])
+
+        # feature files without an artist index can't exclude artists
+        rec.publish(self.snapshot)
+        with self.assertRaises(ValueError):
+            rec.recommend('A', options={"exclude_artists": ['X']})
+        self.assertEqual(len(rec.recommend('A', options={"exclude_artists": []})['top_tracks']), 2)
+
+    def test_diversify(self):
+        # A, B and C by artist X, D by Z
+        artist_index = ArtistIndex.build([['X'], ['X'], ['X'], ['Z']])
+        rec.publish(replace(self.snapshot, artist_index=artist_index))
+        options = {"k": 3, "match_genre": False, "match_decade": False, "diversify": True}
+        out = rec.recommend('A', options=options)
+        # C is only X's second best track
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['B', 'D'])
+        self.assertEqual(out['stats']['candidate_count'], 3)
+        # the pool grows when its best tracks are all by the same artist
+        with patch.object(rec, "DIVERSE_POOL_FACTOR", 1):
+            out = rec.recommend('A', options={**options, "k": 2})
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['B', 'D'])
+
+        # B is the target's song under another MBID, C is then X's best track
+        title_hashes = hash_strings(['Song', 'Song', 'Other song', 'Song'])
+        rec.publish(replace(self.snapshot, artist_index=artist_index, title_hashes=title_hashes))
+        out = rec.recommend('A', options={**options, "k": 1})
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['C'])
+        many = rec.recommend_many(['A', 'D'], options=options)
+        self.assertListEqual([t['mbid'] for t in many[0]['top_tracks']], ['C', 'D'])
+        self.assertListEqual([t['mbid'] for t in many[1]['top_tracks']], ['A'])
+
+        # feature files without an artist index return the plain top-k
+        rec.publish(self.snapshot)
+        with self.assertLogs(rec.log, "WARNING"):
+            out = rec.recommend('A', options=options)
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['B', 'C', 'D'])
+        many = rec.recommend_many(['A'], options=options)
+        self.assertListEqual(many[0]['top_tracks'], out['top_tracks'])
+
+    def test_popularity_blend(self):
+        # D is far less similar to A than B and C, but much more popular
+        popularity = np.array([0.0, 0.0, 0.0, 2.0], dtype=np.float32)
+        rec.publish(replace(self.snapshot, popularity=popularity))
+        options = {
+            "k": 3, "match_genre": False, "match_decade": False,
+            "similarity_weight": 0.9, "popularity_weight": 0.1,
+        }
+        out = rec.recommend('A', options=options)
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['B', 'D', 'C'])
+        similar = rec.recommend('A', options={"k": 3, "match_genre": False, "match_decade": False})
+        # similarities aren't blended, the score is
+        self.assertEqual(out['top_tracks'][1]['similarity'], similar['top_tracks'][2]['similarity'])
+        self.assertAlmostEqual(
+            out['top_tracks'][1]['score'], 0.9 * similar['top_tracks'][2]['similarity'] + 0.2,
+            places=6,
+        )
+
+        with patch.object(rec, "STREAM_MIN_CANDIDATES", 0), patch.object(rec, "STREAM_BLOCK_SIZE", 2):
+            streamed = rec.recommend('A', options=options)
+        self.assertListEqual(streamed['top_tracks'], out['top_tracks'])
+        many = rec.recommend_many(['A'], options=options)
+        self.assertListEqual(many[0]['top_tracks'], out['top_tracks'])
+
+        # feature files without popularity rank by similarity alone
+        rec.publish(self.snapshot)
+        with self.assertLogs(rec.log, "WARNING"):
+            out = rec.recommend('A', options=options)
+        self.assertListEqual(out['top_tracks'], similar['top_tracks'])
+
+    def test_api_defaults(self):
+        # the view's default options diversify and blend popularity, the test feature file has
+        # neither an artist index nor a popularity column
+        with self.assertLogs(rec.log, "WARNING"):
+            out = rec.recommend('A', options=recommend_options({"mbid": 'A'}))
+        self.assertListEqual([t['mbid'] for t in out['top_tracks']], ['B', 'C'])
+
     def test_feature_stats(self):
         # Make one column near-constant to trigger near_zero_col_count
-        fm = rec.feature_matrix.copy()
+        fm = self.snapshot.feature_matrix.copy()
         fm[:, 2] = 0.000001 
-        rec.feature_matrix = fm
+        rec.publish(replace(self.snapshot, feature_matrix=fm))
 
         stats = rec.get_feature_stats()
         assert stats['unique_track_count'] == 4
         assert stats['total_col_count'] == 3
         assert stats['near_zero_col_count'] >= 1
+
+    def test_find_index(self):
+        self.assertEqual(self.snapshot.find_index('C'), 2)
+        self.assertEqual(self.snapshot.find_index('missing'), -1)
+
+    def test_unknown_target(self):
+        with self.assertRaises(ValueError):
+            rec.recommend('missing')
+
+    def test_preload_only_from_server(self):
+        # management commands run `ready()` too, they don't load the feature file
+        with patch.object(rec.threading, "Thread") as thread:
+            apps.get_app_config("recommend_api").ready()
+            thread.assert_not_called()
+            rec.start_preload()
+            thread.assert_called_once_with(target=rec.preload, daemon=True)
+
+
+class QuantizedFirstPassTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        rng = np.random.default_rng(0)
+        n = 6000
+        matrix = rng.normal(size=(n, 16)).astype(np.float32)
+        self.snapshot = rec.load_features({
+            "feature_matrix": matrix / np.linalg.norm(matrix, axis=1, keepdims=True),
+            "mbids": np.array([f"T{i}" for i in range(n)]),
+            "years": rng.choice([1985, 1995, 2005], size=n),
+            "genre_rosamerica": rng.choice(["roc", "pop"], size=n),
+            "genre_dortmund": rng.choice(["rock", "jazz"], size=n),
+            "feature_names": np.array([f"f{i}" for i in range(16)]),
+            "popularity": np.log1p(rng.integers(0, 1000, size=n)).astype(np.float32),
+        })
+        self.seeds = [f"T{i}" for i in range(0, n, 300)]
+
+    def test_top_k_matches_exact_search(self):
+        for options in [
+            {"k": 50, "use_ros": False},
+            {"k": 50, "match_genre": False},
+            {"k": 200, "use_ros": False, "match_decade": False},
+            {"k": 50, "use_ros": False, "feature_weights": {"f0": 3.0, "f3": 0.2}},
+            {"k": 50, "use_ros": False, "similarity_weight": 0.9, "popularity_weight": 0.1},
+        ]:
+            # the candidates are scattered rows, large enough for the int8 first pass
+            partition_key = rec._partition_key(self.snapshot, 0, rec._parse_options(options))
+            rows = rec._candidate_rows(self.snapshot, partition_key)
+            self.assertTrue(rec._use_quantized(self.snapshot, rows, options["k"]))
+            quantized = [rec.recommend(m, options) for m in self.seeds]
+            with patch.object(self.snapshot, "quantized_matrix", None):
+                exact = [rec.recommend(m, options) for m in self.seeds]
+
+            for q, e in zip(quantized, exact):
+                self.assertListEqual(
+                    [t['mbid'] for t in q['top_tracks']], [t['mbid'] for t in e['top_tracks']]
+                )
+                np.testing.assert_allclose(
+                    [t['similarity'] for t in q['top_tracks']],
+                    [t['similarity'] for t in e['top_tracks']],
+                    rtol=1e-6,
+                )
+                self.assertEqual(q['stats']['candidate_count'], e['stats']['candidate_count'])
@@ -0,0 +1,141 @@
+import numpy as np
+from dataclasses import replace
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services.result_cache import ResultCache, _result_size
+
+
+def make_result(mbid):
+    return {
+        "target_year": 1991,
+        "top_tracks": [{"mbid": mbid, "similarity": 0.5, "year": 1992}],
+        "stats": {"candidate_count": 1, "search_time": 0.001},
+    }
+
+
+class ResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.snapshot = SimpleNamespace(version="v1", generation=1)
+        self.entry_size = _result_size(make_result("A"))
+        # room for two results
+        self.cache = ResultCache(max_bytes=2 * self.entry_size, ttl=60)
+
+    def test_hit_returns_copy(self):
+        self.assertIsNone(self.cache.get(self.snapshot, "a"))
+        self.cache.put(self.snapshot, "a", make_result("A"))
+        cached = self.cache.get(self.snapshot, "a")
+        self.assertEqual(cached, make_result("A"))
+
+        # callers can modify what they get without changing the cached result
+        cached["top_tracks"].pop()
+        self.assertEqual(self.cache.get(self.snapshot, "a"), make_result("A"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (2, 1, 1))
+        self.assertEqual(stats["size_bytes"], self.entry_size)
+        self.assertEqual(stats["version"], "v1")
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put(self.snapshot, "a", make_result("A"))
+        self.cache.put(self.snapshot, "b", make_result("B"))
+        self.cache.get(self.snapshot, "a")
+        self.cache.put(self.snapshot, "c", make_result("C"))
+
+        self.assertIsNone(self.cache.get(self.snapshot, "b"))
+        self.assertIsNotNone(self.cache.get(self.snapshot, "a"))
+        self.assertIsNotNone(self.cache.get(self.snapshot, "c"))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertLessEqual(self.cache.stats()["size_bytes"], self.cache.max_bytes)
+
+    def test_expired_entries(self):
+        with patch("recommend_api.services.result_cache.time.monotonic", return_value=100.0):
+            self.cache.put(self.snapshot, "a", make_result("A"))
+        with patch("recommend_api.services.result_cache.time.monotonic", return_value=159.0):
+            self.assertIsNotNone(self.cache.get(self.snapshot, "a"))
+        with patch("recommend_api.services.result_cache.time.monotonic", return_value=160.0):
+            self.assertIsNone(self.cache.get(self.snapshot, "a"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["expirations"], stats["entries"], stats["size_bytes"]), (1, 0, 0))
+
+    def test_new_snapshot_clears_entries(self):
+        self.cache.put(self.snapshot, "a", make_result("A"))
+        new_snapshot = SimpleNamespace(version="v2", generation=2)
+        self.assertIsNone(self.cache.get(new_snapshot, "a"))
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+        self.assertEqual(self.cache.stats()["version"], "v2")
+
+    def test_old_snapshot_bypasses(self):
+        # requests on the old and new snapshot overlap during a reload
+        new_snapshot = SimpleNamespace(version="v2", generation=2)
+        self.cache.put(self.snapshot, "a", make_result("A"))
+        self.cache.put(new_snapshot, "a", make_result("B"))
+        for _ in range(3):
+            self.assertIsNone(self.cache.get(self.snapshot, "a"))
+            self.cache.put(self.snapshot, "a", make_result("A"))
+            self.assertEqual(self.cache.get(new_snapshot, "a")["top_tracks"][0]["mbid"], "B")
+        stats = self.cache.stats()
+        self.assertEqual((stats["invalidations"], stats["version"], stats["hits"]), (1, "v2", 3))
+
+    def test_disabled(self):
+        self.cache.max_bytes = 0
+        self.cache.put(self.snapshot, "a", make_result("A"))
+        self.assertIsNone(self.cache.get(self.snapshot, "a"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+
+class RecommendCacheTests(SimpleTestCase):
+    def setUp(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(
+            patch.object(rec, "result_cache", ResultCache(max_bytes=2**20, ttl=60))
+        )
+        rng = np.random.default_rng(0)
+        n = 200
+        self.snapshot = rec.load_features({
+            "feature_matrix": rng.normal(size=(n, 4)),
+            "mbids": np.array([f"T{i}" for i in range(n)]),
+            "years": rng.choice([1985, 1995], size=n),
+            "genre_rosamerica": rng.choice(["roc", "pop"], size=n),
+            "genre_dortmund": rng.choice(["rock", "jazz"], size=n),
+            "feature_names": np.array(["f0", "f1", "f2", "f3"]),
+        })
+
+    def test_cached_result(self):
+        first = rec.recommend("T0", {"k": 5, "exclude_mbids": ["T1", "T2"]})
+        # same request, exclusions in another order with an unknown MBID
+        second = rec.recommend("T0", {"k": 5, "exclude_mbids": ["T2", "missing", "T1", "T2"]})
+
+        self.assertNotIn("cached", first["stats"])
+        self.assertTrue(second["stats"]["cached"])
+        self.assertListEqual(second["top_tracks"], first["top_tracks"])
+        self.assertEqual(rec.result_cache.stats()["hits"], 1)
+
+    def test_options_change_key(self):
+        rec.recommend("T0", {"k": 5})
+        for options in [
+            {"k": 6},
+            {"k": 5, "use_ros": False},
+            {"k": 5, "match_decade": False},
+            {"k": 5, "exclude_mbids": ["T1"]},
+            {"k": 5, "feature_weights": {"f0": 2.0}},
+        ]:
+            self.assertNotIn("cached", rec.recommend("T0", options)["stats"])
+        # weights that resolve to the default vector are the same request
+        self.assertTrue(rec.recommend("T0", {"k": 5, "feature_weights": {"f0": 1.0}})["stats"]["cached"])
+
+    def test_recommend_many_uses_cache(self):
+        single = rec.recommend("T3", {"k": 5})
+        results = rec.recommend_many(["T3", "T4"], {"k": 5})
+        self.assertTrue(results[0]["stats"]["cached"])
+        self.assertListEqual(results[0]["top_tracks"], single["top_tracks"])
+        self.assertNotIn("cached", results[1]["stats"])
+        # the batch result was stored as well
+        self.assertTrue(rec.recommend("T4", {"k": 5})["stats"]["cached"])
+
+    def test_new_snapshot_invalidates(self):
+        rec.recommend("T0", {"k": 5})
+        rec.publish(replace(self.snapshot, version="v2"))
+        self.assertNotIn("cached", rec.recommend("T0", {"k": 5})["stats"])
@@ -0,0 +1,67 @@
+import numpy as np
+from django.test import SimpleTestCase
+from sklearn.metrics.pairwise import cosine_similarity
+from recommend_api.services.scoring import (
+    feature_weights_vector, row_norms, weighted_cosine, weighted_cosine_many, weighted_norms
+)
+
+
+class WeightedCosineTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.matrix = rng.normal(size=(200, 16)).astype(np.float32)
+        self.matrix[5] = 0  # zero vector
+        self.matrix_sq = np.square(self.matrix)
+        self.query = self.matrix[0]
+
+    def test_unweighted_matches_sklearn(self):
+        expected = cosine_similarity(self.query[None, :], self.matrix).flatten()
+        scores = weighted_cosine(self.query, self.matrix, self.matrix_sq)
+        self.assertEqual(scores.dtype, np.float32)
+        np.testing.assert_allclose(scores, expected, atol=1e-5)
+        self.assertEqual(scores[5], 0)
+
+    def test_precomputed_norms(self):
+        norms = row_norms(self.matrix_sq)
+        np.testing.assert_allclose(norms, np.linalg.norm(self.matrix, axis=1), rtol=1e-5)
+        np.testing.assert_allclose(
+            weighted_cosine(self.query, self.matrix, None, candidate_norms=norms),
+            weighted_cosine(self.query, self.matrix, self.matrix_sq),
+        )
+
+    def test_weighted_matches_sklearn(self):
+        weights = np.random.default_rng(1).random(16).astype(np.float32)
+        # the query is weighted like the candidates, a track is fully similar to itself
+        expected = cosine_similarity((self.query * weights)[None, :], self.matrix * weights).flatten()
+        scores = weighted_cosine(self.query, self.matrix, self.matrix_sq, weights=weights)
+        np.testing.assert_allclose(scores, expected, atol=1e-5)
+        self.assertAlmostEqual(scores[0], 1, places=6)
+
+    def test_weighted_norms(self):
+        weights = np.random.default_rng(1).random(16).astype(np.float32)
+        norms = weighted_norms(self.matrix_sq, weights)
+        np.testing.assert_allclose(norms, np.linalg.norm(self.matrix * weights, axis=1), rtol=1e-5)
+        np.testing.assert_array_equal(weighted_norms(self.matrix_sq), row_norms(self.matrix_sq))
+        np.testing.assert_allclose(
+            weighted_cosine(self.query, self.matrix, self.matrix_sq, weights, candidate_norms=norms),
+            weighted_cosine(self.query, self.matrix, self.matrix_sq, weights),
+        )
+
+    def test_feature_weights_vector(self):
+        names = ["danceability", "aggressiveness", "brightness"]
+        self.assertIsNone(feature_weights_vector(names, {}))
+        self.assertIsNone(feature_weights_vector(names, {"brightness": 1}))
+        weights = feature_weights_vector(names, {"aggressiveness": 0.5})
+        self.assertEqual(weights.dtype, np.float32)
+        self.assertListEqual(weights.tolist(), [1, 0.5, 1])
+
+    def test_many_matches_single(self):
+        queries = self.matrix[[0, 1, 5]]
+        weights = np.random.default_rng(2).random(16).astype(np.float32)
+        for w in [None, weights]:
+            scores = weighted_cosine_many(queries, self.matrix, self.matrix_sq, weights=w)
+            self.assertEqual(scores.shape, (3, 200))
+            for i, query in enumerate(queries):
+                np.testing.assert_allclose(
+                    scores[i], weighted_cosine(query, self.matrix, self.matrix_sq, weights=w), atol=1e-6
+                )
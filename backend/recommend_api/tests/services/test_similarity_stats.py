@@ -0,0 +1,37 @@
+import numpy as np
+from django.test import SimpleTestCase
+from recommend_api.services.similarity_stats import RunningStats, exact_stats, sample_stats
+
+
+class SimilarityStatsTests(SimpleTestCase):
+    def test_running_stats_match_exact(self):
+        scores = np.random.default_rng(0).uniform(-1, 1, 50_000).astype(np.float32)
+        running = RunningStats()
+        for start in range(0, len(scores), 4096):
+            running.update(scores[start:start + 4096])
+
+        expected = exact_stats(scores)
+        result = running.result()
+        self.assertEqual(running.count, len(scores))
+        self.assertAlmostEqual(result["mean"], expected["mean"], places=5)
+        self.assertAlmostEqual(result["std"], expected["std"], places=5)
+        self.assertAlmostEqual(result["max"], expected["max"], places=6)
+        self.assertAlmostEqual(result["p95"], expected["p95"], delta=2 / RunningStats.BINS)
+
+    def test_sample_stats(self):
+        scores = np.random.default_rng(0).normal(0.3, 0.2, 200_000).astype(np.float32)
+        expected = exact_stats(scores)
+        result = sample_stats(scores)
+        self.assertAlmostEqual(result["mean"], expected["mean"], delta=0.01)
+        self.assertAlmostEqual(result["std"], expected["std"], delta=0.01)
+        self.assertAlmostEqual(result["p95"], expected["p95"], delta=0.02)
+        self.assertEqual(result["max"], expected["max"])
+        # same scores, same sample
+        self.assertEqual(sample_stats(scores), result)
+        self.assertEqual(sample_stats(scores, max_score=2.0)["max"], 2.0)
+        # small arrays aren't sampled
+        self.assertEqual(sample_stats(scores[:100]), exact_stats(scores[:100]))
+
+    def test_empty(self):
+        self.assertIsNone(RunningStats().result()["p95"])
+        self.assertIsNone(exact_stats(np.empty(0))["mean"])
@@ -0,0 +1,64 @@
+import time
+import numpy as np
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import recommend_api.services.recommender as rec
+from recommend_api.services import timings
+
+
+class TimingsTests(SimpleTestCase):
+    def test_nested_phases(self):
+        with timings.collect() as timer:
+            with timings.phase("outer"):
+                time.sleep(0.01)
+                with timings.phase("inner"):
+                    time.sleep(0.02)
+            with timings.phase("inner"):
+                time.sleep(0.02)
+        # a phase doesn't include the time of its nested phases
+        self.assertListEqual(list(timer.phases), ["outer", "inner"])
+        self.assertGreaterEqual(timer.phases["inner"], 0.04)
+        self.assertLess(timer.phases["outer"], 0.02)
+        self.assertGreaterEqual(timer.total(), sum(timer.phases.values()))
+        self.assertIsNone(timings.current())
+
+    def test_timed(self):
+        @timings.timed("work")
+        def work(x):
+            return x * 2
+
+        # without an active timer the function is just called
+        self.assertEqual(work(2), 4)
+        with timings.collect() as timer:
+            self.assertEqual(work(3), 6)
+            work(4)
+        self.assertListEqual(list(timer.phases), ["work"])
+
+    def test_server_timing(self):
+        timer = timings.PhaseTimer()
+        timer.add("score", 0.0125)
+        timer.add("top_k", 0.001)
+        header = timings.server_timing(timer)
+        self.assertTrue(header.startswith("score;dur=12.500, top_k;dur=1.000, total;dur="))
+
+    def test_recommend(self):
+        # put back the snapshot of the process once the test has published its own
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        rng = np.random.default_rng(0)
+        n = 500
+        rec.load_features({
+            "feature_matrix": rng.random((n, 4)).astype(np.float32),
+            "mbids": np.array([f"T{i}" for i in range(n)]),
+            "years": rng.choice([1985, 1995], size=n),
+            "genre_rosamerica": rng.choice(["roc", "pop"], size=n),
+            "genre_dortmund": rng.choice(["rock", "jazz"], size=n),
+            "feature_names": np.array(["a", "b", "c", "d"]),
+        })
+        with timings.collect() as timer:
+            out = rec.recommend("T0", {"k": 5, "exclude_mbids": ["T1"]})
+        self.assertEqual(len(out['top_tracks']), 5)
+        for name in ["lookup", "exclusions", "candidates", "score", "top_k", "stats", "results"]:
+            self.assertIn(name, timer.phases)
+        self.assertLessEqual(sum(timer.phases.values()), timer.total())
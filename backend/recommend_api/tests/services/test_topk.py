@@ -0,0 +1,39 @@
+import numpy as np
+from django.test import SimpleTestCase
+from recommend_api.services.topk import stream_top_k, top_k
+
+
+class TopKTests(SimpleTestCase):
+    def test_matches_full_sort(self):
+        scores = np.random.default_rng(0).random(1000).astype(np.float32)
+        expected = np.argsort(-scores, kind="stable")[:25]
+        self.assertListEqual(top_k(scores, 25).tolist(), expected.tolist())
+
+    def test_ties_keep_candidate_order(self):
+        scores = np.array([0.5, 0.9, 0.5, 0.5, 0.1, 0.5])
+        self.assertListEqual(top_k(scores, 3).tolist(), [1, 0, 2])
+        self.assertListEqual(top_k(scores, 6).tolist(), [1, 0, 2, 3, 5, 4])
+
+    def test_tiebreak(self):
+        scores = np.array([0.5, 0.5, 0.5])
+        tiebreak = np.array([30, 10, 20])
+        self.assertListEqual(top_k(scores, 2, tiebreak=tiebreak).tolist(), [1, 2])
+
+    def test_k_out_of_range(self):
+        scores = np.array([0.1, 0.3, 0.2])
+        self.assertListEqual(top_k(scores, 10).tolist(), [1, 2, 0])
+        self.assertEqual(top_k(scores, 0).size, 0)
+        self.assertEqual(top_k(np.empty(0), 5).size, 0)
+
+    def test_stream_matches_top_k(self):
+        # rounded scores so there are plenty of ties across blocks
+        scores = np.round(np.random.default_rng(1).random(10_000), 2)
+        expected = top_k(scores, 100)
+
+        blocks = (
+            (np.arange(start, start + 1000), scores[start:start + 1000])
+            for start in range(0, len(scores), 1000)
+        )
+        rows, block_scores = stream_top_k(blocks, 100)
+        self.assertListEqual(rows.tolist(), expected.tolist())
+        self.assertTrue(np.array_equal(block_scores, scores[expected]))
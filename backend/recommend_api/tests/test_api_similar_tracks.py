@@ -1,6 +1,9 @@
+import numpy as np
+from django.conf import settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from unittest.mock import patch
+import recommend_api.services.recommender as rec
 from recommend_api.models import Album, Artist, Track
 from recommend_api.tests.factories import ArtistFactory, AlbumFactory, TrackFactory
 
@@ -46,3 +49,117 @@ class SimilarTracksAPITests(APITestCase):
         self.assertIn("target_track", resp.data)
         self.assertIn("similar_list", resp.data)
         self.assertIn("stats", resp.data)
+
+    def test_default_options_without_optional_arrays(self):
+        # a legacy feature file: no artist index to diversify, no popularity to blend
+        self.enterContext(patch.object(rec, "_snapshot", rec._snapshot))
+        self.enterContext(patch.object(rec, "_watched_directory", rec._watched_directory))
+        self.enterContext(patch.object(rec.result_cache, "max_bytes", 0))
+        rec.load_features({
+            "feature_matrix": np.array([[1.0, 0.0], [0.9, 0.1], [0.2, 1.0]], dtype=np.float32),
+            "mbids": np.array(["A", "B", "C"]),
+            "years": np.array([1991, 1992, 1994]),
+            "genre_rosamerica": np.array(["roc", "roc", "roc"]),
+            "genre_dortmund": np.array(["rock", "rock", "rock"]),
+            "feature_names": np.array(["danceability", "brightness"]),
+        })
+        url = reverse("api:recommend")
+        with self.assertLogs(rec.log, "WARNING"):
+            resp = self.client.post(url, {"mbid": "A"}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertListEqual([t["mbid"] for t in resp.data["similar_list"]], ["B", "C"])
+
+    @patch("recommend_api.api.rec.recommend_many")
+    def test_batch_response_signature(self, mock_rec):
+        mock_rec.return_value = [self.recommend_response, self.recommend_response]
+        url = reverse("api:recommend-batch")
+        resp = self.client.post(url, {"mbids": ["A", "B"], "limit": 1}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.data["results"]), 2)
+        self.assertEqual(resp.data["results"][0]["target_track"]["mbid"], "A")
+        self.assertEqual(resp.data["results"][1]["target_track"]["mbid"], "B")
+        # the recommender picks `limit` tracks, one per artist
+        options = mock_rec.call_args.kwargs["options"]
+        self.assertEqual(options["k"], 1)
+        self.assertTrue(options["diversify"])
+        self.assertEqual(len(resp.data["results"][0]["similar_list"]), 2)
+        self.assertIn("stats", resp.data["results"][0])
+
+    @patch("recommend_api.api.rec.recommend_many")
+    def test_batch_unknown_target(self, mock_rec):
+        url = reverse("api:recommend-batch")
+        resp = self.client.post(url, {"mbids": ["A", "missing"]}, format="json")
+        self.assertEqual(resp.status_code, 404)
+        mock_rec.assert_not_called()
+
+    @patch("recommend_api.api.rec.recommend")
+    def test_timings(self, mock_rec):
+        mock_rec.return_value = self.recommend_response
+        url = reverse("api:recommend")
+        resp = self.client.post(url, {"mbid": "A"}, format="json")
+        self.assertIn("target;dur=", resp["Server-Timing"])
+        self.assertIn("total;dur=", resp["Server-Timing"])
+        self.assertNotIn("timings", resp.data["stats"])
+
+        resp = self.client.post(url, {"mbid": "A", "debug_timings": True}, format="json")
+        self.assertListEqual(
+            list(resp.data["stats"]["timings"]),
+            ["validate", "target", "recommend", "hydrate", "serialize"],
+        )
+        # the recommender's result isn't changed
+        self.assertNotIn("timings", self.recommend_response["stats"])
+
+    @patch("recommend_api.api.rec.recommend")
+    def test_budget(self, mock_rec):
+        mock_rec.return_value = self.recommend_response
+        url = reverse("api:recommend")
+        self.client.post(url, {"mbid": "A"}, format="json")
+        self.assertEqual(
+            mock_rec.call_args.kwargs["options"]["budget_ms"],
+            settings.RECOMMENDER_LATENCY_BUDGET_MS,
+        )
+        # opt-in, requests have no budget unless the setting is set
+        with self.settings(RECOMMENDER_LATENCY_BUDGET_MS=None):
+            self.client.post(url, {"mbid": "A"}, format="json")
+        self.assertIsNone(mock_rec.call_args.kwargs["options"]["budget_ms"])
+        self.client.post(url, {"mbid": "A", "budget_ms": 20}, format="json")
+        self.assertEqual(mock_rec.call_args.kwargs["options"]["budget_ms"], 20)
+
+    @patch("recommend_api.api.rec.recommend")
+    def test_dislikes(self, mock_rec):
+        mock_rec.return_value = self.recommend_response
+        url = reverse("api:recommend")
+        resp = self.client.post(
+            url, {"mbid": "A", "disliked_mbids": ["B", "C"], "dislike_weight": 0.8}, format="json"
+        )
+        self.assertEqual(resp.status_code, 200)
+        options = mock_rec.call_args.kwargs["options"]
+        self.assertListEqual(options["disliked_mbids"], ["B", "C"])
+        self.assertEqual(options["dislike_weight"], 0.8)
+        # the recommender returns `limit` tracks, nothing is fetched to make up for the penalty
+        self.assertEqual(options["k"], 10)
+
+        resp = self.client.post(url, {"mbid": "A", "dislike_weight": 2}, format="json")
+        self.assertEqual(resp.status_code, 400)
+
+    @patch("recommend_api.api.rec.recommend_profile")
+    def test_profile_response_signature(self, mock_rec):
+        mock_rec.return_value = self.recommend_response
+        url = reverse("api:recommend-profile")
+        resp = self.client.post(
+            url, {"seed_mbids": ["A", "B"], "seed_weights": [1, 2], "profile": "max"},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertListEqual([t["mbid"] for t in resp.data["seed_tracks"]], ["A", "B"])
+        self.assertEqual(len(resp.data["similar_list"]), 2)
+        self.assertListEqual(mock_rec.call_args.kwargs["seed_weights"], [1, 2])
+        self.assertEqual(mock_rec.call_args.kwargs["options"]["profile"], "max")
+
+        # one weight per seed
+        resp = self.client.post(
+            url, {"seed_mbids": ["A", "B"], "seed_weights": [1]}, format="json"
+        )
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.post(url, {"seed_mbids": ["A", "missing"]}, format="json")
+        self.assertEqual(resp.status_code, 404)
@@ -17,6 +17,9 @@ urlpatterns = [
     path("api/v1/", include(router.urls)),
     path("api/v1/genres/", api.GenreView.as_view(), name="genre-list"),
     path("api/v1/recommend/", api.RecommendView.as_view(), name="recommend"),
+    path("api/v1/recommend/batch/", api.RecommendBatchView.as_view(), name="recommend-batch"),
+    path("api/v1/recommend/profile/", api.RecommendProfileView.as_view(), name="recommend-profile"),
+    path("api/v1/recommend/cache/", api.RecommendCacheView.as_view(), name="recommend-cache"),
     path("api/v1/search/", api.SearchView.as_view(), name="search"),
     path("api/v1/schema/", SpectacularAPIView.as_view(), name="schema"),
     path("api/v1/swagger-ui/", SpectacularSwaggerView.as_view(url_name="api:schema"), name="swagger-ui"),